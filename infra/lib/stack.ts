@@ -1,5 +1,7 @@
 import * as cdk from "aws-cdk-lib";
 import * as budgets from "aws-cdk-lib/aws-budgets";
+import * as events from "aws-cdk-lib/aws-events";
+import * as eventsTargets from "aws-cdk-lib/aws-events-targets";
 import * as iam from "aws-cdk-lib/aws-iam";
 import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as logs from "aws-cdk-lib/aws-logs";
@@ -33,6 +35,11 @@ export class HsaReceiptArchiverStack extends cdk.Stack {
                     prefix: "raw-emails/",
                     expiration: cdk.Duration.days(30),
                 },
+                {
+                    // Entries expire logically after ELIGIBILITY_CACHE_TTL_DAYS (30); this reclaims the objects.
+                    prefix: "eligibility-cache/",
+                    expiration: cdk.Duration.days(31),
+                },
             ],
         });
 
@@ -90,7 +97,7 @@ export class HsaReceiptArchiverStack extends cdk.Stack {
 
         handler.addToRolePolicy(
             new iam.PolicyStatement({
-                actions: ["ssm:GetParameter"],
+                actions: ["ssm:GetParameters"],
                 resources: [
                     cdk.Arn.format(
                         {
@@ -106,6 +113,26 @@ export class HsaReceiptArchiverStack extends cdk.Stack {
 
         notificationTopic.grantPublish(handler);
 
+        // Nightly rebuild of the merged ledger view from the per-year partitions
+        new events.Rule(this, "RebuildLedgerSchedule", {
+            schedule: events.Schedule.cron({ hour: "7", minute: "0" }),
+            targets: [
+                new eventsTargets.LambdaFunction(handler, {
+                    event: events.RuleTargetInput.fromObject({ action: "rebuild-ledger" }),
+                }),
+            ],
+        });
+
+        // Nightly re-conversion of receipts stored without PDF/A after a conversion timeout
+        new events.Rule(this, "UpgradePendingPdfaSchedule", {
+            schedule: events.Schedule.cron({ hour: "7", minute: "30" }),
+            targets: [
+                new eventsTargets.LambdaFunction(handler, {
+                    event: events.RuleTargetInput.fromObject({ action: "upgrade-pending-pdfa" }),
+                }),
+            ],
+        });
+
         // SES Receipt Rule Set + Rule
         const ruleSet = new ses.ReceiptRuleSet(this, "ReceiptRuleSet", {
             receiptRuleSetName: "hsa-receipt-archiver",
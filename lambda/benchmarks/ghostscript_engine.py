@@ -0,0 +1,56 @@
+"""Compare per-conversion latency of the subprocess and persistent Ghostscript engines.
+
+Needs a real Ghostscript binary:
+
+    GS_BINARY=$(which gs) python benchmarks/ghostscript_engine.py [conversions]
+"""
+
+import io
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from hsa_receipt_archiver import pdf_converter
+
+
+def _receipt_pdf() -> bytes:
+    """A one-page, receipt-sized PDF: the small-document case where gs startup dominates."""
+    img = Image.new("RGB", (850, 1100), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(["Family Pharmacy", "2025-01-15", "Amoxicillin 500mg", "Total due $30.00"]):
+        draw.text((60, 60 + 40 * i), line, fill="black")
+    buf = io.BytesIO()
+    img.save(buf, "PDF", resolution=100.0)
+    return buf.getvalue()
+
+
+def _time_conversions(engine: str, data: bytes, conversions: int) -> list[float]:
+    timings = []
+    with patch.object(pdf_converter, "GS_ENGINE", engine):
+        for _ in range(conversions):
+            start = time.perf_counter()
+            pdf_converter.convert_to_pdfa(data, "application/pdf")
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> None:
+    conversions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data = _receipt_pdf()
+
+    for engine in ("subprocess", "persistent"):
+        timings = _time_conversions(engine, data, conversions)
+        # The first persistent conversion includes the worker's startup; report it separately.
+        first, rest = timings[0], sorted(timings[1:])
+        p95 = rest[int(len(rest) * 0.95) - 1]
+        print(
+            f"{engine:>10}: first={first:7.1f}ms median={statistics.median(rest):7.1f}ms "
+            f"p95={p95:7.1f}ms (n={conversions})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Report conversion time and output bytes for each GS_PROFILE over a sample corpus.
+
+    GS_BINARY=$(which gs) python benchmarks/gs_profiles.py [corpus_dir]
+
+The corpus directory may hold .pdf, .jpg, .jpeg and .png files; without one a few synthetic
+receipts are used. Each profile runs in a fresh interpreter because profiles are read at
+import. If veraPDF is on PATH, every output is also validated against PDF/A-2b.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+_CHILD = """
+import io, json, shutil, subprocess, sys, tempfile, time
+from pathlib import Path
+from PIL import Image, ImageDraw
+from hsa_receipt_archiver.pdf_converter import convert_to_pdfa
+
+TYPES = {".pdf": "application/pdf", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+def synthetic():
+    for name, color, ink in (("paper", (250, 240, 225), "black"), ("logo", "white", (30, 60, 200))):
+        img = Image.new("RGB", (2400, 3200), color)
+        draw = ImageDraw.Draw(img)
+        for line in range(60):
+            draw.text((120, 120 + 48 * line), f"Item {line:02d}  Copay  $25.00", fill=ink)
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        yield name, buf.getvalue(), "image/jpeg"
+
+def corpus(directory):
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in TYPES:
+            yield path.name, path.read_bytes(), TYPES[path.suffix.lower()]
+
+samples = list(corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic())
+verapdf = shutil.which("verapdf")
+seconds, size, invalid = 0.0, 0, 0
+for name, data, content_type in samples:
+    start = time.perf_counter()
+    pdf = convert_to_pdfa(data, content_type)
+    seconds += time.perf_counter() - start
+    size += len(pdf)
+    if verapdf:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+            f.write(pdf)
+            f.flush()
+            report = subprocess.run([verapdf, "--flavour", "2b", f.name], capture_output=True, text=True).stdout
+            invalid += 'isCompliant="true"' not in report
+
+print(json.dumps({"files": len(samples), "seconds": seconds, "bytes": size, "invalid": invalid if verapdf else None}))
+"""
+
+
+def main() -> None:
+    for profile in ("fast", "balanced", "compact"):
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD, *sys.argv[1:]],
+            env={**os.environ, "GS_PROFILE": profile},
+            capture_output=True,
+            check=True,
+        ).stdout
+        stats = json.loads(out)
+        validity = "not checked" if stats["invalid"] is None else f"{stats['invalid']} not PDF/A-2b"
+        print(
+            f"{profile:>8}: {stats['files']} files, {stats['seconds']:6.2f}s, {stats['bytes'] / 1e6:7.2f}MB, {validity}"
+        )
+
+
+if __name__ == "__main__":
+    main()
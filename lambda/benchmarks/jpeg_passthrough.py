@@ -0,0 +1,65 @@
+"""Compare wrapping JPEGs via Pillow (decode + re-encode) against the lossless DCTDecode passthrough.
+
+    python benchmarks/jpeg_passthrough.py [photo_dir]
+
+Without a directory a few synthetic 12 MP photos are used. Set GS_BINARY to a real Ghostscript
+to also time the full convert_to_pdfa for each path.
+"""
+
+import io
+import os
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+from unittest.mock import patch
+
+from PIL import Image
+
+from hsa_receipt_archiver import pdf_converter
+from hsa_receipt_archiver.jpeg_pdf import jpeg_to_pdf
+
+
+def _pillow_wrap(data: bytes) -> bytes:
+    buf = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(buf, "PDF", resolution=300.0)
+    return buf.getvalue()
+
+
+def _corpus() -> list[bytes]:
+    if len(sys.argv) > 1:
+        return [p.read_bytes() for p in sorted(Path(sys.argv[1]).iterdir()) if p.suffix.lower() in (".jpg", ".jpeg")]
+    photos = []
+    for seed in range(3):
+        img = Image.effect_noise((4032, 3024), 24 + 8 * seed).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=92)
+        photos.append(buf.getvalue())
+    return photos
+
+
+def _measure(name: str, corpus: list[bytes], fn: Callable[[bytes], bytes | None]) -> None:
+    timings, sizes = [], []
+    for data in corpus:
+        start = time.perf_counter()
+        out = fn(data)
+        timings.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(out or b""))
+    print(f"{name:>24}: median={statistics.median(timings):8.1f}ms total_size={sum(sizes) / 1e6:7.2f}MB")
+
+
+def main() -> None:
+    corpus = _corpus()
+    print(f"{len(corpus)} photos, {sum(map(len, corpus)) / 1e6:.2f}MB of JPEG")
+    _measure("pillow wrap", corpus, _pillow_wrap)
+    _measure("dctdecode passthrough", corpus, jpeg_to_pdf)
+
+    if os.environ.get("GS_BINARY"):
+        with patch.object(pdf_converter, "jpeg_to_pdf", return_value=None):
+            _measure("convert_to_pdfa (pillow)", corpus, lambda d: pdf_converter.convert_to_pdfa(d, "image/jpeg"))
+        _measure("convert_to_pdfa (passthru)", corpus, lambda d: pdf_converter.convert_to_pdfa(d, "image/jpeg"))
+
+
+if __name__ == "__main__":
+    main()
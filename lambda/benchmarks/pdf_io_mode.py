@@ -0,0 +1,56 @@
+"""Compare wall time and peak RSS of the pipe and tempfile GS_IO_MODEs.
+
+Each mode runs in a fresh interpreter so peak RSS isn't shared between them. Needs a real
+Ghostscript binary:
+
+    GS_BINARY=$(which gs) python benchmarks/pdf_io_mode.py [conversions]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+_CHILD = """
+import io, json, os, resource, statistics, sys, time
+from PIL import Image
+from hsa_receipt_archiver.pdf_converter import convert_to_pdfa
+
+img = Image.effect_noise((4032, 3024), 64).convert("RGB")
+buf = io.BytesIO()
+img.save(buf, "JPEG", quality=90)
+photo = buf.getvalue()
+del img, buf
+
+timings = []
+for _ in range(int(sys.argv[1])):
+    start = time.perf_counter()
+    convert_to_pdfa(photo, "image/jpeg")
+    timings.append((time.perf_counter() - start) * 1000)
+
+print(json.dumps({
+    "median_ms": statistics.median(timings),
+    "self_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "gs_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+}))
+"""
+
+
+def main() -> None:
+    conversions = sys.argv[1] if len(sys.argv) > 1 else "5"
+    for mode in ("tempfile", "pipe"):
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD, conversions],
+            env={**os.environ, "GS_IO_MODE": mode, "GS_ENGINE": "subprocess"},
+            capture_output=True,
+            check=True,
+        ).stdout
+        stats = json.loads(out)
+        print(
+            f"{mode:>8}: median={stats['median_ms']:7.1f}ms python_peak_rss={stats['self_rss_mb']:6.1f}MB "
+            f"gs_peak_rss={stats['gs_rss_mb']:6.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
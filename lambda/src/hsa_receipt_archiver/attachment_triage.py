@@ -0,0 +1,70 @@
+"""Drop attachments that can't be receipts before they reach Claude."""
+
+import io
+import logging
+import os
+
+from hsa_receipt_archiver.email_parser import Attachment
+
+logger = logging.getLogger(__name__)
+
+# Tracking pixels and spacer images are a few hundred bytes; even a text-only PDF receipt is larger.
+MIN_ATTACHMENT_BYTES = int(os.environ.get("MIN_ATTACHMENT_BYTES", "1024"))
+# Images whose shorter edge is below this many pixels (logos, icons, banners) can't hold a legible receipt.
+MIN_IMAGE_DIMENSION = int(os.environ.get("MIN_IMAGE_DIMENSION", "100"))
+# Inline images (those with a Content-ID) smaller than this are taken to be signature logos.
+MAX_INLINE_IMAGE_BYTES = int(os.environ.get("MAX_INLINE_IMAGE_BYTES", "20480"))
+
+
+def triage_attachments(attachments: list[Attachment]) -> list[Attachment]:
+    """Return the attachments worth checking, in order, logging why each of the others was skipped."""
+    kept: list[Attachment] = []
+    seen: dict[bytes, str] = {}
+    for attachment in attachments:
+        reason = _skip_reason(attachment, seen)
+        if reason is None:
+            kept.append(attachment)
+        else:
+            logger.info(
+                "Skipping attachment %s (%s, %d bytes): %s",
+                attachment.filename,
+                attachment.content_type,
+                len(attachment.data),
+                reason,
+            )
+    return kept
+
+
+def _skip_reason(attachment: Attachment, seen: dict[bytes, str]) -> str | None:
+    """Why an attachment should be skipped, or None to keep it. Records kept attachments in seen by hash."""
+    size = len(attachment.data)
+    if size < MIN_ATTACHMENT_BYTES:
+        return f"smaller than {MIN_ATTACHMENT_BYTES} bytes"
+
+    is_image = attachment.content_type.startswith("image/")
+    if is_image and attachment.content_id and size < MAX_INLINE_IMAGE_BYTES:
+        return f"inline image smaller than {MAX_INLINE_IMAGE_BYTES} bytes"
+
+    digest = attachment.sha256
+    if digest in seen:
+        return f"duplicate of {seen[digest]}"
+
+    if is_image:
+        dimensions = _image_dimensions(attachment.data)
+        if dimensions is not None and min(dimensions) < MIN_IMAGE_DIMENSION:
+            width, height = dimensions
+            return f"{width}x{height} pixels is below {MIN_IMAGE_DIMENSION}px"
+
+    seen[digest] = attachment.filename
+    return None
+
+
+def _image_dimensions(data: bytes) -> tuple[int, int] | None:
+    """Width and height from the image header, or None if Pillow can't read it."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.size
+    except (UnidentifiedImageError, OSError):
+        return None
@@ -0,0 +1,70 @@
+"""Shared boto3 clients, created on first use rather than at import."""
+
+import os
+import threading
+from typing import Any
+
+# One pooled connection per attachment worker thread plus the handler's own thread. Reads the
+# same setting as handler.MAX_ATTACHMENT_WORKERS.
+AWS_MAX_POOL_CONNECTIONS = int(
+    os.environ.get("AWS_MAX_POOL_CONNECTIONS", str(int(os.environ.get("MAX_ATTACHMENT_WORKERS", "4")) + 1))
+)
+# Short timeouts so a stalled connection is retried well inside the Lambda deadline, instead of
+# botocore's 60s defaults.
+AWS_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("AWS_CONNECT_TIMEOUT_SECONDS", "3"))
+AWS_READ_TIMEOUT_SECONDS = float(os.environ.get("AWS_READ_TIMEOUT_SECONDS", "15"))
+# Same names and meaning as botocore's own settings, but with adaptive retries (client-side rate
+# limiting when throttled) as the default.
+AWS_RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "4"))
+AWS_TCP_KEEPALIVE = os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+_clients: dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service: str) -> Any:
+    """Return the shared client for an AWS service, creating it on first use with client_config().
+
+    boto3 clients are thread-safe, so one per service is shared by every thread.
+    """
+    client = _clients.get(service)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service)
+            if client is None:
+                import boto3
+
+                client = boto3.client(service, config=client_config())
+                _clients[service] = client
+    return client
+
+
+def client_config() -> Any:
+    """The botocore Config shared by every client."""
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=AWS_READ_TIMEOUT_SECONDS,
+        retries={"mode": AWS_RETRY_MODE, "max_attempts": AWS_MAX_ATTEMPTS},
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+    )
+
+
+class LazyClient:
+    """Stands in for a boto3 client at module level, creating the shared client on first use.
+
+    Modules keep a `CLIENT = LazyClient("s3")` global, so call sites and the tests that patch
+    those globals are unchanged, but nothing is created until a call is made.
+    """
+
+    def __init__(self, service: str) -> None:
+        self._service = service
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_client(self._service), name)
+
+    def __repr__(self) -> str:
+        return f"LazyClient({self._service!r})"
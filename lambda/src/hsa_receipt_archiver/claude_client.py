@@ -1,20 +1,28 @@
 """Claude API client for HSA eligibility determination."""
 
 import base64
+import hashlib
 import json
 import logging
+import os
+import re
+import threading
+import time
 from dataclasses import dataclass
-from typing import Literal, cast, get_args
-
-import anthropic
-from anthropic.types import (
-    Base64ImageSourceParam,
-    Base64PDFSourceParam,
-    DocumentBlockParam,
-    ImageBlockParam,
-    TextBlock,
-    TextBlockParam,
+from typing import TYPE_CHECKING, Any, Literal, cast, get_args
+
+from hsa_receipt_archiver.image_preprocessor import (
+    MODEL_IMAGE_JPEG_QUALITY,
+    MODEL_IMAGE_MAX_EDGE,
+    prepare_image_for_model,
 )
+from hsa_receipt_archiver.pdf_converter import extract_pdf_text
+
+# The SDK takes over a second to import, so it is imported on the first Claude call rather than
+# at cold start; its request types are TypedDicts, which are plain dicts at runtime.
+if TYPE_CHECKING:
+    import anthropic
+    from anthropic.types import DocumentBlockParam, ImageBlockParam, TextBlockParam
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +52,54 @@ If the document contains only one transaction, still return a JSON array with on
 
 Respond ONLY with the JSON array, no other text."""
 
+USER_PROMPT = (
+    "Please analyze this receipt or statement for HSA eligibility. Extract each out-of-pocket transaction separately."
+)
+
+MULTIPAGE_USER_PROMPT = (
+    "These images are consecutive pages of one receipt or statement, in page order. Please analyze them "
+    "together for HSA eligibility. Extract each out-of-pocket transaction separately, and list a "
+    "transaction only once even if it appears on several pages."
+)
+
+# Wraps the text layer of a PDF sent as text instead of as a document.
+PDF_TEXT_PROMPT = "The receipt or statement is a PDF. Its extracted text follows.\n\n<document>\n{text}\n</document>"
+
+MODEL = "claude-haiku-4-5-20251001"
+
+# HTTP connection pool settings for the shared client, which is reused across warm invocations.
+ANTHROPIC_MAX_CONNECTIONS = int(os.environ.get("ANTHROPIC_MAX_CONNECTIONS", "10"))
+ANTHROPIC_KEEPALIVE_SECONDS = float(os.environ.get("ANTHROPIC_KEEPALIVE_SECONDS", "300"))
+ANTHROPIC_TIMEOUT_SECONDS = float(os.environ.get("ANTHROPIC_TIMEOUT_SECONDS", "120"))
+ANTHROPIC_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("ANTHROPIC_CONNECT_TIMEOUT_SECONDS", "5"))
+
+# A PDF whose text layer has at least this many characters is sent as text instead of as a document.
+PDF_TEXT_MIN_CHARS = int(os.environ.get("PDF_TEXT_MIN_CHARS", "200"))
+
+# Changes whenever anything that shapes what the model sees changes: the model, the prompts, when a
+# PDF is sent as text, or how images are shrunk. Cached results from an older setup are not reused.
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join(
+        [
+            MODEL,
+            SYSTEM_PROMPT,
+            USER_PROMPT,
+            MULTIPAGE_USER_PROMPT,
+            PDF_TEXT_PROMPT,
+            str(PDF_TEXT_MIN_CHARS),
+            str(MODEL_IMAGE_MAX_EDGE),
+            str(MODEL_IMAGE_JPEG_QUALITY),
+        ]
+    ).encode()
+).hexdigest()[:16]
+
+# Rough token costs used to log the savings of the text fast path. A PDF document block is billed
+# as a rendered image per page plus the page's text.
+_TOKENS_PER_PDF_PAGE_IMAGE = 1500
+_CHARS_PER_TOKEN = 4
+
+_PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
 ImageMediaType = Literal["image/jpeg", "image/png", "image/gif", "image/webp"]
 IMAGE_CONTENT_TYPES: frozenset[str] = frozenset(get_args(ImageMediaType))
 
@@ -61,48 +117,159 @@ class EligibilityResult:
     reasoning: str
 
 
+_clients: dict[str, "anthropic.Anthropic"] = {}
+_clients_lock = threading.Lock()
+
+# Per-thread time spent opening TCP connections and TLS sessions during the current call.
+_connection_setup = threading.local()
+_CONNECTION_SETUP_EVENTS = frozenset({"connection.connect_tcp", "connection.start_tls"})
+
+
+def _get_client(api_key: str) -> "anthropic.Anthropic":
+    """Return the shared client for an API key, creating it on first use.
+
+    Clients for other (rotated-out) keys are dropped but not closed, since another thread may
+    still be mid-request on one; their connections are closed once they are garbage collected.
+    """
+    import anthropic
+
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            _clients.clear()
+            client = anthropic.Anthropic(api_key=api_key, http_client=_build_http_client())
+            _clients[api_key] = client
+            logger.info("Created Anthropic client (max_connections=%d)", ANTHROPIC_MAX_CONNECTIONS)
+    return client
+
+
+def _build_http_client() -> "anthropic.DefaultHttpxClient":
+    import anthropic
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=ANTHROPIC_MAX_CONNECTIONS,
+        max_keepalive_connections=ANTHROPIC_MAX_CONNECTIONS,
+        keepalive_expiry=ANTHROPIC_KEEPALIVE_SECONDS,
+    )
+    return anthropic.DefaultHttpxClient(
+        limits=limits,
+        timeout=anthropic.Timeout(ANTHROPIC_TIMEOUT_SECONDS, connect=ANTHROPIC_CONNECT_TIMEOUT_SECONDS),
+        event_hooks={"request": [_trace_connection_setup]},
+    )
+
+
+def _trace_connection_setup(request: Any) -> None:
+    request.extensions["trace"] = _record_connection_event
+
+
+def _record_connection_event(event_name: str, info: dict[str, Any]) -> None:
+    """Accumulate TCP connect and TLS handshake time reported by the HTTP transport."""
+    stage, _, phase = event_name.rpartition(".")
+    if stage not in _CONNECTION_SETUP_EVENTS:
+        return
+    if phase == "started":
+        _connection_setup.started = time.perf_counter()
+    elif phase == "complete":
+        now = time.perf_counter()
+        started = getattr(_connection_setup, "started", now)
+        _connection_setup.seconds = getattr(_connection_setup, "seconds", 0.0) + now - started
+        if stage == "connection.connect_tcp":
+            _connection_setup.connections = getattr(_connection_setup, "connections", 0) + 1
+
+
 def check_hsa_eligibility(api_key: str, attachment_data: bytes, content_type: str) -> list[EligibilityResult]:
     """Send a receipt to Claude and determine HSA eligibility.
 
     Returns a list of results — one per transaction found in the document.
     Supports both images and PDFs.
     """
-    client = anthropic.Anthropic(api_key=api_key)
+    if content_type in IMAGE_CONTENT_TYPES:
+        # Only the model payload is shrunk; the archived PDF is built from the original bytes.
+        attachment_data, content_type = prepare_image_for_model(attachment_data, content_type)
 
-    data_b64 = base64.standard_b64encode(attachment_data).decode("ascii")
+    pdf_text = _usable_pdf_text(attachment_data) if content_type == "application/pdf" else None
 
-    content_block: ImageBlockParam | DocumentBlockParam
-    if content_type in IMAGE_CONTENT_TYPES:
-        content_block = ImageBlockParam(
-            type="image",
-            source=Base64ImageSourceParam(
-                type="base64",
-                media_type=cast(ImageMediaType, content_type),
-                data=data_b64,
-            ),
-        )
+    content_block: ImageBlockParam | DocumentBlockParam | TextBlockParam
+    if pdf_text is not None:
+        content_block = {"type": "text", "text": PDF_TEXT_PROMPT.format(text=pdf_text)}
+    elif content_type in IMAGE_CONTENT_TYPES:
+        content_block = _image_block(attachment_data, content_type)
     else:
-        content_block = DocumentBlockParam(
-            type="document",
-            source=Base64PDFSourceParam(type="base64", media_type="application/pdf", data=data_b64),
-        )
-
-    prompt = TextBlockParam(
-        type="text",
-        text="Please analyze this receipt or statement for HSA eligibility."
-        " Extract each out-of-pocket transaction separately.",
-    )
+        data_b64 = base64.standard_b64encode(attachment_data).decode("ascii")
+        content_block = {
+            "type": "document",
+            "source": {"type": "base64", "media_type": "application/pdf", "data": data_b64},
+        }
 
     logger.info("Calling Claude API: content_type=%s, data_size=%d bytes", content_type, len(attachment_data))
+    response_text, input_tokens = _create_message(api_key, [content_block], USER_PROMPT)
+
+    if pdf_text is not None:
+        _log_text_fast_path_savings(attachment_data, pdf_text, input_tokens)
+
+    return _parse_results(response_text)
+
+
+def check_multipage_eligibility(api_key: str, pages: list[tuple[bytes, str]]) -> list[EligibilityResult]:
+    """Send the images of a multi-page document to Claude in one request.
+
+    Pages are (data, content_type) pairs in page order. Returns one result per transaction
+    across the whole document.
+    """
+    blocks: list[ImageBlockParam | DocumentBlockParam | TextBlockParam] = []
+    total_size = 0
+    for data, content_type in pages:
+        data, content_type = prepare_image_for_model(data, content_type)
+        blocks.append(_image_block(data, content_type))
+        total_size += len(data)
+
+    logger.info("Calling Claude API: pages=%d, data_size=%d bytes", len(pages), total_size)
+    response_text, _ = _create_message(api_key, blocks, MULTIPAGE_USER_PROMPT)
+    return _parse_results(response_text)
+
+
+def _image_block(data: bytes, content_type: str) -> "ImageBlockParam":
+    data_b64 = base64.standard_b64encode(data).decode("ascii")
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": cast(ImageMediaType, content_type),
+            "data": data_b64,
+        },
+    }
 
+
+def _create_message(
+    api_key: str, content: list["ImageBlockParam | DocumentBlockParam | TextBlockParam"], user_prompt: str
+) -> tuple[str, int]:
+    """Send the document blocks plus the prompt. Returns the response text and input token count."""
+    from anthropic.types import TextBlock
+
+    client = _get_client(api_key)
+    prompt: TextBlockParam = {"type": "text", "text": user_prompt}
+
+    _connection_setup.seconds = 0.0
+    _connection_setup.connections = 0
+    started = time.perf_counter()
     response = client.messages.create(
-        model="claude-haiku-4-5-20251001",
+        model=MODEL,
         max_tokens=4096,
         system=SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": [content_block, prompt]}],
+        messages=[{"role": "user", "content": [*content, prompt]}],
     )
+    elapsed = time.perf_counter() - started
 
-    logger.info("Claude API returned: stop_reason=%s, content_blocks=%d", response.stop_reason, len(response.content))
+    logger.info(
+        "Claude API returned: stop_reason=%s, content_blocks=%d, elapsed_ms=%.0f, "
+        "new_connections=%d, connection_setup_ms=%.0f",
+        response.stop_reason,
+        len(response.content),
+        elapsed * 1000,
+        _connection_setup.connections,
+        _connection_setup.seconds * 1000,
+    )
 
     response_text = ""
     for block in response.content:
@@ -116,6 +283,10 @@ def check_hsa_eligibility(api_key: str, attachment_data: bytes, content_type: st
         logger.error("Claude returned empty response. Stop reason: %s", response.stop_reason)
         raise ValueError("Claude returned an empty response")
 
+    return response_text, response.usage.input_tokens
+
+
+def _parse_results(response_text: str) -> list[EligibilityResult]:
     # Strip markdown code fences if present
     stripped = response_text.strip()
     if stripped.startswith("```"):
@@ -154,3 +325,40 @@ def check_hsa_eligibility(api_key: str, attachment_data: bytes, content_type: st
         )
 
     return results
+
+
+def _usable_pdf_text(pdf_data: bytes) -> str | None:
+    """Return the PDF's text layer if it is substantial enough to send instead of the PDF."""
+    try:
+        text = extract_pdf_text(pdf_data).strip()
+    except Exception:
+        logger.warning("PDF text extraction failed; sending the document", exc_info=True)
+        return None
+
+    # Broken font encodings produce plenty of characters but few letters or digits.
+    alnum = sum(ch.isalnum() for ch in text)
+    if alnum < PDF_TEXT_MIN_CHARS:
+        logger.info("PDF text layer too small (%d alphanumeric chars); sending the document", alnum)
+        return None
+    return text
+
+
+def _log_text_fast_path_savings(pdf_data: bytes, pdf_text: str, input_tokens: int) -> None:
+    """Log the text request's input tokens next to an estimate for sending the PDF as a document.
+
+    input_tokens covers the whole request, system and user prompts included. The estimate swaps
+    only the text block for a document block, so it covers the same request and the two compare.
+    """
+    pages = max(1, len(_PDF_PAGE_RE.findall(pdf_data)))
+    estimated_text_block_tokens = len(PDF_TEXT_PROMPT.format(text=pdf_text)) // _CHARS_PER_TOKEN
+    estimated_document_block_tokens = pages * _TOKENS_PER_PDF_PAGE_IMAGE + len(pdf_text) // _CHARS_PER_TOKEN
+    estimated_document_input_tokens = input_tokens - estimated_text_block_tokens + estimated_document_block_tokens
+    logger.info(
+        "PDF text fast path: pages=%d, text_chars=%d, input_tokens=%d, "
+        "estimated_document_input_tokens=%d, estimated_tokens_saved=%d",
+        pages,
+        len(pdf_text),
+        input_tokens,
+        estimated_document_input_tokens,
+        estimated_document_input_tokens - input_tokens,
+    )
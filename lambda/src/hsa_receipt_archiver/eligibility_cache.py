@@ -0,0 +1,72 @@
+"""Cache Claude eligibility results in S3, keyed by a digest of the attachment content."""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict
+from datetime import UTC, datetime, timedelta
+
+from hsa_receipt_archiver.claude_client import PROMPT_VERSION, EligibilityResult
+from hsa_receipt_archiver.s3_manager import fetch_object, store_object
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "eligibility-cache/"
+
+# Entries older than this are treated as misses. 0 disables the cache.
+CACHE_TTL_DAYS = int(os.environ.get("ELIGIBILITY_CACHE_TTL_DAYS", "30"))
+
+
+def cache_key(digest: bytes, content_type: str) -> str:
+    """Return the S3 key for an attachment's cached results.
+
+    digest identifies the attachment content, such as the Attachment.sha256 computed once per
+    attachment, so the bytes aren't hashed again. The key also covers the content type and
+    the model/prompt version.
+    """
+    key = hashlib.sha256(f"{PROMPT_VERSION}\0{content_type}\0".encode() + digest)
+    return f"{CACHE_PREFIX}{key.hexdigest()}.json"
+
+
+def get_cached_results(bucket: str, digest: bytes, content_type: str) -> list[EligibilityResult] | None:
+    """Return cached eligibility results for an attachment's digest, or None on a miss.
+
+    Cache failures are logged and treated as misses; they never fail the receipt.
+    """
+    if CACHE_TTL_DAYS <= 0:
+        return None
+
+    key = cache_key(digest, content_type)
+    try:
+        raw = fetch_object(bucket, key)
+        if raw is None:
+            return None
+        cached = json.loads(raw)
+        if datetime.fromisoformat(cached["expires_at"]) <= datetime.now(tz=UTC):
+            logger.info("Eligibility cache entry expired: %s", key)
+            return None
+        results = [EligibilityResult(**item) for item in cached["results"]]
+    except Exception:
+        logger.warning("Failed to read eligibility cache entry %s", key, exc_info=True)
+        return None
+
+    logger.info("Eligibility cache hit: %s (%d results)", key, len(results))
+    return results
+
+
+def put_cached_results(bucket: str, digest: bytes, content_type: str, results: list[EligibilityResult]) -> None:
+    """Store eligibility results for an attachment. Failures are logged and ignored."""
+    if CACHE_TTL_DAYS <= 0:
+        return
+
+    key = cache_key(digest, content_type)
+    body = {
+        "prompt_version": PROMPT_VERSION,
+        "expires_at": (datetime.now(tz=UTC) + timedelta(days=CACHE_TTL_DAYS)).isoformat(),
+        "results": [asdict(result) for result in results],
+    }
+    try:
+        store_object(bucket, key, json.dumps(body).encode("utf-8"), "application/json")
+    except Exception:
+        logger.warning("Failed to write eligibility cache entry %s", key, exc_info=True)
@@ -1,8 +1,10 @@
 """Parse incoming SES emails and extract attachments."""
 
-import email
+import binascii
+import email.parser
 import email.policy
-from dataclasses import dataclass
+import hashlib
+from email.message import Message
 
 SUPPORTED_CONTENT_TYPES = frozenset(
     {
@@ -14,28 +16,126 @@ SUPPORTED_CONTENT_TYPES = frozenset(
     }
 )
 
+# The raw email is fed to the MIME parser in slices of this size. Parsing it in one go first
+# decodes the whole message into a str and then splits it into lines, several full-size copies.
+_PARSE_CHUNK_BYTES = 64 * 1024
+
+
+class Attachment:
+    """An email attachment whose payload is decoded from its MIME part on first access to data.
+
+    The decoded bytes are the only copy of the payload; every stage is handed the same object,
+    and its hash is computed at most once.
+    """
+
+    __slots__ = ("_data", "_part", "_sha256", "content_id", "content_type", "filename")
+
+    def __init__(
+        self,
+        filename: str,
+        content_type: str,
+        data: bytes | None = None,
+        part: Message | None = None,
+        content_id: str = "",
+    ) -> None:
+        self.filename = filename
+        self.content_type = content_type
+        # Set for parts referenced from the HTML body (cid:), i.e. inline images.
+        self.content_id = content_id
+        self._data = data
+        self._part = part
+        self._sha256: bytes | None = None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = _decode_payload(self._part) if self._part is not None else b""
+            # Drop the part so its encoded payload can be freed.
+            self._part = None
+        return self._data
+
+    @property
+    def sha256(self) -> bytes:
+        """SHA-256 digest of data."""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).digest()
+        return self._sha256
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Attachment):
+            return NotImplemented
+        return (self.filename, self.content_type, self.data) == (other.filename, other.content_type, other.data)
+
+    def __repr__(self) -> str:
+        return f"Attachment(filename={self.filename!r}, content_type={self.content_type!r})"
+
 
-@dataclass
 class ParsedEmail:
-    sender: str
-    subject: str
-    body: str
-    attachments: list["Attachment"]
+    """An email whose sender and subject come from a headers-only parse.
 
+    The MIME body is only parsed when body or attachments is first read, so mail that fails the
+    sender check is rejected without walking or decoding its attachments.
+    """
 
-@dataclass
-class Attachment:
-    filename: str
-    content_type: str
-    data: bytes
+    def __init__(
+        self,
+        sender: str,
+        subject: str,
+        body: str | None = None,
+        attachments: list[Attachment] | None = None,
+        raw_email: bytes = b"",
+    ) -> None:
+        self.sender = sender
+        self.subject = subject
+        self._body = body
+        self._attachments = attachments
+        self._raw_email = raw_email
+
+    @property
+    def body(self) -> str:
+        if self._body is None:
+            self._parse_parts()
+        return self._body or ""
+
+    @property
+    def attachments(self) -> list[Attachment]:
+        if self._attachments is None:
+            self._parse_parts()
+        return self._attachments or []
+
+    def _parse_parts(self) -> None:
+        body, attachments = _parse_parts(self._raw_email)
+        if self._body is None:
+            self._body = body
+        if self._attachments is None:
+            self._attachments = attachments
+        self._raw_email = b""
 
 
 def parse_ses_email(raw_email: bytes) -> ParsedEmail:
-    """Parse a raw email from S3 into structured data."""
-    msg = email.message_from_bytes(raw_email, policy=email.policy.default)
+    """Parse the headers of a raw email from S3. The body and attachments are parsed on first access."""
+    headers = email.parser.BytesHeaderParser(policy=email.policy.default).parsebytes(_header_block(raw_email))
+    sender = str(headers.get("From", ""))
+    subject = str(headers.get("Subject", ""))
+    return ParsedEmail(sender=sender, subject=subject, raw_email=raw_email)
+
+
+def _header_block(raw_email: bytes) -> bytes:
+    """The bytes up to the blank line that ends the top-level headers (all of it if there is none).
+
+    BytesHeaderParser would otherwise decode the whole message, attachments included, to a str.
+    """
+    ends = [end for end in (raw_email.find(b"\r\n\r\n"), raw_email.find(b"\n\n")) if end != -1]
+    return raw_email[: min(ends)] if ends else raw_email
 
-    sender = str(msg.get("From", ""))
-    subject = str(msg.get("Subject", ""))
+
+def _parse_parts(raw_email: bytes) -> tuple[str, list[Attachment]]:
+    """Walk the MIME tree for the plain-text body and supported attachments, leaving attachments undecoded."""
+    parser = email.parser.BytesFeedParser(policy=email.policy.default)
+    view = memoryview(raw_email)
+    for start in range(0, len(view), _PARSE_CHUNK_BYTES):
+        parser.feed(bytes(view[start : start + _PARSE_CHUNK_BYTES]))
+    msg = parser.close()
 
     body = ""
     attachments: list[Attachment] = []
@@ -48,10 +148,24 @@ def parse_ses_email(raw_email: bytes) -> ParsedEmail:
             payload = part.get_payload(decode=True)
             if isinstance(payload, bytes):
                 body = payload.decode("utf-8", errors="replace")
-        elif content_type in SUPPORTED_CONTENT_TYPES:
-            payload = part.get_payload(decode=True)
-            if isinstance(payload, bytes):
-                filename = part.get_filename() or f"attachment.{content_type.split('/')[-1]}"
-                attachments.append(Attachment(filename=filename, content_type=content_type, data=payload))
+        elif content_type in SUPPORTED_CONTENT_TYPES and not part.is_multipart():
+            filename = part.get_filename() or f"attachment.{content_type.split('/')[-1]}"
+            content_id = str(part.get("Content-ID", "")).strip()
+            attachments.append(
+                Attachment(filename=filename, content_type=content_type, part=part, content_id=content_id)
+            )
+
+    return body, attachments
+
 
-    return ParsedEmail(sender=sender, subject=subject, body=body, attachments=attachments)
+def _decode_payload(part: Message) -> bytes:
+    """Decode a part's payload, handling base64 directly to avoid the stdlib's line-by-line copies."""
+    if str(part.get("Content-Transfer-Encoding", "")).strip().lower() == "base64":
+        encoded = part.get_payload()
+        if isinstance(encoded, str):
+            try:
+                return binascii.a2b_base64(encoded)
+            except (binascii.Error, ValueError):
+                pass  # Non-ASCII or bad padding; the stdlib decoder is more forgiving.
+    payload = part.get_payload(decode=True)
+    return payload if isinstance(payload, bytes) else b""
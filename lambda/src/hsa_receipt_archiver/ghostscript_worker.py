@@ -0,0 +1,175 @@
+"""A long-lived Ghostscript interpreter that converts PDFs to PDF/A without a fork/exec per job."""
+
+import logging
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class GhostscriptWorkerError(RuntimeError):
+    """Raised when the worker fails a job. The worker is stopped and restarts on the next job."""
+
+
+class GhostscriptWorker:
+    """Keeps one Ghostscript process warm and feeds it conversion jobs over stdin.
+
+    Ghostscript pays for loading its init files, fonts and ICC profiles once, at start().
+    Each job points the pdfwrite device at a new OutputFile, runs the input and then points
+    the device at a scratch file, which closes and finalizes the job's output.
+
+    The interpreter runs under -dSAFER and may only read and write its own scratch directory,
+    so each job's input is staged there and its output moved out afterwards. Inputs must
+    start with a %PDF- header and are run with runpdf, never as PostScript.
+    """
+
+    def __init__(self, binary: str, device_args: list[str]) -> None:
+        self._binary = binary
+        self._device_args = device_args
+        self._proc: subprocess.Popen[bytes] | None = None
+        self._work_dir: Path | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the interpreter if it isn't already running."""
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        self.stop()
+
+        self._work_dir = Path(tempfile.mkdtemp(prefix="gsworker-"))
+        self._proc = subprocess.Popen(
+            [
+                self._binary,
+                "-q",
+                "-dNOPAUSE",
+                "-dSAFER",
+                f"--permit-file-read={self._work_dir}/",
+                f"--permit-file-write={self._work_dir}/",
+                *self._device_args,
+                f"-sOutputFile={self._work_dir / 'idle.pdf'}",
+                "-",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        logger.info("Started Ghostscript worker pid=%d", self._proc.pid)
+
+    def stop(self) -> None:
+        """Kill the interpreter and remove its scratch directory."""
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+            for stream in (self._proc.stdin, self._proc.stdout):
+                if stream is not None:
+                    stream.close()
+            self._proc = None
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
+    def try_convert(self, input_pdf: Path, output_pdf: Path, timeout: float) -> bool:
+        """Convert input_pdf to output_pdf if the worker is free. Returns False if it is busy.
+
+        Raises GhostscriptWorkerError if the input isn't a PDF, or if the job fails; the worker
+        is stopped in the latter case.
+        """
+        if not has_pdf_header(input_pdf):
+            raise GhostscriptWorkerError(f"{input_pdf.name} has no %PDF- header")
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._convert(input_pdf, output_pdf, timeout)
+        except GhostscriptWorkerError:
+            self.stop()
+            raise
+        finally:
+            self._lock.release()
+        return True
+
+    def _convert(self, input_pdf: Path, output_pdf: Path, timeout: float) -> None:
+        try:
+            self.start()
+        except OSError as e:
+            raise GhostscriptWorkerError(f"Could not start Ghostscript: {e}") from e
+        assert self._proc is not None and self._proc.stdin is not None and self._work_dir is not None
+
+        token = uuid.uuid4().hex
+        staged_input = self._work_dir / f"{token}-in.pdf"
+        staged_output = self._work_dir / f"{token}-out.pdf"
+        try:
+            os.link(input_pdf, staged_input)
+        except OSError:
+            shutil.copyfile(input_pdf, staged_input)
+        try:
+            self._run_job(token, staged_input, staged_output, timeout)
+            shutil.move(staged_output, output_pdf)
+        finally:
+            staged_input.unlink(missing_ok=True)
+            staged_output.unlink(missing_ok=True)
+
+    def _run_job(self, token: str, input_pdf: Path, output_pdf: Path, timeout: float) -> None:
+        assert self._proc is not None and self._proc.stdin is not None and self._work_dir is not None
+        job = (
+            "{ "
+            f"<< /OutputFile ({_ps_string(output_pdf)}) >> setpagedevice "
+            f"({_ps_string(input_pdf)}) (r) file runpdf "
+            f"<< /OutputFile ({_ps_string(self._work_dir / 'idle.pdf')}) >> setpagedevice "
+            "} stopped "
+            f"{{ (\\nJOBFAILED {token}\\n) print }} {{ (\\nJOBDONE {token}\\n) print }} ifelse "
+            "flush clear cleardictstack\n"
+        )
+        try:
+            self._proc.stdin.write(job.encode())
+            self._proc.stdin.flush()
+        except OSError as e:
+            raise GhostscriptWorkerError(f"Ghostscript worker is not accepting jobs: {e}") from e
+
+        status, output = self._read_status(token, timeout)
+        if status != "JOBDONE":
+            raise GhostscriptWorkerError(f"Ghostscript worker job failed:\n{output}")
+        if not output_pdf.exists() or output_pdf.read_bytes()[:5] != b"%PDF-":
+            raise GhostscriptWorkerError(f"Ghostscript worker produced no PDF:\n{output}")
+
+    def _read_status(self, token: str, timeout: float) -> tuple[str, str]:
+        """Read worker output until the job's status line. Returns (status, output before it)."""
+        assert self._proc is not None and self._proc.stdout is not None
+        fd = self._proc.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        buf = b""
+        while True:
+            for status in ("JOBDONE", "JOBFAILED"):
+                marker = f"{status} {token}\n".encode()
+                if marker in buf:
+                    return status, buf[: buf.index(marker)].decode(errors="replace")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GhostscriptWorkerError(f"Ghostscript worker timed out after {timeout:.0f}s")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise GhostscriptWorkerError(f"Ghostscript worker exited:\n{buf.decode(errors='replace')}")
+            buf += chunk
+
+
+def has_pdf_header(path: Path) -> bool:
+    """Return whether the file starts with a %PDF- header."""
+    with path.open("rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def _ps_string(path: Path) -> str:
+    """Escape a path for use inside a PostScript string literal."""
+    return str(path).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
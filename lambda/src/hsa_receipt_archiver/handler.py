@@ -1,25 +1,46 @@
 """Main Lambda handler for processing HSA receipt emails."""
 
+import functools
+import json
 import logging
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, date, datetime
 from email.utils import parseaddr
 from typing import Any
-
-import boto3
-
-from hsa_receipt_archiver.claude_client import check_hsa_eligibility
+from urllib.parse import unquote_plus
+
+from hsa_receipt_archiver.attachment_triage import triage_attachments
+from hsa_receipt_archiver.claude_client import (
+    IMAGE_CONTENT_TYPES,
+    EligibilityResult,
+    check_hsa_eligibility,
+    check_multipage_eligibility,
+)
+from hsa_receipt_archiver.eligibility_cache import get_cached_results, put_cached_results
 from hsa_receipt_archiver.email_parser import Attachment, parse_ses_email
-from hsa_receipt_archiver.ledger_manager import LedgerEntry, add_ledger_entry
+from hsa_receipt_archiver.ledger_manager import LedgerEntry, add_ledger_entries, ledger_partition
 from hsa_receipt_archiver.notifier import notify_failure, notify_rejection, notify_success
-from hsa_receipt_archiver.pdf_converter import convert_to_pdfa
+from hsa_receipt_archiver.pdf_converter import (
+    ConversionTimeoutError,
+    convert_pages_to_pdfa,
+    convert_to_pdfa,
+    unconverted_pdf,
+)
+from hsa_receipt_archiver.pdfa_upgrade import PENDING_NOTE, mark_pending, upgrade_pending
+from hsa_receipt_archiver.pending_ledger import queue_ledger_entries, replay_ledger_entries
 from hsa_receipt_archiver.s3_manager import (
-    fetch_ledger,
+    MergedLedgerEditedError,
     fetch_raw_email,
-    store_ledger,
+    is_raw_email_processed,
+    rebuild_merged_ledger,
     store_receipt,
     tag_raw_email,
+    update_ledger,
 )
+from hsa_receipt_archiver.ssm_cache import get_parameter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -30,75 +51,315 @@ SSM_ALLOWED_SENDERS_PARAM = os.environ["SSM_ALLOWED_SENDERS_PARAM"]
 
 FORCE_STORE_PREFIX = "FORCE_STORE"
 
-_ssm_cache: dict[str, str] = {}
-_ssm_client = boto3.client("ssm")
+# Event {"action": "rebuild-ledger"} adds queued ledger entries to their partitions and regenerates
+# the merged ledger view, instead of processing an email.
+REBUILD_LEDGER_ACTION = "rebuild-ledger"
+# Event {"action": "upgrade-pending-pdfa"} re-converts receipts that were stored without PDF/A.
+UPGRADE_PENDING_PDFA_ACTION = "upgrade-pending-pdfa"
+
+# Lambda time kept back from PDF/A conversion for storing, ledger updates and notifications.
+CONVERSION_RESERVE_SECONDS = float(os.environ.get("CONVERSION_RESERVE_SECONDS", "20"))
+
+MAX_ATTACHMENT_WORKERS = int(os.environ.get("MAX_ATTACHMENT_WORKERS", "4"))
+
+# A subject containing this word archives the email's images as the pages of one document.
+MULTIPAGE_KEYWORD = "MULTIPAGE"
+# Also treat the images as one document when Claude reads the same provider and date off each.
+MULTIPAGE_AUTO_DETECT = os.environ.get("MULTIPAGE_AUTO_DETECT", "false").lower() == "true"
+# Upper bound on pages per document, to stay within the images Claude accepts per request.
+MULTIPAGE_MAX_PAGES = int(os.environ.get("MULTIPAGE_MAX_PAGES", "20"))
+# Cache "content type" for multi-page results, which are keyed by the pages' hashes in order.
+_MULTIPAGE_CACHE_TYPE = "multipage"
 
 
 def _get_ssm_param(name: str) -> str:
-    """Fetch an SSM parameter, caching across invocations."""
-    if name not in _ssm_cache:
-        response = _ssm_client.get_parameter(Name=name, WithDecryption=True)
-        _ssm_cache[name] = response["Parameter"]["Value"]
-    return _ssm_cache[name]
+    """Fetch an SSM parameter through the TTL cache. Both of the handler's parameters are fetched together."""
+    return get_parameter(name, batch=(SSM_API_KEY_PARAM, SSM_ALLOWED_SENDERS_PARAM))
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_allowed_senders(allowed_senders: str) -> frozenset[str]:
+    """Parse the comma-separated allowed-sender list, memoized against the raw parameter value."""
+    return frozenset(s.strip().lower() for s in allowed_senders.split(","))
 
 
 def process_receipt(event: dict[str, Any], context: Any) -> dict[str, Any]:
-    """Process an incoming SES email event."""
+    """Process an incoming SES email event, or an SQS batch of S3 notifications for raw emails."""
     try:
-        return _handle(event)
+        deadline = _conversion_deadline(context)
+        if event.get("action") == REBUILD_LEDGER_ACTION:
+            replayed, pending = replay_ledger_entries(BUCKET_NAME)
+            try:
+                rebuild_merged_ledger(BUCKET_NAME)
+            except MergedLedgerEditedError as e:
+                logger.warning("Not rebuilding merged ledger: %s", e)
+                notify_failure(str(e))
+                return {"statusCode": 409, "body": "Merged ledger was edited; not rebuilt"}
+            return {
+                "statusCode": 200,
+                "body": f"Ledger rebuilt; replayed {replayed} queued batches, {pending} still queued",
+            }
+        if event.get("action") == UPGRADE_PENDING_PDFA_ACTION:
+            upgraded, pending = upgrade_pending(BUCKET_NAME, deadline)
+            return {"statusCode": 200, "body": f"Upgraded {upgraded} receipts; {pending} still pending"}
+        if _is_sqs_event(event):
+            return _handle_sqs_batch(event, deadline)
+        return _handle(event, deadline)
     except Exception:
         logger.exception("Failed to process receipt")
         return {"statusCode": 500, "body": "Internal error"}
 
 
-def _handle(event: dict[str, Any]) -> dict[str, Any]:
-    ses_record = event["Records"][0]["ses"]
-    mail = ses_record["mail"]
-    message_id = mail["messageId"]
+def _conversion_deadline(context: Any) -> float | None:
+    """The time.monotonic() by which PDF/A conversions must finish, or None outside Lambda."""
+    if context is None:
+        return None
+    remaining = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining - CONVERSION_RESERVE_SECONDS
 
-    raw_email_key = f"raw-emails/{message_id}"
-    logger.info("Processing email %s", message_id)
 
-    raw_email = fetch_raw_email(BUCKET_NAME, raw_email_key)
-    parsed = parse_ses_email(raw_email)
+def _handle(event: dict[str, Any], deadline: float | None = None) -> dict[str, Any]:
+    """Process each SES or S3 record in the event. With several records, the worst status is returned."""
+    records = event["Records"]
+    if len(records) == 1:
+        return _handle_email(_raw_email_key(records[0]), deadline)
+
+    results = []
+    for record in records:
+        try:
+            results.append(_handle_email(_raw_email_key(record), deadline))
+        except Exception:
+            logger.exception("Failed to process record %s", record)
+            results.append({"statusCode": 500, "body": "Internal error"})
+    return {
+        "statusCode": max(result["statusCode"] for result in results),
+        "body": "; ".join(result["body"] for result in results),
+    }
+
+
+def _is_sqs_event(event: dict[str, Any]) -> bool:
+    records = event.get("Records") or []
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def _handle_sqs_batch(event: dict[str, Any], deadline: float | None) -> dict[str, Any]:
+    """Process an SQS batch of S3 notifications, reporting failed messages for redelivery.
+
+    Server errors and exceptions fail the message; rejections (4xx) are final and don't. Messages
+    not started before the deadline also fail, so they are retried rather than rushed.
+    """
+    failures = []
+    for message in event["Records"]:
+        message_id = message["messageId"]
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.warning("Out of time; returning message %s to the queue", message_id)
+            failures.append({"itemIdentifier": message_id})
+            continue
+        try:
+            # S3 sends a test event with no Records when a notification is first configured.
+            records = json.loads(message["body"]).get("Records", [])
+            results = [_handle_email(_raw_email_key(record), deadline) for record in records]
+        except Exception:
+            logger.exception("Failed to process message %s", message_id)
+            failures.append({"itemIdentifier": message_id})
+            continue
+        if any(result["statusCode"] >= 500 for result in results):
+            failures.append({"itemIdentifier": message_id})
+    return {"batchItemFailures": failures}
+
+
+def _raw_email_key(record: dict[str, Any]) -> str:
+    """The raw email's S3 key, from an SES receipt record or an S3 notification record."""
+    if "ses" in record:
+        return f"raw-emails/{record['ses']['mail']['messageId']}"
+    # S3 notification keys are URL-encoded, with spaces as "+".
+    return unquote_plus(record["s3"]["object"]["key"])
+
+
+def _handle_email(raw_email_key: str, deadline: float | None = None) -> dict[str, Any]:
+    logger.info("Processing email %s", raw_email_key)
+
+    # SES, S3 and SQS all deliver at least once. Archiving an email again would store its
+    # receipts under new keys and add their ledger rows twice.
+    if is_raw_email_processed(BUCKET_NAME, raw_email_key):
+        logger.info("Email %s was already processed; skipping it", raw_email_key)
+        return {"statusCode": 200, "body": "Already processed"}
+
+    # Only the headers are parsed here; attachments aren't touched until the sender is allowed. The raw
+    # email isn't kept in a local so it can be freed once its parts are parsed.
+    parsed = parse_ses_email(fetch_raw_email(BUCKET_NAME, raw_email_key))
 
     _, sender_email = parseaddr(parsed.sender)
     sender_email = sender_email.lower()
 
-    allowed_senders = _get_ssm_param(SSM_ALLOWED_SENDERS_PARAM)
-    allowed_set = {s.strip().lower() for s in allowed_senders.split(",")}
-    if sender_email not in allowed_set:
+    if sender_email not in _parse_allowed_senders(_get_ssm_param(SSM_ALLOWED_SENDERS_PARAM)):
         logger.warning("Unauthorized sender: %s", sender_email)
         return {"statusCode": 403, "body": "Unauthorized sender"}
 
-    if not parsed.attachments:
+    attachments = triage_attachments(parsed.attachments)
+    if not attachments:
         logger.warning("No attachments found in email from %s", sender_email)
         return {"statusCode": 400, "body": "No attachments"}
 
     force_store = parsed.subject.strip().upper().startswith(FORCE_STORE_PREFIX)
     api_key = _get_ssm_param(SSM_API_KEY_PARAM)
 
-    for i, attachment in enumerate(parsed.attachments):
-        logger.info(
-            "Attachment %d/%d: filename=%s, content_type=%s, size=%d bytes",
-            i + 1,
-            len(parsed.attachments),
-            attachment.filename,
-            attachment.content_type,
-            len(attachment.data),
-        )
+    documents = _group_documents(attachments, parsed.subject, api_key)
+    workers = max(1, min(MAX_ATTACHMENT_WORKERS, len(documents)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attachment") as pool:
+        futures = [
+            pool.submit(_process_document_safely, i, len(documents), pages, force_store, api_key, deadline)
+            for i, pages in enumerate(documents)
+        ]
+    batches = [batch for batch in (future.result() for future in futures) if batch]
+    failed = _commit_ledger(batches, raw_email_key)
+
+    # The email is marked processed as soon as its rows are in the ledger or queued for it. A failure
+    # to mark it is logged rather than raised, since a redelivery would archive everything again.
+    try:
+        tag_raw_email(BUCKET_NAME, raw_email_key)
+    except Exception:
+        logger.exception("Failed to tag %s as processed", raw_email_key)
+
+    _notify_committed(batches, failed)
+    return {"statusCode": 200, "body": "Processed"}
+
+
+def _group_documents(attachments: list[Attachment], subject: str, api_key: str) -> list[list[Attachment]]:
+    """Split the email's attachments into documents, each archived as one PDF.
+
+    Each attachment is its own document, except in multi-page mode, where the image
+    attachments together form one document with a page per image, in attachment order.
+    """
+    singles = [[attachment] for attachment in attachments]
+    images = [attachment for attachment in attachments if attachment.content_type in IMAGE_CONTENT_TYPES]
+    if len(images) < 2:
+        return singles
+
+    requested = re.search(rf"\b{MULTIPAGE_KEYWORD}\b", subject.upper()) is not None
+    if len(images) > MULTIPAGE_MAX_PAGES:
+        if requested:
+            logger.warning("Too many images for one document (%d > %d)", len(images), MULTIPAGE_MAX_PAGES)
+        return singles
+    if requested:
+        logger.info("Multi-page mode requested by subject: %d images", len(images))
+    elif not (MULTIPAGE_AUTO_DETECT and _images_share_provider_and_date(images, api_key)):
+        return singles
+
+    return [images] + [[a] for a in attachments if a.content_type not in IMAGE_CONTENT_TYPES]
+
+
+def _images_share_provider_and_date(images: list[Attachment], api_key: str) -> bool:
+    """Check each image on its own and report whether all of them show one provider and date.
+
+    The per-image results land in the eligibility cache, so if the images turn out to be
+    separate receipts their own checks don't call Claude again.
+    """
+    workers = max(1, min(MAX_ATTACHMENT_WORKERS, len(images)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attachment") as pool:
+            per_image = list(pool.map(lambda image: _check_eligibility([image], api_key), images))
+    except Exception:
+        logger.warning("Multi-page detection failed; processing images separately", exc_info=True)
+        return False
+
+    keys: set[tuple[str, str]] = set()
+    for results in per_image:
+        if not results:
+            return False
+        for result in results:
+            receipt_date = result.service_date or result.payment_date
+            if not result.provider or not receipt_date:
+                return False
+            keys.add((result.provider.strip().lower(), receipt_date))
+
+    if len(keys) != 1:
+        return False
+    logger.info("Images share provider and date %s; archiving them as one document", keys)
+    return True
+
+
+def _process_document_safely(
+    index: int, total: int, pages: list[Attachment], force_store: bool, api_key: str, deadline: float | None
+) -> list[LedgerEntry]:
+    """Process one document, isolating its failures from the other documents in the email."""
+    filenames = ", ".join(page.filename for page in pages)
+    logger.info(
+        "Attachment %d/%d: filename=%s, content_type=%s, size=%d bytes",
+        index + 1,
+        total,
+        filenames,
+        ", ".join(page.content_type for page in pages),
+        sum(len(page.data) for page in pages),
+    )
+    try:
+        return _process_document(pages, force_store, api_key, deadline)
+    except Exception:
+        logger.exception("Failed to process attachment %s", filenames)
+        notify_failure(f"Failed to process attachment: {filenames}")
+        return []
+
+
+def _commit_ledger(batches: list[list[LedgerEntry]], raw_email_key: str) -> list[LedgerEntry]:
+    """Write every archived entry from the email to the ledger. Returns the entries that failed.
+
+    Entries are grouped by tax-year partition, and each affected partition gets one
+    conditional read, merge and write. The merged view is left to the rebuild-ledger action,
+    which also adds the entries of any failed write, queued here. If they can't be queued
+    either, the error is raised so the email is left untagged and redelivered.
+    """
+    if not batches:
+        return []
+
+    by_partition: dict[str, list[LedgerEntry]] = {}
+    for batch in batches:
+        for entry in batch:
+            by_partition.setdefault(ledger_partition(entry.service_date, entry.payment_date), []).append(entry)
+
+    failed: list[LedgerEntry] = []
+    for partition, entries in by_partition.items():
         try:
-            _process_attachment(attachment, force_store, api_key)
+            update_ledger(
+                BUCKET_NAME, partition, lambda ledger_csv, entries=entries: add_ledger_entries(ledger_csv, entries)
+            )
         except Exception:
-            logger.exception("Failed to process attachment %s", attachment.filename)
-            notify_failure(f"Failed to process attachment: {attachment.filename}")
+            logger.exception("Failed to update ledger partition %s with %d entries", partition, len(entries))
+            queue_ledger_entries(BUCKET_NAME, partition, entries, raw_email_key)
+            failed.extend(entries)
+            continue
+        logger.info("Added %d entries to ledger partition %s", len(entries), partition)
+
+    return failed
+
+
+def _notify_committed(batches: list[list[LedgerEntry]], failed: list[LedgerEntry]) -> None:
+    """Send the notifications for a ledger commit.
+
+    Each batch holds the entries of one attachment and gets its own success notification once
+    all of its entries have landed.
+    """
+    if failed:
+        receipts = sorted({entry.receipt_s3_uri for entry in failed})
+        notify_failure(
+            "Receipts were archived but the ledger could not be updated; their rows are queued for the "
+            f"next ledger rebuild: {', '.join(receipts)}"
+        )
+
+    failed_ids = {id(entry) for entry in failed}
+    for batch in batches:
+        if not any(id(entry) in failed_ids for entry in batch):
+            notify_success(batch)
 
-    tag_raw_email(BUCKET_NAME, raw_email_key)
-    return {"statusCode": 200, "body": "Processed"}
 
+def _process_document(
+    pages: list[Attachment], force_store: bool, api_key: str, deadline: float | None = None
+) -> list[LedgerEntry]:
+    """Check, convert and store one document. Returns the ledger entries to record for it.
 
-def _process_attachment(attachment: "Attachment", force_store: bool, api_key: str) -> None:
-    results = check_hsa_eligibility(api_key, attachment.data, attachment.content_type)
+    If PDF/A conversion doesn't finish by the deadline, the document is stored as a plain PDF,
+    noted as such in the ledger and queued for re-conversion.
+    """
+    results = _check_eligibility(pages, api_key)
 
     eligible_results = []
     for result in results:
@@ -109,9 +370,19 @@ def _process_attachment(attachment: "Attachment", force_store: bool, api_key: st
             eligible_results.append(result)
 
     if not eligible_results:
-        return
+        return []
 
-    pdf_data = convert_to_pdfa(attachment.data, attachment.content_type)
+    page_data = [(page.data, page.content_type) for page in pages]
+    notes = ""
+    try:
+        if len(pages) == 1:
+            pdf_data = convert_to_pdfa(pages[0].data, pages[0].content_type, deadline)
+        else:
+            pdf_data = convert_pages_to_pdfa(page_data, deadline)
+    except ConversionTimeoutError:
+        logger.warning("PDF/A conversion ran out of time; storing %s unconverted", pages[0].filename, exc_info=True)
+        pdf_data = unconverted_pdf(page_data)
+        notes = PENDING_NOTE
     receipt_uri: str | None = None
     entries: list[LedgerEntry] = []
 
@@ -135,16 +406,47 @@ def _process_attachment(attachment: "Attachment", force_store: bool, api_key: st
             description=result.description,
             amount=result.amount or 0.0,
             receipt_s3_uri=receipt_uri,
+            notes=notes,
         )
-
-        ledger_csv = fetch_ledger(BUCKET_NAME)
-        updated_ledger = add_ledger_entry(ledger_csv, entry)
-        store_ledger(BUCKET_NAME, updated_ledger)
         entries.append(entry)
 
         logger.info("Archived receipt: %s at %s", result.description, receipt_uri)
 
-    notify_success(entries)
+    if notes and receipt_uri is not None:
+        partitions = sorted({ledger_partition(entry.service_date, entry.payment_date) for entry in entries})
+        _queue_for_pdfa_upgrade(receipt_uri, partitions)
+    return entries
+
+
+def _queue_for_pdfa_upgrade(receipt_uri: str, ledger_partitions: list[str]) -> None:
+    """Queue a receipt for re-conversion. A failure here must not lose the receipt's ledger rows."""
+    try:
+        mark_pending(BUCKET_NAME, receipt_uri, ledger_partitions)
+    except Exception:
+        logger.exception("Failed to queue %s for PDF/A re-conversion", receipt_uri)
+
+
+def _check_eligibility(pages: list[Attachment], api_key: str) -> list[EligibilityResult]:
+    """Check a document's eligibility, reusing cached results for byte-identical resends.
+
+    A multi-page document is checked in one request carrying all of its pages.
+    """
+    if len(pages) == 1:
+        cache_digest, cache_type = pages[0].sha256, pages[0].content_type
+    else:
+        cache_digest = b"".join(page.sha256 for page in pages)
+        cache_type = _MULTIPAGE_CACHE_TYPE
+
+    cached = get_cached_results(BUCKET_NAME, cache_digest, cache_type)
+    if cached is not None:
+        return cached
+
+    if len(pages) == 1:
+        results = check_hsa_eligibility(api_key, pages[0].data, pages[0].content_type)
+    else:
+        results = check_multipage_eligibility(api_key, [(page.data, page.content_type) for page in pages])
+    put_cached_results(BUCKET_NAME, cache_digest, cache_type, results)
+    return results
 
 
 def _today() -> date:
@@ -0,0 +1,85 @@
+"""Shrink receipt images before sending them to Claude."""
+
+import io
+import logging
+import math
+import os
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Claude downsamples anything with a longer edge than this, so larger images only cost upload time.
+MODEL_IMAGE_MAX_EDGE = int(os.environ.get("MODEL_IMAGE_MAX_EDGE", "1568"))
+MODEL_IMAGE_JPEG_QUALITY = int(os.environ.get("MODEL_IMAGE_JPEG_QUALITY", "85"))
+
+# EXIF orientation tag; any value other than 1 means the pixels must be rotated for display.
+_EXIF_ORIENTATION = 0x0112
+
+
+def prepare_image_for_model(data: bytes, content_type: str) -> tuple[bytes, str]:
+    """Return a (data, content_type) pair suitable for the model payload.
+
+    Images are rotated upright per their EXIF orientation, downscaled so the long edge is at
+    most MODEL_IMAGE_MAX_EDGE and re-encoded as JPEG. Images that are already upright and
+    small enough are returned unchanged, as is anything Pillow fails to process.
+    """
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    try:
+        img = Image.open(io.BytesIO(data))
+        needs_rotation = img.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        if max(img.size) <= MODEL_IMAGE_MAX_EDGE and not needs_rotation:
+            return data, content_type
+
+        # Let the JPEG decoder scale down by a power of two while decoding, which is far
+        # cheaper than decoding full size and resizing.
+        img.draft("RGB", _draft_size(img.size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MODEL_IMAGE_MAX_EDGE, MODEL_IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+        img = _flatten_to_rgb(img)
+
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=MODEL_IMAGE_JPEG_QUALITY, optimize=True)
+    except Exception:
+        logger.warning("Image preprocessing failed; sending original (%d bytes)", len(data), exc_info=True)
+        return data, content_type
+
+    shrunk = buf.getvalue()
+    logger.info(
+        "Preprocessed image for model: %d -> %d bytes, %dx%d, %.0f ms",
+        len(data),
+        len(shrunk),
+        img.width,
+        img.height,
+        (time.perf_counter() - started) * 1000,
+    )
+    return shrunk, "image/jpeg"
+
+
+def _draft_size(size: tuple[int, int]) -> tuple[int, int]:
+    """The image's size scaled so the long edge is MODEL_IMAGE_MAX_EDGE, rounded up.
+
+    draft() only scales down while both edges stay at least this big, so the target has to
+    keep the image's aspect ratio. A square MODEL_IMAGE_MAX_EDGE box never lets a 4:3 photo shrink.
+    """
+    scale = MODEL_IMAGE_MAX_EDGE / max(size)
+    return math.ceil(size[0] * scale), math.ceil(size[1] * scale)
+
+
+def _flatten_to_rgb(img: "Image.Image") -> "Image.Image":
+    """Convert to RGB, compositing any transparency onto white."""
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA", "P"):
+        from PIL import Image
+
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
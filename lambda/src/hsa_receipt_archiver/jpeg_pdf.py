@@ -0,0 +1,82 @@
+"""Wrap a JPEG in a one-page PDF without decoding or re-encoding its pixels."""
+
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Matches the resolution Pillow is given for the other image formats.
+PAGE_DPI = 300
+
+_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB"}
+# EXIF orientations that are pure rotations, mapped to the page's clockwise /Rotate. Mirrored
+# orientations can't be expressed that way and go through Pillow instead.
+_EXIF_ROTATIONS = {1: 0, 3: 180, 6: 90, 8: 270}
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+def jpeg_to_pdf(data: bytes) -> bytes | None:
+    """Embed the JPEG stream as-is (DCTDecode) on a page sized for PAGE_DPI.
+
+    Only the JPEG header is read. Returns None for anything this can't wrap losslessly
+    (not a JPEG, CMYK, mirrored EXIF orientation), which should take the Pillow path.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format != "JPEG" or img.mode not in _COLOR_SPACES:
+                return None
+            width, height = img.size
+            color_space = _COLOR_SPACES[img.mode]
+            orientation = img.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.debug("Not wrapping image as JPEG: %s", e)
+        return None
+
+    rotate = _EXIF_ROTATIONS.get(orientation)
+    if rotate is None:
+        return None
+
+    page_width = width * 72 / PAGE_DPI
+    page_height = height * 72 / PAGE_DPI
+    content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q".encode()
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+            f"/Rotate {rotate} /Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>"
+        ).encode(),
+        _stream(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>",
+            data,
+        ),
+        _stream(f"<< /Length {len(content)} >>", content),
+    ]
+    return _write_pdf(objects)
+
+
+def _stream(dictionary: str, data: bytes) -> bytes:
+    return dictionary.encode() + b"\nstream\n" + data + b"\nendstream"
+
+
+def _write_pdf(objects: list[bytes]) -> bytes:
+    """Serialize objects numbered from 1, with object 1 as the catalog."""
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode())
+        out.write(obj)
+        out.write(b"\nendobj\n")
+
+    xref_offset = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    return out.getvalue()
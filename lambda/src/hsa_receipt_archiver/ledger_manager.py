@@ -1,7 +1,11 @@
 """Manage the HSA receipt ledger (CSV file)."""
 
+import bisect
 import csv
 import io
+import math
+from collections import defaultdict
+from collections.abc import Iterator
 from dataclasses import dataclass
 from datetime import date
 
@@ -18,6 +22,9 @@ HEADERS = [
     "Prob. of Duplicate",
 ]
 
+# Partition for rows with neither a service nor a payment date.
+UNDATED_PARTITION = "undated"
+
 
 @dataclass
 class LedgerEntry:
@@ -28,6 +35,7 @@ class LedgerEntry:
     description: str
     amount: float
     receipt_s3_uri: str
+    notes: str = ""
 
 
 def create_empty_ledger() -> str:
@@ -38,24 +46,226 @@ def create_empty_ledger() -> str:
     return buf.getvalue()
 
 
+def ledger_partition(service_date: date | None, payment_date: date | None) -> str:
+    """Return the ledger partition a row belongs to: the tax year of its service (or payment) date."""
+    receipt_date = service_date or payment_date
+    return str(receipt_date.year) if receipt_date else UNDATED_PARTITION
+
+
+def split_ledger(ledger_csv: str) -> dict[str, str]:
+    """Split a ledger into one ledger per partition, keyed by partition. Rows keep their order."""
+    reader = csv.reader(io.StringIO(ledger_csv))
+    header = next(reader, HEADERS)
+    service_col = _column(header, "Service Date")
+    payment_col = _column(header, "Payment Date")
+
+    rows_by_partition: dict[str, list[list[str]]] = defaultdict(list)
+    for row in reader:
+        if not row:
+            continue
+        partition = ledger_partition(_parse_iso_date(row, service_col), _parse_iso_date(row, payment_col))
+        rows_by_partition[partition].append(row)
+
+    partitions: dict[str, str] = {}
+    for partition, rows in rows_by_partition.items():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(header)
+        writer.writerows(rows)
+        partitions[partition] = buf.getvalue()
+    return partitions
+
+
+def merge_ledgers(ledger_csvs: list[str]) -> str:
+    """Concatenate ledgers into a single ledger with one header row.
+
+    Cells are matched to columns by header name, so ledgers whose columns were reordered or
+    that predate a column still line up. Columns outside HEADERS are kept, after the standard ones.
+    """
+    parsed = []
+    header = list(HEADERS)
+    for ledger_csv in ledger_csvs:
+        reader = csv.reader(io.StringIO(ledger_csv))
+        ledger_header = next(reader, HEADERS)
+        header.extend(name for name in ledger_header if name not in header)
+        parsed.append((ledger_header, [row for row in reader if row]))
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for ledger_header, rows in parsed:
+        positions = [ledger_header.index(name) if name in ledger_header else None for name in header]
+        writer.writerows([row[i] if i is not None and i < len(row) else "" for i in positions] for row in rows)
+    return buf.getvalue()
+
+
+def replace_note(ledger_csv: str | None, receipt_s3_uri: str, old_note: str, new_note: str) -> str:
+    """Replace old_note with new_note in the Notes cell of a receipt's rows. Returns updated CSV string.
+
+    Other rows, and the receipt's rows whose note was since changed by hand, are left as they are.
+    """
+    if ledger_csv is None:
+        return create_empty_ledger()
+    reader = csv.reader(io.StringIO(ledger_csv))
+    header = next(reader, HEADERS)
+    uri_col = _column(header, "Receipt S3 URI")
+    notes_col = _column(header, "Notes")
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for row in reader:
+        if len(row) > max(uri_col, notes_col) and row[uri_col] == receipt_s3_uri and row[notes_col] == old_note:
+            row[notes_col] = new_note
+        writer.writerow(row)
+    return buf.getvalue()
+
+
 def add_ledger_entry(ledger_csv: str | None, entry: LedgerEntry) -> str:
     """Add a new entry to the CSV ledger. Returns updated CSV string.
 
     If ledger_csv is None, creates a new ledger first.
     """
-    if ledger_csv is None:
-        ledger_csv = create_empty_ledger()
+    return add_ledger_entries(ledger_csv, [entry])
 
-    dupe_pct = _duplicate_score(ledger_csv, entry)
 
-    buf = io.StringIO()
-    buf.write(ledger_csv)
-    if not ledger_csv.endswith("\n"):
-        buf.write("\n")
+def add_ledger_entries(ledger_csv: str | None, entries: list[LedgerEntry]) -> str:
+    """Append a batch of entries to the CSV ledger in a single pass. Returns updated CSV string.
 
-    writer = csv.writer(buf)
-    writer.writerow(
-        [
+    The existing ledger is parsed and indexed once for duplicate scoring. Each entry is also
+    scored against the entries before it in the batch, matching the result of adding them one
+    at a time. If ledger_csv is None, creates a new ledger first.
+    """
+    ledger = Ledger.from_csv(ledger_csv)
+    for entry in entries:
+        ledger.append(entry)
+    return ledger.to_csv()
+
+
+def _duplicate_score(ledger_csv: str, entry: LedgerEntry) -> int:
+    """Score how likely an entry is a duplicate of an existing row (0-100).
+
+    Scoring:
+    - Same provider (case-insensitive): +30
+    - Same amount: +30
+    - Same service date: +40 (exact match) or +20 (within 30 days)
+    """
+    return Ledger.from_csv(ledger_csv).duplicate_score(entry)
+
+
+@dataclass(slots=True)
+class LedgerRow:
+    """One parsed ledger row.
+
+    The typed fields are parsed once at load. The original cells are kept so the row
+    serializes back exactly as it was read.
+    """
+
+    service_date: date | None
+    payment_date: date | None
+    provider: str
+    category: str
+    description: str
+    amount: float
+    receipt_s3_uri: str
+    reimbursed: bool
+    notes: str
+    duplicate_pct: int | None
+    cells: list[str]
+
+    @classmethod
+    def from_cells(cls, cells: list[str], columns: dict[str, int]) -> "LedgerRow":
+        def cell(name: str) -> str:
+            col = columns[name]
+            return cells[col] if col < len(cells) else ""
+
+        try:
+            amount = float(cell("Amount"))
+        except ValueError:
+            amount = 0.0
+        try:
+            duplicate_pct: int | None = int(cell("Prob. of Duplicate"))
+        except ValueError:
+            duplicate_pct = None
+
+        return cls(
+            service_date=_parse_iso_date(cells, columns["Service Date"]),
+            payment_date=_parse_iso_date(cells, columns["Payment Date"]),
+            provider=cell("Vendor/Provider"),
+            category=cell("Category"),
+            description=cell("Description"),
+            amount=amount,
+            receipt_s3_uri=cell("Receipt S3 URI"),
+            reimbursed=cell("Reimbursed").strip().lower() in _REIMBURSED_VALUES,
+            notes=cell("Notes"),
+            duplicate_pct=duplicate_pct,
+            cells=cells,
+        )
+
+    @property
+    def receipt_date(self) -> date | None:
+        """The date the ledger files this row under: service date, else payment date."""
+        return self.service_date or self.payment_date
+
+    @property
+    def tax_year(self) -> int | None:
+        receipt_date = self.receipt_date
+        return receipt_date.year if receipt_date else None
+
+
+class Ledger:
+    """An in-memory ledger, parsed once from the CSV format and queryable without reparsing.
+
+    Rows appended with append() are scored for duplicates through an index that is built on
+    first use and then kept up to date.
+    """
+
+    def __init__(self, ledger_csv: str | None = None) -> None:
+        self._source = ledger_csv
+        self.rows: list[LedgerRow] = []
+        self._index: _DuplicateIndex | None = None
+        self._by_date: list[tuple[int, int]] | None = None
+
+        if ledger_csv is None:
+            self.header = list(HEADERS)
+            self._loaded_rows = 0
+            return
+
+        reader = csv.reader(io.StringIO(ledger_csv))
+        self.header = next(reader, list(HEADERS))
+        columns = {name: _column(self.header, name) for name in HEADERS}
+        self.rows = [LedgerRow.from_cells(cells, columns) for cells in reader if cells]
+        self._loaded_rows = len(self.rows)
+
+    @classmethod
+    def from_csv(cls, ledger_csv: str | None) -> "Ledger":
+        """Load a ledger from CSV. None gives a new empty ledger."""
+        return cls(ledger_csv)
+
+    def to_csv(self) -> str:
+        """Serialize to the CSV format. Rows that were loaded are written back unchanged."""
+        buf = io.StringIO()
+        if self._source is None:
+            writer = csv.writer(buf)
+            writer.writerow(self.header)
+        else:
+            buf.write(self._source)
+            if not self._source.endswith("\n"):
+                buf.write("\n")
+            writer = csv.writer(buf)
+        writer.writerows(row.cells for row in self.rows[self._loaded_rows :])
+        return buf.getvalue()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[LedgerRow]:
+        return iter(self.rows)
+
+    def append(self, entry: LedgerEntry) -> LedgerRow:
+        """Append an entry, scoring it for duplicates against every row before it."""
+        dupe_pct = self.duplicate_score(entry)
+        cells = [
             entry.service_date.isoformat() if entry.service_date else "",
             entry.payment_date.isoformat() if entry.payment_date else "",
             entry.provider,
@@ -64,49 +274,144 @@ def add_ledger_entry(ledger_csv: str | None, entry: LedgerEntry) -> str:
             f"{entry.amount:.2f}",
             entry.receipt_s3_uri,
             "No",
-            "",
+            entry.notes,
             f"{dupe_pct}" if dupe_pct > 0 else "",
         ]
-    )
+        row = LedgerRow.from_cells(cells, _STANDARD_COLUMNS)
+        self.rows.append(row)
 
-    return buf.getvalue()
+        if self._index is not None:
+            self._index.add(row)
+        if self._by_date is not None and row.receipt_date is not None:
+            bisect.insort(self._by_date, (row.receipt_date.toordinal(), len(self.rows) - 1))
+        return row
 
+    def duplicate_score(self, entry: LedgerEntry) -> int:
+        """Score how likely an entry is a duplicate of an existing row (0-100)."""
+        if self._index is None:
+            self._index = _DuplicateIndex(self.rows)
+        return self._index.score(entry)
 
-def _duplicate_score(ledger_csv: str, entry: LedgerEntry) -> int:
-    """Score how likely an entry is a duplicate of an existing row (0-100).
+    def totals_by_year_and_category(self) -> dict[tuple[int | None, str], float]:
+        """Sum of amounts per (tax year, category). Rows without any date have year None."""
+        cents: dict[tuple[int | None, str], int] = defaultdict(int)
+        for row in self.rows:
+            cents[(row.tax_year, row.category)] += _to_cents(row.amount)
+        return {key: total / 100 for key, total in cents.items()}
 
-    Scoring:
-    - Same provider (case-insensitive): +30
-    - Same amount: +30
-    - Same service date: +40 (exact match) or +20 (within 30 days)
+    def total(self, year: int | None = None, category: str | None = None, *, unreimbursed_only: bool = False) -> float:
+        """Sum of amounts, optionally restricted to a tax year, a category and unreimbursed rows."""
+        cents = sum(
+            _to_cents(row.amount)
+            for row in self.rows
+            if (year is None or row.tax_year == year)
+            and (category is None or row.category == category)
+            and not (unreimbursed_only and row.reimbursed)
+        )
+        return cents / 100
+
+    def unreimbursed(self) -> list[LedgerRow]:
+        """Rows that have not been marked as reimbursed."""
+        return [row for row in self.rows if not row.reimbursed]
+
+    def between(self, start: date, end: date) -> list[LedgerRow]:
+        """Rows whose receipt date falls within [start, end], in date order."""
+        if self._by_date is None:
+            self._by_date = sorted(
+                (row.receipt_date.toordinal(), i) for i, row in enumerate(self.rows) if row.receipt_date is not None
+            )
+        lo = bisect.bisect_left(self._by_date, (start.toordinal(), -1))
+        hi = bisect.bisect_right(self._by_date, (end.toordinal(), len(self.rows)))
+        return [self.rows[i] for _, i in self._by_date[lo:hi]]
+
+
+# Width of the service-date buckets. Any two dates within 30 days of each other land in the
+# same or an adjacent bucket, so a lookup only has to check three buckets.
+_DATE_BUCKET_DAYS = 30
+
+_STANDARD_COLUMNS = {name: i for i, name in enumerate(HEADERS)}
+
+# Values of the (hand-maintained) Reimbursed column that mean the row has been paid back.
+_REIMBURSED_VALUES = frozenset({"yes", "y", "true", "x"})
+
+
+class _DuplicateIndex:
+    """Ledger rows indexed by normalized provider, amount in cents and service-date bucket.
+
+    A row that shares none of these keys with an entry scores 0 against it, so scoring only
+    the rows found through the index gives the same best score as scanning the whole ledger.
     """
-    reader = csv.DictReader(io.StringIO(ledger_csv))
-    best = 0
 
-    for row in reader:
-        score = 0
+    def __init__(self, rows: list[LedgerRow]) -> None:
+        self._rows: list[LedgerRow] = []
+        self._by_provider: dict[str, list[int]] = defaultdict(list)
+        self._by_cents: dict[int, list[int]] = defaultdict(list)
+        self._by_date_bucket: dict[int, list[int]] = defaultdict(list)
+        for row in rows:
+            self.add(row)
 
-        if row.get("Vendor/Provider", "").strip().lower() == entry.provider.strip().lower():
-            score += 30
+    def add(self, row: LedgerRow) -> None:
+        """Index one more row, e.g. an entry that was just appended to the ledger."""
+        row_id = len(self._rows)
+        self._rows.append(row)
+        self._by_provider[_normalize_provider(row.provider)].append(row_id)
+        if math.isfinite(row.amount):
+            self._by_cents[round(row.amount * 100)].append(row_id)
+        if row.service_date is not None:
+            self._by_date_bucket[row.service_date.toordinal() // _DATE_BUCKET_DAYS].append(row_id)
 
-        try:
-            row_amount = float(row.get("Amount", "0"))
-        except ValueError:
-            row_amount = 0.0
-        if abs(row_amount - entry.amount) < 0.01:
-            score += 30
-
-        row_date_str = row.get("Service Date", "").strip()
-        if row_date_str and entry.service_date:
-            try:
-                row_date = date.fromisoformat(row_date_str)
-                if row_date == entry.service_date:
-                    score += 40
-                elif abs((row_date - entry.service_date).days) <= 30:
-                    score += 20
-            except ValueError:
-                pass
-
-        best = max(best, score)
-
-    return best
+    def score(self, entry: LedgerEntry) -> int:
+        """Return the best duplicate score of the entry against any indexed row."""
+        provider = _normalize_provider(entry.provider)
+
+        candidates: set[int] = set(self._by_provider.get(provider, ()))
+        if math.isfinite(entry.amount):
+            # Amounts within a cent of each other can round to adjacent cent values.
+            cents = round(entry.amount * 100)
+            for neighbor in (cents - 1, cents, cents + 1):
+                candidates.update(self._by_cents.get(neighbor, ()))
+        if entry.service_date is not None:
+            bucket = entry.service_date.toordinal() // _DATE_BUCKET_DAYS
+            for neighbor in (bucket - 1, bucket, bucket + 1):
+                candidates.update(self._by_date_bucket.get(neighbor, ()))
+
+        return max((_score_pair(self._rows[row_id], provider, entry) for row_id in candidates), default=0)
+
+
+def _score_pair(row: LedgerRow, provider: str, entry: LedgerEntry) -> int:
+    score = 0
+
+    if _normalize_provider(row.provider) == provider:
+        score += 30
+
+    if abs(row.amount - entry.amount) < 0.01:
+        score += 30
+
+    if row.service_date and entry.service_date:
+        if row.service_date == entry.service_date:
+            score += 40
+        elif abs((row.service_date - entry.service_date).days) <= 30:
+            score += 20
+
+    return score
+
+
+def _normalize_provider(provider: str) -> str:
+    return provider.strip().lower()
+
+
+def _to_cents(amount: float) -> int:
+    return round(amount * 100) if math.isfinite(amount) else 0
+
+
+def _column(header: list[str], name: str) -> int:
+    return header.index(name) if name in header else HEADERS.index(name)
+
+
+def _parse_iso_date(row: list[str], col: int) -> date | None:
+    if col >= len(row) or not row[col].strip():
+        return None
+    try:
+        return date.fromisoformat(row[col].strip())
+    except ValueError:
+        return None
@@ -2,11 +2,10 @@
 
 import os
 
-import boto3
-
+from hsa_receipt_archiver.aws_clients import LazyClient
 from hsa_receipt_archiver.ledger_manager import LedgerEntry
 
-SNS_CLIENT = boto3.client("sns")
+SNS_CLIENT = LazyClient("sns")
 
 TOPIC_ARN = os.environ["SNS_TOPIC_ARN"]
 
@@ -35,6 +34,9 @@ def notify_success(entries: list[LedgerEntry]) -> None:
     message = "\n".join([header, separator, *rows])
     if receipt_uri:
         message += f"\n\nReceipt: {receipt_uri}"
+    notes = entries[0].notes if entries else ""
+    if notes:
+        message += f"\nNote: {notes}"
 
     SNS_CLIENT.publish(TopicArn=TOPIC_ARN, Subject=subject, Message=message)
 
@@ -1,62 +1,319 @@
 """Convert receipt images and PDFs to PDF/A format for archival."""
 
+import contextlib
+import io
+import logging
 import os
+import signal
 import subprocess
 import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterable
+from dataclasses import dataclass
 from pathlib import Path
 
-from PIL import Image
+from hsa_receipt_archiver.ghostscript_worker import GhostscriptWorker, GhostscriptWorkerError, has_pdf_header
+from hsa_receipt_archiver.jpeg_pdf import jpeg_to_pdf
+from hsa_receipt_archiver.pdfa_check import is_pdfa_2b
+
+logger = logging.getLogger(__name__)
 
 GS_BINARY = os.environ.get("GS_BINARY", "/var/task/bin/gs")
+# "subprocess" runs a fresh gs per conversion; "persistent" keeps one warm for the container's lifetime.
+GS_ENGINE = os.environ.get("GS_ENGINE", "subprocess")
+# "pipe" reads the converted PDF from gs's stdout; "tempfile" has gs write it to /tmp first.
+GS_IO_MODE = os.environ.get("GS_IO_MODE", "pipe")
+# Bound on text extraction, which runs outside a conversion's deadline.
+GS_QUERY_TIMEOUT_SECONDS = float(os.environ.get("GS_QUERY_TIMEOUT_SECONDS", "30"))
+GS_WORKER_TIMEOUT_SECONDS = float(os.environ.get("GS_WORKER_TIMEOUT_SECONDS", "60"))
+# Consecutive worker failures before the container gives up on it and only uses subprocesses.
+GS_WORKER_MAX_FAILURES = int(os.environ.get("GS_WORKER_MAX_FAILURES", "3"))
+
+# How often convert_to_pdfa passed an existing PDF/A through vs ran Ghostscript, per container.
+CONVERSION_COUNTS: Counter[str] = Counter()
+_conversion_counts_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ConversionProfile:
+    """Ghostscript pdfwrite settings layered on the PDF/A-2b flags, plus image preparation."""
 
-_CONTENT_TYPE_SUFFIX = {
-    "image/jpeg": ".jpg",
-    "image/png": ".png",
-    "image/gif": ".gif",
-    "image/webp": ".webp",
+    gs_args: tuple[str, ...]
+    # Re-encode image attachments with no real color as grayscale before wrapping them.
+    grayscale_images: bool = False
+
+
+PROFILES = {
+    # Skips duplicate-image hashing and per-page text orientation analysis.
+    "fast": ConversionProfile(gs_args=("-dDetectDuplicateImages=false", "-dAutoRotatePages=/None")),
+    # The original flags.
+    "balanced": ConversionProfile(gs_args=()),
+    # Downsamples images above 200 dpi (300 for bitonal) and stores color and gray images as JPEG.
+    "compact": ConversionProfile(
+        gs_args=(
+            "-dDownsampleColorImages=true",
+            "-dColorImageDownsampleType=/Bicubic",
+            "-dColorImageResolution=200",
+            "-dDownsampleGrayImages=true",
+            "-dGrayImageDownsampleType=/Bicubic",
+            "-dGrayImageResolution=200",
+            "-dDownsampleMonoImages=true",
+            "-dMonoImageResolution=300",
+            "-dAutoFilterColorImages=false",
+            "-dColorImageFilter=/DCTEncode",
+            "-dAutoFilterGrayImages=false",
+            "-dGrayImageFilter=/DCTEncode",
+        ),
+        grayscale_images=True,
+    ),
 }
 
+GS_PROFILE = os.environ.get("GS_PROFILE", "balanced")
+if GS_PROFILE not in PROFILES:
+    raise ValueError(f"Unknown GS_PROFILE {GS_PROFILE!r}; expected one of {', '.join(PROFILES)}")
+PROFILE = PROFILES[GS_PROFILE]
+
+_PDFA_DEVICE_ARGS = [
+    "-dPDFA=2",
+    "-sColorConversionStrategy=UseDeviceIndependentColor",
+    "-sDEVICE=pdfwrite",
+    *PROFILE.gs_args,
+]
+
+# An image counts as uncolored when fewer than this share of its pixels have a saturation
+# above _COLORED_SATURATION. Paper under warm light stays well below that saturation.
+_COLORED_PIXEL_RATIO = 0.01
+_COLORED_SATURATION = 60
 
-def convert_to_pdfa(data: bytes, content_type: str) -> bytes:
+
+class ConversionTimeoutError(RuntimeError):
+    """Raised when Ghostscript doesn't finish before the conversion's deadline."""
+
+
+def convert_to_pdfa(data: bytes, content_type: str, deadline: float | None = None) -> bytes:
     """Convert an image or PDF to PDF/A-2b format using Ghostscript.
 
-    Images are first converted to PDF via Pillow, then Ghostscript produces PDF/A.
-    PDFs go directly through Ghostscript.
+    Images are first wrapped in a PDF, in memory, then Ghostscript produces PDF/A. JPEGs are
+    embedded as-is so they aren't recompressed twice; other formats are converted via Pillow.
+    PDFs go directly through Ghostscript, unless they already declare PDF/A-2b, in which case
+    they are returned unchanged.
+
+    Ghostscript needs a seekable PDF to read, so the input is the one thing written to disk.
+    In the default "pipe" GS_IO_MODE the result is read from Ghostscript's stdout; "tempfile"
+    has it write output.pdf instead, as does the persistent worker.
+
+    deadline is a time.monotonic() value. Ghostscript still running then is killed, along with
+    its process group, and ConversionTimeoutError is raised.
     """
+    if content_type == "application/pdf" and is_pdfa_2b(data):
+        _record_conversion("passthrough")
+        return data
+    _record_conversion("converted")
+
+    pdf = data if content_type == "application/pdf" else _image_to_pdf(data, content_type)
+    return _ghostscript_to_pdfa([pdf], deadline)
+
+
+def convert_pages_to_pdfa(pages: list[tuple[bytes, str]], deadline: float | None = None) -> bytes:
+    """Combine images into one multi-page PDF/A-2b, one page per image, in page order.
+
+    Pages are (data, content_type) pairs. Each is wrapped the same way convert_to_pdfa wraps
+    a single image, and one Ghostscript run concatenates them.
+    """
+    _record_conversion("converted")
+    return _ghostscript_to_pdfa((_image_to_pdf(data, content_type) for data, content_type in pages), deadline)
+
+
+def unconverted_pdf(pages: list[tuple[bytes, str]]) -> bytes:
+    """Build a plain PDF, not PDF/A, without Ghostscript. For when conversion ran out of time.
+
+    A single PDF is returned as-is and a single image is wrapped the way conversion wraps it,
+    so converting the result later gives the same PDF/A. Several images are combined by Pillow.
+    """
+    if len(pages) == 1:
+        data, content_type = pages[0]
+        return data if content_type == "application/pdf" else _image_to_pdf(data, content_type)
+
+    from PIL import Image
+
+    images = [Image.open(io.BytesIO(data)) for data, _ in pages]
+    buf = io.BytesIO()
+    images[0].save(buf, "PDF", resolution=300.0, save_all=True, append_images=images[1:])
+    return buf.getvalue()
+
+
+def _ghostscript_to_pdfa(pdfs: Iterable[bytes], deadline: float | None) -> bytes:
+    """Run Ghostscript over the input PDFs, concatenated in order, and return the PDF/A."""
     with tempfile.TemporaryDirectory() as tmp_dir:
         tmp = Path(tmp_dir)
+        input_pdfs = []
+        for i, pdf in enumerate(pdfs):
+            input_pdf = tmp / f"input{i}.pdf"
+            input_pdf.write_bytes(pdf)
+            input_pdfs.append(input_pdf)
+        inputs = [str(path) for path in input_pdfs]
+
+        if GS_ENGINE == "persistent" or GS_IO_MODE == "tempfile":
+            output_pdf = tmp / "output.pdf"
+            # The worker runs one input per job, and only inputs that are really PDFs.
+            use_worker = GS_ENGINE == "persistent" and len(input_pdfs) == 1 and has_pdf_header(input_pdfs[0])
+            if not (use_worker and _convert_with_worker(input_pdfs[0], output_pdf, deadline)):
+                _run_ghostscript([f"-sOutputFile={output_pdf}", *inputs], deadline)
+            return output_pdf.read_bytes()
+
+        # -sstdout=%stderr keeps Ghostscript's own messages out of the PDF on stdout.
+        return _run_ghostscript(["-q", "-sstdout=%stderr", "-sOutputFile=-", *inputs], deadline)
+
 
-        if content_type == "application/pdf":
-            input_pdf = tmp / "input.pdf"
-            input_pdf.write_bytes(data)
+def _record_conversion(outcome: str) -> None:
+    with _conversion_counts_lock:
+        CONVERSION_COUNTS[outcome] += 1
+        counts = dict(CONVERSION_COUNTS)
+    logger.info("PDF/A %s (container totals: %s)", outcome, counts)
+
+
+def _image_to_pdf(data: bytes, content_type: str) -> bytes:
+    grayscale = PROFILE.grayscale_images and _is_uncolored(data)
+    if content_type == "image/jpeg" and not grayscale:
+        pdf = jpeg_to_pdf(data)
+        if pdf is not None:
+            return pdf
+
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(data))
+    if grayscale:
+        img = ImageOps.exif_transpose(img).convert("L")
+    buf = io.BytesIO()
+    img.save(buf, "PDF", resolution=300.0)
+    return buf.getvalue()
+
+
+def _is_uncolored(data: bytes) -> bool:
+    """Return True if the image has no meaningful color, judged from a small decoded sample."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.mode in ("1", "L", "LA", "I", "I;16", "F"):
+                return True
+            img.draft("RGB", (256, 256))
+            sample = img.convert("RGB")
+    except Exception:
+        logger.debug("Could not sample image colors", exc_info=True)
+        return False
+
+    sample.thumbnail((256, 256))
+    saturation = sample.convert("HSV").getchannel("S")
+    colored = sum(saturation.histogram()[_COLORED_SATURATION + 1 :])
+    return colored < _COLORED_PIXEL_RATIO * sample.width * sample.height
+
+
+def _run_ghostscript(io_args: list[str], deadline: float | None) -> bytes:
+    """Run a one-off PDF/A conversion and return its stdout."""
+    result = _run_process([GS_BINARY, "-dBATCH", "-dNOPAUSE", *_PDFA_DEVICE_ARGS, *io_args], deadline)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Ghostscript failed (exit {result.returncode}):\n"
+            f"stdout: {result.stdout.decode(errors='replace')}\n"
+            f"stderr: {result.stderr.decode(errors='replace')}"
+        )
+    return result.stdout
+
+
+_worker: GhostscriptWorker | None = None
+_worker_failures = 0
+_worker_state_lock = threading.Lock()
+
+
+def _run_process(args: list[str], deadline: float | None) -> subprocess.CompletedProcess[bytes]:
+    """Run a command in its own process group, capturing output, until it exits or the deadline passes.
+
+    On timeout the whole process group is killed and ConversionTimeoutError is raised.
+    """
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True) as proc:
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            raise ConversionTimeoutError(f"{Path(args[0]).name} killed after {timeout:.1f}s") from None
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+
+def _convert_with_worker(input_pdf: Path, output_pdf: Path, deadline: float | None) -> bool:
+    """Convert with the persistent worker. Returns False if the caller should use a subprocess instead.
+
+    A failed job stops the worker, which restarts on the next job. After GS_WORKER_MAX_FAILURES
+    consecutive failures the worker stays off for the rest of the container's lifetime. Running
+    out of time raises ConversionTimeoutError and doesn't count as a worker failure.
+    """
+    global _worker, _worker_failures
+
+    timeout = GS_WORKER_TIMEOUT_SECONDS
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise ConversionTimeoutError("No time left to convert")
+
+    with _worker_state_lock:
+        if _worker_failures >= GS_WORKER_MAX_FAILURES:
+            return False
+        if _worker is None:
+            _worker = GhostscriptWorker(GS_BINARY, _PDFA_DEVICE_ARGS)
+        worker = _worker
+
+    try:
+        converted = worker.try_convert(input_pdf, output_pdf, timeout)
+    except GhostscriptWorkerError as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise ConversionTimeoutError(f"Ghostscript worker ran out of time: {e}") from e
+        with _worker_state_lock:
+            _worker_failures += 1
+            failures = _worker_failures
+        if failures >= GS_WORKER_MAX_FAILURES:
+            logger.error("Ghostscript worker failed %d times in a row, disabling it: %s", failures, e)
         else:
-            input_pdf = tmp / "intermediate.pdf"
-            suffix = _CONTENT_TYPE_SUFFIX.get(content_type, ".bin")
-            image_path = tmp / f"input{suffix}"
-            image_path.write_bytes(data)
-            img = Image.open(image_path)
-            img.save(str(input_pdf), "PDF", resolution=300.0)
+            logger.warning("Ghostscript worker failed, falling back to a subprocess: %s", e)
+        output_pdf.unlink(missing_ok=True)
+        return False
+
+    if converted:
+        with _worker_state_lock:
+            _worker_failures = 0
+    return converted
+
 
-        output_pdf = tmp / "output.pdf"
+def extract_pdf_text(data: bytes) -> str:
+    """Extract a PDF's text layer with Ghostscript's txtwrite device.
+
+    Returns an empty string for PDFs without one (e.g. scans).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_pdf = Path(tmp_dir) / "input.pdf"
+        input_pdf.write_bytes(data)
 
-        result = subprocess.run(
+        result = _run_process(
             [
                 GS_BINARY,
-                "-dPDFA=2",
+                "-q",
                 "-dBATCH",
                 "-dNOPAUSE",
-                "-sColorConversionStrategy=UseDeviceIndependentColor",
-                "-sDEVICE=pdfwrite",
-                f"-sOutputFile={output_pdf}",
+                "-dSAFER",
+                "-sDEVICE=txtwrite",
+                "-sOutputFile=-",
                 str(input_pdf),
             ],
-            capture_output=True,
+            time.monotonic() + GS_QUERY_TIMEOUT_SECONDS,
         )
         if result.returncode != 0:
             raise RuntimeError(
-                f"Ghostscript failed (exit {result.returncode}):\n"
-                f"stdout: {result.stdout.decode(errors='replace')}\n"
+                f"Ghostscript text extraction failed (exit {result.returncode}):\n"
                 f"stderr: {result.stderr.decode(errors='replace')}"
             )
 
-        return output_pdf.read_bytes()
+        return result.stdout.decode("utf-8", errors="replace")
@@ -0,0 +1,52 @@
+"""Cheap PDF/A-2b conformance pre-check that inspects metadata without rendering the PDF."""
+
+import re
+import zlib
+
+# Only the markers below are needed, so a stream inflating past this is not worth finishing.
+_MAX_INFLATED_BYTES = 8 * 1024 * 1024
+
+_PART_RE = re.compile(rb"pdfaid:part(?:\s*=\s*[\"']|>)\s*(\d+)")
+_CONFORMANCE_RE = re.compile(rb"pdfaid:conformance(?:\s*=\s*[\"']|>)\s*([A-Za-z])")
+_OUTPUT_INTENT_RE = re.compile(rb"/S\s*/GTS_PDFA1\b")
+_OBJSTM_RE = re.compile(rb"/Type\s*/ObjStm\b")
+_STREAM_START_RE = re.compile(rb"stream\r?\n")
+
+# 2a and 2u add requirements on top of 2b, so any of the three can be archived as-is.
+_CONFORMANCE_LEVELS = {b"A", b"B", b"U"}
+
+
+def is_pdfa_2b(data: bytes) -> bool:
+    """Return True if the PDF declares PDF/A-2 (level a, b or u) and carries a PDF/A OutputIntent.
+
+    This trusts the document's own claims: XMP pdfaid identification plus a GTS_PDFA1
+    OutputIntent, which PDF/A requires for device-dependent color. Encrypted PDFs are
+    rejected since PDF/A forbids encryption. It does not validate the full standard.
+    """
+    if not data.startswith(b"%PDF-") or b"/Encrypt" in data:
+        return False
+
+    part = _PART_RE.search(data)
+    conformance = _CONFORMANCE_RE.search(data)
+    if part is None or part.group(1) != b"2" or conformance is None:
+        return False
+    if conformance.group(1).upper() not in _CONFORMANCE_LEVELS:
+        return False
+
+    return _OUTPUT_INTENT_RE.search(data) is not None or _objstm_has_output_intent(data)
+
+
+def _objstm_has_output_intent(data: bytes) -> bool:
+    """Look for the OutputIntent inside compressed object streams, where PDF 1.5+ writers often put it."""
+    view = memoryview(data)
+    for objstm in _OBJSTM_RE.finditer(data):
+        stream = _STREAM_START_RE.search(data, objstm.end())
+        if stream is None:
+            continue
+        try:
+            inflated = zlib.decompressobj().decompress(view[stream.end() :], _MAX_INFLATED_BYTES)
+        except zlib.error:
+            continue
+        if _OUTPUT_INTENT_RE.search(inflated):
+            return True
+    return False
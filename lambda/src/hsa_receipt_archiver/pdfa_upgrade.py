@@ -0,0 +1,122 @@
+"""Track receipts stored without PDF/A conversion and upgrade them in place later."""
+
+import json
+import logging
+import os
+import time
+from datetime import UTC, datetime
+from typing import Any
+
+from hsa_receipt_archiver.ledger_manager import replace_note
+from hsa_receipt_archiver.notifier import notify_failure
+from hsa_receipt_archiver.pdf_converter import convert_to_pdfa
+from hsa_receipt_archiver.s3_manager import delete_object, fetch_object, list_keys, store_object, update_ledger
+
+logger = logging.getLogger(__name__)
+
+# One marker per pending receipt, at PENDING_PREFIX + the receipt's key.
+PENDING_PREFIX = "pending-pdfa/"
+
+# Ledger note for receipts stored unconverted. Cleared once the receipt is upgraded.
+PENDING_NOTE = "Stored as plain PDF after PDF/A conversion timed out; queued for re-conversion"
+
+# Replaces PENDING_NOTE for receipts whose re-conversion was given up on.
+ABANDONED_NOTE = "Stored as plain PDF; PDF/A re-conversion failed"
+
+# Time allowed for one receipt, so a single slow receipt can't use up the whole run.
+PDFA_UPGRADE_RECEIPT_SECONDS = float(os.environ.get("PDFA_UPGRADE_RECEIPT_SECONDS", "120"))
+
+# Attempts before a receipt is given up on and left as plain PDF.
+PDFA_UPGRADE_MAX_ATTEMPTS = int(os.environ.get("PDFA_UPGRADE_MAX_ATTEMPTS", "3"))
+
+
+def mark_pending(bucket: str, receipt_uri: str, ledger_partitions: list[str]) -> None:
+    """Queue a stored receipt for re-conversion to PDF/A.
+
+    ledger_partitions are the partitions holding the receipt's ledger rows, whose notes are
+    updated once the receipt is upgraded or given up on.
+    """
+    receipt_key = receipt_uri.removeprefix(f"s3://{bucket}/")
+    body = {
+        "receipt_key": receipt_key,
+        "receipt_uri": receipt_uri,
+        "ledger_partitions": ledger_partitions,
+        "queued_at": datetime.now(tz=UTC).isoformat(),
+        "attempts": 0,
+    }
+    store_object(bucket, f"{PENDING_PREFIX}{receipt_key}", json.dumps(body).encode("utf-8"), "application/json")
+    logger.info("Queued %s for PDF/A re-conversion", receipt_key)
+
+
+def upgrade_pending(bucket: str, deadline: float | None = None) -> tuple[int, int]:
+    """Re-convert queued receipts to PDF/A until none are left or the deadline passes.
+
+    Each receipt is overwritten in place, so its URI and ledger rows stay valid, and PENDING_NOTE
+    is cleared from those rows. Each receipt gets at most PDFA_UPGRADE_RECEIPT_SECONDS. Attempts
+    are counted in the marker before converting, so receipts that fail or time out stay queued
+    until PDFA_UPGRADE_MAX_ATTEMPTS, then are dropped with a failure notification and their
+    rows noted with ABANDONED_NOTE. Returns (upgraded, still pending).
+    """
+    markers = list_keys(bucket, PENDING_PREFIX)
+    upgraded = dropped = 0
+    for marker in markers:
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.warning("Out of time with %d receipts still pending", len(markers) - upgraded - dropped)
+            break
+
+        receipt_key = marker.removeprefix(PENDING_PREFIX)
+        data = fetch_object(bucket, receipt_key)
+        if data is None:
+            logger.warning("Pending receipt %s no longer exists; dropping it", receipt_key)
+            delete_object(bucket, marker)
+            dropped += 1
+            continue
+
+        body = json.loads(fetch_object(bucket, marker) or b"{}")
+        attempts = body.get("attempts", 0)
+        if attempts >= PDFA_UPGRADE_MAX_ATTEMPTS:
+            _give_up(bucket, marker, body, receipt_key, attempts)
+            dropped += 1
+            continue
+        body["attempts"] = attempts = attempts + 1
+        store_object(bucket, marker, json.dumps(body).encode("utf-8"), "application/json")
+
+        receipt_deadline = time.monotonic() + PDFA_UPGRADE_RECEIPT_SECONDS
+        if deadline is not None:
+            receipt_deadline = min(deadline, receipt_deadline)
+        try:
+            pdf_data = convert_to_pdfa(data, "application/pdf", receipt_deadline)
+        except Exception:
+            logger.exception("Re-conversion of %s failed (attempt %d)", receipt_key, attempts)
+            if attempts >= PDFA_UPGRADE_MAX_ATTEMPTS:
+                _give_up(bucket, marker, body, receipt_key, attempts)
+                dropped += 1
+            continue
+
+        store_object(bucket, receipt_key, pdf_data, "application/pdf")
+        _update_ledger_notes(bucket, body, receipt_key, "")
+        delete_object(bucket, marker)
+        upgraded += 1
+        logger.info("Upgraded %s to PDF/A", receipt_key)
+
+    return upgraded, len(markers) - upgraded - dropped
+
+
+def _give_up(bucket: str, marker: str, body: dict[str, Any], receipt_key: str, attempts: int) -> None:
+    """Drop a receipt's marker after its last attempt, note it in the ledger and report it."""
+    logger.error("Giving up on PDF/A re-conversion of %s after %d attempts", receipt_key, attempts)
+    _update_ledger_notes(bucket, body, receipt_key, ABANDONED_NOTE)
+    delete_object(bucket, marker)
+    notify_failure(f"PDF/A re-conversion of {receipt_key} failed {attempts} times; it stays stored as plain PDF")
+
+
+def _update_ledger_notes(bucket: str, body: dict[str, Any], receipt_key: str, note: str) -> None:
+    """Replace PENDING_NOTE on the receipt's ledger rows. Failures are logged, not raised."""
+    receipt_uri = body.get("receipt_uri", f"s3://{bucket}/{receipt_key}")
+    for partition in body.get("ledger_partitions", []):
+        try:
+            update_ledger(
+                bucket, partition, lambda ledger_csv: replace_note(ledger_csv, receipt_uri, PENDING_NOTE, note)
+            )
+        except Exception:
+            logger.exception("Failed to update the ledger note of %s in partition %s", receipt_key, partition)
@@ -0,0 +1,85 @@
+"""Keep ledger entries whose partition write failed, and add them to the ledger later."""
+
+import json
+import logging
+import uuid
+from dataclasses import asdict
+from datetime import UTC, date, datetime
+from typing import Any
+
+from hsa_receipt_archiver.ledger_manager import Ledger, LedgerEntry
+from hsa_receipt_archiver.s3_manager import delete_object, fetch_object, list_keys, store_object, update_ledger
+
+logger = logging.getLogger(__name__)
+
+# One marker per failed partition write, at PENDING_PREFIX + partition + "/" + a unique name.
+PENDING_PREFIX = "pending-ledger/"
+
+_DATE_FIELDS = ("service_date", "payment_date")
+
+
+def queue_ledger_entries(bucket: str, partition: str, entries: list[LedgerEntry], source: str) -> None:
+    """Store entries that couldn't be written to a partition, for replay_ledger_entries to add.
+
+    source names where the entries came from, such as the raw email's key, for the logs.
+    """
+    body = {
+        "partition": partition,
+        "source": source,
+        "queued_at": datetime.now(tz=UTC).isoformat(),
+        "entries": [_entry_to_json(entry) for entry in entries],
+    }
+    marker = f"{PENDING_PREFIX}{partition}/{uuid.uuid4().hex}.json"
+    store_object(bucket, marker, json.dumps(body).encode("utf-8"), "application/json")
+    logger.info("Queued %d ledger entries from %s for partition %s", len(entries), source, partition)
+
+
+def replay_ledger_entries(bucket: str) -> tuple[int, int]:
+    """Add every queued batch of entries to its partition. Returns (replayed, still pending).
+
+    Entries whose receipt URI is already in the partition are skipped, so a batch that was
+    written but whose marker couldn't be deleted isn't added twice. Batches that fail again
+    stay queued for the next run.
+    """
+    replayed = pending = 0
+    for marker in list_keys(bucket, PENDING_PREFIX):
+        data = fetch_object(bucket, marker)
+        if data is None:
+            continue
+        body = json.loads(data)
+        entries = [_entry_from_json(entry) for entry in body["entries"]]
+        try:
+            update_ledger(
+                bucket, body["partition"], lambda ledger_csv, entries=entries: _add_missing(ledger_csv, entries)
+            )
+        except Exception:
+            logger.exception("Failed to replay %d ledger entries from %s", len(entries), body.get("source"))
+            pending += 1
+            continue
+        delete_object(bucket, marker)
+        replayed += 1
+        logger.info("Replayed %d ledger entries into partition %s", len(entries), body["partition"])
+
+    return replayed, pending
+
+
+def _add_missing(ledger_csv: str | None, entries: list[LedgerEntry]) -> str:
+    ledger = Ledger.from_csv(ledger_csv)
+    present = {row.receipt_s3_uri for row in ledger.rows}
+    for entry in entries:
+        if entry.receipt_s3_uri not in present:
+            ledger.append(entry)
+    return ledger.to_csv()
+
+
+def _entry_to_json(entry: LedgerEntry) -> dict[str, Any]:
+    fields = asdict(entry)
+    for name in _DATE_FIELDS:
+        if fields[name] is not None:
+            fields[name] = fields[name].isoformat()
+    return fields
+
+
+def _entry_from_json(fields: dict[str, Any]) -> LedgerEntry:
+    dates = {name: date.fromisoformat(fields[name]) if fields[name] else None for name in _DATE_FIELDS}
+    return LedgerEntry(**{**fields, **dates})
@@ -1,13 +1,43 @@
 """S3 operations for storing receipts and managing the ledger."""
 
+import hashlib
+import logging
+import os
+import random
 import re
+import time
+from collections.abc import Callable
 
-import boto3
 from botocore.exceptions import ClientError
 
-S3_CLIENT = boto3.client("s3")
+from hsa_receipt_archiver.aws_clients import LazyClient
+from hsa_receipt_archiver.ledger_manager import merge_ledgers, split_ledger
 
+logger = logging.getLogger(__name__)
+
+S3_CLIENT = LazyClient("s3")
+
+# The read-only merged view of every partition, rebuilt by rebuild_merged_ledger. The
+# partitions are the editable source.
 LEDGER_KEY = "ledger/hsa-receipts.csv"
+LEDGER_PREFIX = "ledger/"
+# Object metadata holding the SHA-256 of the merged view as rebuild_merged_ledger wrote it. It
+# lands in the same write as the view, so a view whose body no longer matches was edited by hand.
+LEDGER_VIEW_HASH_METADATA = "content-sha256"
+LEDGER_MAX_ATTEMPTS = int(os.environ.get("LEDGER_MAX_ATTEMPTS", "6"))
+
+# Error codes S3 returns when a conditional write loses a race with another writer.
+_CONFLICT_ERROR_CODES = frozenset({"PreconditionFailed", "ConditionalRequestConflict"})
+
+_PARTITION_KEY_RE = re.compile(r"^ledger/(\d{4}|undated)\.csv$")
+
+
+class LedgerConflictError(RuntimeError):
+    """Raised when a ledger update keeps losing the conditional-write race to other writers."""
+
+
+class MergedLedgerEditedError(RuntimeError):
+    """Raised instead of overwriting a merged ledger view that was edited since it was last rebuilt."""
 
 
 def fetch_raw_email(bucket: str, key: str) -> bytes:
@@ -20,7 +50,8 @@ def store_receipt(bucket: str, pdf_data: bytes, receipt_date: str, provider: str
     """Store a PDF/A receipt in S3. Returns the S3 URI.
 
     Naming: receipts/{year}/{date}_{provider}_{short_description}.pdf
-    Appends _2, _3, etc. on collisions.
+    Appends _2, _3, etc. on collisions. The put is conditional on the key not existing,
+    so concurrent writers racing for the same name never overwrite each other.
     """
     year = receipt_date[:4]
     provider_slug = _sanitize(provider)
@@ -29,18 +60,34 @@ def store_receipt(bucket: str, pdf_data: bytes, receipt_date: str, provider: str
 
     receipt_key = f"receipts/{year}/{base_name}.pdf"
     counter = 2
-    while _key_exists(bucket, receipt_key):
-        receipt_key = f"receipts/{year}/{base_name}_{counter}.pdf"
-        counter += 1
+    while True:
+        while _key_exists(bucket, receipt_key):
+            receipt_key = f"receipts/{year}/{base_name}_{counter}.pdf"
+            counter += 1
+        try:
+            S3_CLIENT.put_object(
+                Bucket=bucket, Key=receipt_key, Body=pdf_data, ContentType="application/pdf", IfNoneMatch="*"
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in _CONFLICT_ERROR_CODES:
+                raise
+            continue
+        return f"s3://{bucket}/{receipt_key}"
 
-    S3_CLIENT.put_object(Bucket=bucket, Key=receipt_key, Body=pdf_data, ContentType="application/pdf")
-    return f"s3://{bucket}/{receipt_key}"
 
+def ledger_partition_key(partition: str) -> str:
+    """Return the S3 key of a ledger partition, e.g. ledger/2025.csv."""
+    return f"{LEDGER_PREFIX}{partition}.csv"
 
-def fetch_ledger(bucket: str) -> str | None:
-    """Fetch the CSV ledger from S3. Returns None if it doesn't exist yet."""
+
+def fetch_ledger(bucket: str, partition: str | None = None) -> str | None:
+    """Fetch a CSV ledger partition from S3, or the merged view if no partition is given.
+
+    Returns None if it doesn't exist yet.
+    """
+    key = LEDGER_KEY if partition is None else ledger_partition_key(partition)
     try:
-        response = S3_CLIENT.get_object(Bucket=bucket, Key=LEDGER_KEY)
+        response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
     except ClientError as e:
         if e.response["Error"]["Code"] == "NoSuchKey":
             return None
@@ -48,14 +95,131 @@ def fetch_ledger(bucket: str) -> str | None:
     return response["Body"].read().decode("utf-8")
 
 
-def store_ledger(bucket: str, ledger_data: str) -> None:
-    """Upload the updated CSV ledger to S3."""
-    S3_CLIENT.put_object(
-        Bucket=bucket,
-        Key=LEDGER_KEY,
-        Body=ledger_data.encode("utf-8"),
-        ContentType="text/csv",
-    )
+def update_ledger(bucket: str, partition: str, merge: Callable[[str | None], str]) -> str:
+    """Apply merge to a ledger partition and store the result. Returns the stored CSV.
+
+    The write is conditional on the partition's ETag (or on its absence), so a concurrent
+    writer can never be silently overwritten. On a lost race the partition is re-fetched
+    and merge is applied again to the fresh copy, so merge must be safe to re-run.
+
+    A partition that doesn't exist yet is seeded with that year's rows from the merged
+    view, which carries the rows of the pre-partitioning ledger.
+    """
+    key = ledger_partition_key(partition)
+    for attempt in range(1, LEDGER_MAX_ATTEMPTS + 1):
+        ledger_csv, etag = _fetch_ledger_versioned(bucket, key)
+        if etag is None:
+            ledger_csv = _merged_view_partitions(bucket).get(partition)
+        updated = merge(ledger_csv)
+        condition = {"IfMatch": etag} if etag is not None else {"IfNoneMatch": "*"}
+        try:
+            S3_CLIENT.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=updated.encode("utf-8"),
+                ContentType="text/csv",
+                **condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in _CONFLICT_ERROR_CODES:
+                raise
+            logger.warning("Ledger %s changed during update (attempt %d/%d)", key, attempt, LEDGER_MAX_ATTEMPTS)
+            if attempt < LEDGER_MAX_ATTEMPTS:
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+            continue
+        return updated
+
+    raise LedgerConflictError(f"Update of {key} lost the write race {LEDGER_MAX_ATTEMPTS} times")
+
+
+def rebuild_merged_ledger(bucket: str) -> str:
+    """Regenerate the merged ledger view from the partitions. Returns the stored CSV.
+
+    Years in the current view that have no partition yet are first copied into one, so every
+    row lives in a partition and the view can always be deleted safely. Raises
+    MergedLedgerEditedError, leaving the view alone, if its body no longer matches the hash
+    stored with it at the last rebuild (or it has none), i.e. someone edited the view instead
+    of a partition. The write is conditional on the view's ETag, so an edit landing
+    mid-rebuild isn't lost either.
+    """
+    for attempt in range(1, LEDGER_MAX_ATTEMPTS + 1):
+        try:
+            response = S3_CLIENT.get_object(Bucket=bucket, Key=LEDGER_KEY)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchKey":
+                raise
+            view_csv = view_etag = None
+        else:
+            view_csv = response["Body"].read().decode("utf-8")
+            view_etag = response["ETag"]
+
+        partitions = {partition: fetch_ledger(bucket, partition) for partition in _list_ledger_partitions(bucket)}
+        if view_csv is not None:
+            for partition, ledger_csv in split_ledger(view_csv).items():
+                if partitions.get(partition) is None:
+                    partitions[partition] = _seed_partition(bucket, partition, ledger_csv)
+            if response.get("Metadata", {}).get(LEDGER_VIEW_HASH_METADATA) != _sha256(view_csv):
+                raise MergedLedgerEditedError(
+                    f"{LEDGER_KEY} was edited since it was last rebuilt; move the edits into the "
+                    f"{LEDGER_PREFIX}<year>.csv partitions and delete it to resume rebuilding"
+                )
+
+        merged = merge_ledgers([partitions[p] or "" for p in sorted(partitions)])
+        condition = {"IfMatch": view_etag} if view_etag is not None else {"IfNoneMatch": "*"}
+        try:
+            S3_CLIENT.put_object(
+                Bucket=bucket,
+                Key=LEDGER_KEY,
+                Body=merged.encode("utf-8"),
+                ContentType="text/csv",
+                Metadata={LEDGER_VIEW_HASH_METADATA: _sha256(merged)},
+                **condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in _CONFLICT_ERROR_CODES:
+                raise
+            logger.warning("Merged ledger changed during rebuild (attempt %d/%d)", attempt, LEDGER_MAX_ATTEMPTS)
+            if attempt < LEDGER_MAX_ATTEMPTS:
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+            continue
+
+        logger.info("Rebuilt merged ledger from %d partitions", len(partitions))
+        return merged
+
+    raise LedgerConflictError(f"Rebuild of {LEDGER_KEY} lost the write race {LEDGER_MAX_ATTEMPTS} times")
+
+
+def fetch_object(bucket: str, key: str) -> bytes | None:
+    """Fetch an object from S3. Returns None if it doesn't exist."""
+    try:
+        response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            return None
+        raise
+    return response["Body"].read()
+
+
+def store_object(bucket: str, key: str, data: bytes, content_type: str) -> None:
+    """Upload an object to S3, overwriting any existing object."""
+    S3_CLIENT.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type)
+
+
+def delete_object(bucket: str, key: str) -> None:
+    """Delete an object from S3. Deleting a missing key is not an error."""
+    S3_CLIENT.delete_object(Bucket=bucket, Key=key)
+
+
+def list_keys(bucket: str, prefix: str) -> list[str]:
+    """List every key under a prefix."""
+    keys: list[str] = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = S3_CLIENT.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in response.get("Contents", []))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
 
 
 def tag_raw_email(bucket: str, key: str) -> None:
@@ -67,6 +231,60 @@ def tag_raw_email(bucket: str, key: str) -> None:
     )
 
 
+def is_raw_email_processed(bucket: str, key: str) -> bool:
+    """Check whether a raw email has already been tagged as processed."""
+    response = S3_CLIENT.get_object_tagging(Bucket=bucket, Key=key)
+    return {"Key": "status", "Value": "processed"} in response["TagSet"]
+
+
+def _fetch_ledger_versioned(bucket: str, key: str) -> tuple[str | None, str | None]:
+    """Fetch a CSV ledger object and its ETag. Returns (None, None) if it doesn't exist yet."""
+    try:
+        response = S3_CLIENT.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            return None, None
+        raise
+    return response["Body"].read().decode("utf-8"), response["ETag"]
+
+
+def _seed_partition(bucket: str, partition: str, ledger_csv: str) -> str | None:
+    """Create a partition from the merged view's rows, unless another writer created it first.
+
+    Returns the partition's contents.
+    """
+    try:
+        S3_CLIENT.put_object(
+            Bucket=bucket,
+            Key=ledger_partition_key(partition),
+            Body=ledger_csv.encode("utf-8"),
+            ContentType="text/csv",
+            IfNoneMatch="*",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in _CONFLICT_ERROR_CODES:
+            raise
+        return fetch_ledger(bucket, partition)
+    logger.info("Copied %s rows from the merged ledger into their own partition", partition)
+    return ledger_csv
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _merged_view_partitions(bucket: str) -> dict[str, str]:
+    """Split the merged ledger view into per-partition ledgers."""
+    merged = fetch_ledger(bucket)
+    return split_ledger(merged) if merged is not None else {}
+
+
+def _list_ledger_partitions(bucket: str) -> list[str]:
+    """List the partitions that have their own ledger object."""
+    matches = (_PARTITION_KEY_RE.match(key) for key in list_keys(bucket, LEDGER_PREFIX))
+    return [match.group(1) for match in matches if match]
+
+
 def _key_exists(bucket: str, key: str) -> bool:
     """Check if an S3 key already exists."""
     try:
@@ -0,0 +1,79 @@
+"""SSM parameters cached with a TTL and refreshed in the background once stale."""
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from hsa_receipt_archiver.aws_clients import LazyClient
+
+logger = logging.getLogger(__name__)
+
+# A cached value is fresh for this long. After that it is still returned, while a background
+# refresh fetches the current one, so a rotated API key or sender list takes effect within a TTL.
+SSM_CACHE_TTL_SECONDS = float(os.environ.get("SSM_CACHE_TTL_SECONDS", "300"))
+# Past TTL + this, a value is too stale to serve and callers wait for a synchronous fetch.
+SSM_CACHE_MAX_STALE_SECONDS = float(os.environ.get("SSM_CACHE_MAX_STALE_SECONDS", "3600"))
+
+SSM_CLIENT = LazyClient("ssm")
+
+
+@dataclass(frozen=True, slots=True)
+class _Entry:
+    value: str
+    fetched_at: float
+
+
+_entries: dict[str, _Entry] = {}
+_lock = threading.Lock()
+_refreshing = False
+
+
+def get_parameter(name: str, batch: Iterable[str] = ()) -> str:
+    """Return a decrypted SSM parameter from the cache, fetching it if missing or too stale.
+
+    Any fetch, synchronous or background, also refreshes the names in batch, in the same
+    GetParameters call.
+    """
+    entry = _entries.get(name)
+    age = time.monotonic() - entry.fetched_at if entry is not None else None
+    if entry is None or age >= SSM_CACHE_TTL_SECONDS + SSM_CACHE_MAX_STALE_SECONDS:
+        _fetch([name, *batch])
+        return _entries[name].value
+    if age >= SSM_CACHE_TTL_SECONDS:
+        _refresh_in_background([name, *batch])
+    return entry.value
+
+
+def _refresh_in_background(names: list[str]) -> None:
+    """Start a refresh unless one is already running."""
+    global _refreshing
+    with _lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=_background_fetch, args=(names,), name="ssm-refresh", daemon=True).start()
+
+
+def _background_fetch(names: list[str]) -> None:
+    global _refreshing
+    try:
+        _fetch(names)
+    except Exception:
+        logger.warning("Background refresh of SSM parameters failed; serving cached values", exc_info=True)
+    finally:
+        with _lock:
+            _refreshing = False
+
+
+def _fetch(names: list[str]) -> None:
+    """Fetch parameters in one GetParameters call (up to 10 names) and cache them."""
+    unique = list(dict.fromkeys(names))
+    response = SSM_CLIENT.get_parameters(Names=unique, WithDecryption=True)
+    fetched_at = time.monotonic()
+    for parameter in response["Parameters"]:
+        _entries[parameter["Name"]] = _Entry(parameter["Value"], fetched_at)
+    if response.get("InvalidParameters"):
+        raise KeyError(f"SSM parameters not found: {', '.join(response['InvalidParameters'])}")
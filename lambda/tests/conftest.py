@@ -1,12 +1,17 @@
 """Shared test fixtures for HSA receipt archiver tests."""
 
+import hashlib
+import io
 import os
+from collections.abc import Callable
 from datetime import date
 from email.message import EmailMessage
+from typing import Any
 
 import pytest
+from botocore.exceptions import ClientError
 
-# Set dummy AWS credentials so module-level boto3.client() calls don't fail during import.
+# Set dummy AWS credentials so boto3 clients created during tests don't fail.
 os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
 os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
 os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -88,3 +93,65 @@ def make_mime_email() -> type[
         return msg.as_bytes()
 
     return _make  # type: ignore[return-value]
+
+
+class FakeS3:
+    """In-memory stand-in for the subset of the S3 client API used by s3_manager.
+
+    Honors If-Match / If-None-Match on put_object the way S3 conditional writes do, and keeps
+    each object's user metadata.
+    Set before_put to run a callback (e.g. a competing writer) just before each put lands.
+    """
+
+    def __init__(self) -> None:
+        self.objects: dict[str, bytes] = {}
+        self.metadata: dict[str, dict[str, str]] = {}
+        self.put_attempts = 0
+        self.before_put: Callable[[FakeS3, str], None] | None = None
+
+    def get_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": ""}}, "GetObject")
+        data = self.objects[Key]
+        return {"Body": io.BytesIO(data), "ETag": self._etag(data), "Metadata": self.metadata.get(Key, {})}
+
+    def head_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": ""}}, "HeadObject")
+        return {"ETag": self._etag(self.objects[Key])}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs: Any) -> dict[str, Any]:
+        self.put_attempts += 1
+        if self.before_put is not None:
+            self.before_put(self, Key)
+
+        current = self.objects.get(Key)
+        if_match = kwargs.get("IfMatch")
+        if_none_match = kwargs.get("IfNoneMatch")
+        if if_match is not None and (current is None or self._etag(current) != if_match):
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": ""}}, "PutObject")
+        if if_none_match == "*" and current is not None:
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": ""}}, "PutObject")
+
+        self.objects[Key] = Body
+        self.metadata[Key] = kwargs.get("Metadata", {})
+        return {"ETag": self._etag(Body)}
+
+    def delete_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        self.objects.pop(Key, None)
+        self.metadata.pop(Key, None)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs: Any) -> dict[str, Any]:
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        return {"Contents": [{"Key": key} for key in keys], "IsTruncated": False}
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+@pytest.fixture
+def fake_s3() -> FakeS3:
+    """A fresh in-memory S3 stand-in."""
+    return FakeS3()
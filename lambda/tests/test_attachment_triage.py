@@ -0,0 +1,74 @@
+"""Tests for attachment_triage module."""
+
+import io
+
+import pytest
+from PIL import Image
+
+from hsa_receipt_archiver.attachment_triage import triage_attachments
+from hsa_receipt_archiver.email_parser import Attachment
+
+
+def _png(width: int, height: int, seed: int = 0, mode: str = "RGB") -> bytes:
+    """A noisy PNG, so it compresses to well over the minimum attachment size."""
+    buf = io.BytesIO()
+    Image.effect_noise((width, height), 50 + seed).convert(mode).save(buf, "PNG")
+    return buf.getvalue()
+
+
+RECEIPT = _png(400, 600)
+
+
+def test_keeps_receipt_sized_attachments_in_order() -> None:
+    other = _png(400, 600, seed=1)
+    pdf = b"%PDF-1.4\n" + b"0" * 4096
+    attachments = [
+        Attachment("a.png", "image/png", RECEIPT),
+        Attachment("b.pdf", "application/pdf", pdf),
+        Attachment("c.png", "image/png", other),
+    ]
+
+    assert triage_attachments(attachments) == attachments
+
+
+def test_skips_tiny_attachments(caplog: pytest.LogCaptureFixture) -> None:
+    with caplog.at_level("INFO"):
+        kept = triage_attachments([Attachment("pixel.gif", "image/gif", b"GIF89a" + b"\0" * 40)])
+
+    assert kept == []
+    assert "pixel.gif" in caplog.text
+    assert "smaller than" in caplog.text
+
+
+def test_skips_duplicate_content(caplog: pytest.LogCaptureFixture) -> None:
+    original = Attachment("scan.png", "image/png", RECEIPT)
+
+    with caplog.at_level("INFO"):
+        kept = triage_attachments([original, Attachment("scan-copy.png", "image/png", RECEIPT)])
+
+    assert kept == [original]
+    assert "duplicate of scan.png" in caplog.text
+
+
+def test_skips_images_below_minimum_dimension(caplog: pytest.LogCaptureFixture) -> None:
+    with caplog.at_level("INFO"):
+        kept = triage_attachments([Attachment("banner.png", "image/png", _png(600, 40))])
+
+    assert kept == []
+    assert "600x40" in caplog.text
+
+
+def test_skips_small_inline_images_but_keeps_attached_ones() -> None:
+    logo = _png(120, 120, mode="L")
+    assert len(logo) < 20480
+
+    inline = Attachment("logo.png", "image/png", logo, content_id="<logo@example.com>")
+    attached = Attachment("logo.png", "image/png", logo)
+
+    assert triage_attachments([inline]) == []
+    assert triage_attachments([attached]) == [attached]
+
+
+def test_keeps_image_pillow_cannot_read() -> None:
+    attachment = Attachment("odd.webp", "image/webp", b"RIFF" + b"\0" * 2048)
+    assert triage_attachments([attachment]) == [attachment]
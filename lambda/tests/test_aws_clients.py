@@ -0,0 +1,64 @@
+"""Tests for aws_clients module."""
+
+import os
+import subprocess
+import sys
+from collections.abc import Iterator
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hsa_receipt_archiver import aws_clients
+from hsa_receipt_archiver.aws_clients import LazyClient, get_client
+
+
+@pytest.fixture(autouse=True)
+def _fresh_clients() -> Iterator[None]:
+    aws_clients._clients.clear()
+    yield
+    aws_clients._clients.clear()
+
+
+@patch("boto3.client")
+def test_get_client_creates_one_client_per_service(mock_client: MagicMock) -> None:
+    assert get_client("s3") is get_client("s3")
+    get_client("sns")
+
+    assert [c.args for c in mock_client.call_args_list] == [("s3",), ("sns",)]
+    assert all(c.kwargs["config"] is not None for c in mock_client.call_args_list)
+
+
+@patch("boto3.client")
+def test_lazy_client_creates_nothing_until_used(mock_client: MagicMock) -> None:
+    client = LazyClient("s3")
+    mock_client.assert_not_called()
+
+    client.get_object(Bucket="b", Key="k")
+
+    mock_client.assert_called_once()
+    mock_client.return_value.get_object.assert_called_once_with(Bucket="b", Key="k")
+
+
+def test_client_config_applies_settings() -> None:
+    with (
+        patch.object(aws_clients, "AWS_MAX_POOL_CONNECTIONS", 17),
+        patch.object(aws_clients, "AWS_CONNECT_TIMEOUT_SECONDS", 1.5),
+        patch.object(aws_clients, "AWS_READ_TIMEOUT_SECONDS", 9.0),
+        patch.object(aws_clients, "AWS_RETRY_MODE", "standard"),
+        patch.object(aws_clients, "AWS_MAX_ATTEMPTS", 6),
+    ):
+        config = aws_clients.client_config()
+
+    assert config.max_pool_connections == 17
+    assert (config.connect_timeout, config.read_timeout) == (1.5, 9.0)
+    assert config.retries == {"mode": "standard", "max_attempts": 6}
+    assert config.tcp_keepalive is True
+
+
+def test_pool_size_follows_attachment_workers() -> None:
+    env = {"MAX_ATTACHMENT_WORKERS": "12"}
+    code = "from hsa_receipt_archiver import aws_clients; print(aws_clients.AWS_MAX_POOL_CONNECTIONS)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], env={**os.environ, **env}, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "13"
@@ -1,12 +1,32 @@
 """Tests for claude_client module."""
 
 import json
+import logging
+import os
+import subprocess
+import sys
+from collections.abc import Iterator
 from unittest.mock import MagicMock, patch
 
 import pytest
 from anthropic.types import TextBlock
 
-from hsa_receipt_archiver.claude_client import check_hsa_eligibility
+from hsa_receipt_archiver import claude_client
+from hsa_receipt_archiver.claude_client import (
+    MULTIPAGE_USER_PROMPT,
+    _get_client,
+    _record_connection_event,
+    check_hsa_eligibility,
+    check_multipage_eligibility,
+)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_client_cache() -> Iterator[None]:
+    """Each test starts without a pooled client so patched SDK classes take effect."""
+    claude_client._clients.clear()
+    yield
+    claude_client._clients.clear()
 
 
 def _make_response(items: list[dict[str, object]] | None = None, text: str | None = None) -> MagicMock:
@@ -35,7 +55,7 @@ def _single_eligible_item(**overrides: object) -> dict[str, object]:
     return base
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_single_eligible_result(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -48,7 +68,7 @@ def test_single_eligible_result(mock_anthropic_cls: MagicMock) -> None:
     assert results[0].amount == 100.0
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_multiple_results(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -64,7 +84,7 @@ def test_multiple_results(mock_anthropic_cls: MagicMock) -> None:
     assert results[1].description == "Visit 2"
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_missing_amount_forces_ineligible(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -75,7 +95,7 @@ def test_missing_amount_forces_ineligible(mock_anthropic_cls: MagicMock) -> None
     assert "required fields" in results[0].reasoning.lower()
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_missing_provider_forces_ineligible(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -85,7 +105,7 @@ def test_missing_provider_forces_ineligible(mock_anthropic_cls: MagicMock) -> No
     assert results[0].is_eligible is False
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_both_dates_none_forces_ineligible(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -97,7 +117,7 @@ def test_both_dates_none_forces_ineligible(mock_anthropic_cls: MagicMock) -> Non
     assert results[0].is_eligible is False
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_one_date_present_stays_eligible(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -109,7 +129,7 @@ def test_one_date_present_stays_eligible(mock_anthropic_cls: MagicMock) -> None:
     assert results[0].is_eligible is True
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_image_content_type_uses_image_block(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -121,7 +141,7 @@ def test_image_content_type_uses_image_block(mock_anthropic_cls: MagicMock) -> N
     assert content[0]["type"] == "image"
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_pdf_content_type_uses_document_block(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -133,7 +153,7 @@ def test_pdf_content_type_uses_document_block(mock_anthropic_cls: MagicMock) ->
     assert content[0]["type"] == "document"
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_uses_correct_model(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -144,17 +164,18 @@ def test_uses_correct_model(mock_anthropic_cls: MagicMock) -> None:
     assert call_kwargs["model"] == "claude-haiku-4-5-20251001"
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_passes_api_key(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
     mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
 
     check_hsa_eligibility("my-secret-key", b"data", "image/jpeg")
-    mock_anthropic_cls.assert_called_once_with(api_key="my-secret-key")
+    mock_anthropic_cls.assert_called_once()
+    assert mock_anthropic_cls.call_args.kwargs["api_key"] == "my-secret-key"
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_empty_response_raises_value_error(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -164,7 +185,7 @@ def test_empty_response_raises_value_error(mock_anthropic_cls: MagicMock) -> Non
         check_hsa_eligibility("api-key", b"data", "image/jpeg")
 
 
-@patch("hsa_receipt_archiver.claude_client.anthropic.Anthropic")
+@patch("anthropic.Anthropic")
 def test_markdown_fenced_json_is_parsed(mock_anthropic_cls: MagicMock) -> None:
     mock_client = MagicMock()
     mock_anthropic_cls.return_value = mock_client
@@ -174,3 +195,190 @@ def test_markdown_fenced_json_is_parsed(mock_anthropic_cls: MagicMock) -> None:
     results = check_hsa_eligibility("api-key", b"data", "image/jpeg")
     assert len(results) == 1
     assert results[0].is_eligible is True
+
+
+@patch("anthropic.Anthropic")
+def test_client_reused_across_calls(mock_anthropic_cls: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    check_hsa_eligibility("api-key", b"data", "image/jpeg")
+    check_hsa_eligibility("api-key", b"data", "image/jpeg")
+
+    mock_anthropic_cls.assert_called_once()
+    assert mock_client.messages.create.call_count == 2
+
+
+@patch("anthropic.Anthropic")
+def test_rotated_key_replaces_old_client_without_closing_it(mock_anthropic_cls: MagicMock) -> None:
+    old_client, new_client = MagicMock(), MagicMock()
+    mock_anthropic_cls.side_effect = [old_client, new_client]
+
+    assert _get_client("old-key") is old_client
+    assert _get_client("new-key") is new_client
+
+    old_client.close.assert_not_called()
+    assert claude_client._clients == {"new-key": new_client}
+
+
+def test_real_client_built_with_pool_settings() -> None:
+    client = _get_client("api-key")
+    try:
+        assert client is _get_client("api-key")
+        assert client.api_key == "api-key"
+
+        http_client = client._client
+        pool = http_client._transport._pool
+        assert pool._max_connections == claude_client.ANTHROPIC_MAX_CONNECTIONS
+        assert pool._max_keepalive_connections == claude_client.ANTHROPIC_MAX_CONNECTIONS
+        assert pool._keepalive_expiry == claude_client.ANTHROPIC_KEEPALIVE_SECONDS
+
+        timeout = http_client.timeout
+        assert timeout.connect == claude_client.ANTHROPIC_CONNECT_TIMEOUT_SECONDS
+        assert timeout.read == timeout.write == timeout.pool == claude_client.ANTHROPIC_TIMEOUT_SECONDS
+
+        # Connections are kept alive between calls rather than closed after each request.
+        assert http_client.headers["Connection"] == "keep-alive"
+    finally:
+        client.close()
+
+
+def test_connection_setup_events_are_accumulated() -> None:
+    claude_client._connection_setup.seconds = 0.0
+    claude_client._connection_setup.connections = 0
+
+    with patch("hsa_receipt_archiver.claude_client.time.perf_counter", side_effect=[1.0, 1.5, 2.0, 2.25]):
+        _record_connection_event("connection.connect_tcp.started", {})
+        _record_connection_event("connection.connect_tcp.complete", {})
+        _record_connection_event("connection.start_tls.started", {})
+        _record_connection_event("connection.start_tls.complete", {})
+    _record_connection_event("http11.send_request_headers.started", {})
+
+    assert claude_client._connection_setup.seconds == 0.75
+    assert claude_client._connection_setup.connections == 1
+
+
+@patch("hsa_receipt_archiver.claude_client.prepare_image_for_model", return_value=(b"small", "image/jpeg"))
+@patch("anthropic.Anthropic")
+def test_image_payload_is_preprocessed(mock_anthropic_cls: MagicMock, mock_prepare: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    check_hsa_eligibility("api-key", b"huge-png", "image/png")
+
+    mock_prepare.assert_called_once_with(b"huge-png", "image/png")
+    source = mock_client.messages.create.call_args[1]["messages"][0]["content"][0]["source"]
+    assert source["media_type"] == "image/jpeg"
+    assert source["data"] == "c21hbGw="
+
+
+@patch("hsa_receipt_archiver.claude_client.prepare_image_for_model")
+@patch("anthropic.Anthropic")
+def test_pdf_payload_is_not_preprocessed(mock_anthropic_cls: MagicMock, mock_prepare: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    check_hsa_eligibility("api-key", b"pdf", "application/pdf")
+
+    mock_prepare.assert_not_called()
+
+
+STATEMENT_TEXT = "Patient statement  Dr Smith Family Medicine  2025-01-15  Office visit copay  $30.00\n" * 5
+
+
+@patch("hsa_receipt_archiver.claude_client.extract_pdf_text", return_value=STATEMENT_TEXT)
+@patch("anthropic.Anthropic")
+def test_pdf_with_text_layer_sends_text(mock_anthropic_cls: MagicMock, mock_extract: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+    mock_client.messages.create.return_value.usage.input_tokens = 250
+
+    check_hsa_eligibility("api-key", b"%PDF-1.7 /Type /Page", "application/pdf")
+
+    content = mock_client.messages.create.call_args[1]["messages"][0]["content"]
+    assert content[0]["type"] == "text"
+    assert STATEMENT_TEXT.strip() in content[0]["text"]
+
+
+@patch("hsa_receipt_archiver.claude_client.extract_pdf_text", return_value=STATEMENT_TEXT)
+@patch("anthropic.Anthropic")
+def test_text_fast_path_savings_compare_whole_requests(
+    mock_anthropic_cls: MagicMock, mock_extract: MagicMock, caplog: pytest.LogCaptureFixture
+) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+    mock_client.messages.create.return_value.usage.input_tokens = 900
+
+    with caplog.at_level(logging.INFO, logger="hsa_receipt_archiver.claude_client"):
+        check_hsa_eligibility("api-key", b"%PDF-1.7 /Type /Page", "application/pdf")
+
+    # The estimate replaces the text block with one page image plus the same text, so the
+    # saving is the page image less the wrapper around the text.
+    text_block = claude_client.PDF_TEXT_PROMPT.format(text=STATEMENT_TEXT.strip())
+    saved = claude_client._TOKENS_PER_PDF_PAGE_IMAGE + len(STATEMENT_TEXT.strip()) // 4 - len(text_block) // 4
+    assert f"estimated_document_input_tokens={900 + saved}, estimated_tokens_saved={saved}" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "setting", ["PDF_TEXT_MIN_CHARS=50", "MODEL_IMAGE_MAX_EDGE=1000", "MODEL_IMAGE_JPEG_QUALITY=70"]
+)
+def test_prompt_version_changes_with_model_input_settings(setting: str) -> None:
+    name, value = setting.split("=")
+    code = "from hsa_receipt_archiver.claude_client import PROMPT_VERSION; print(PROMPT_VERSION)"
+    env = {key: val for key, val in os.environ.items() if key != name}
+
+    default = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    changed = subprocess.run(
+        [sys.executable, "-c", code], env={**env, name: value}, capture_output=True, text=True, check=True
+    )
+
+    assert default.stdout.strip() == claude_client.PROMPT_VERSION
+    assert changed.stdout.strip() != default.stdout.strip()
+
+
+@patch("hsa_receipt_archiver.claude_client.extract_pdf_text", return_value="  \f  ")
+@patch("anthropic.Anthropic")
+def test_scanned_pdf_without_text_sends_document(mock_anthropic_cls: MagicMock, mock_extract: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    check_hsa_eligibility("api-key", b"%PDF-1.7", "application/pdf")
+
+    content = mock_client.messages.create.call_args[1]["messages"][0]["content"]
+    assert content[0]["type"] == "document"
+
+
+@patch("hsa_receipt_archiver.claude_client.extract_pdf_text", side_effect=RuntimeError("gs failed"))
+@patch("anthropic.Anthropic")
+def test_text_extraction_failure_sends_document(mock_anthropic_cls: MagicMock, mock_extract: MagicMock) -> None:
+    mock_client = MagicMock()
+    mock_anthropic_cls.return_value = mock_client
+    mock_client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    check_hsa_eligibility("api-key", b"%PDF-1.7", "application/pdf")
+
+    content = mock_client.messages.create.call_args[1]["messages"][0]["content"]
+    assert content[0]["type"] == "document"
+
+
+@patch("hsa_receipt_archiver.claude_client.prepare_image_for_model", side_effect=lambda data, ct: (data, ct))
+@patch("anthropic.Anthropic")
+def test_multipage_sends_all_pages_in_one_request(mock_anthropic_cls: MagicMock, mock_prepare: MagicMock) -> None:
+    client = mock_anthropic_cls.return_value
+    client.messages.create.return_value = _make_response([_single_eligible_item()])
+
+    results = check_multipage_eligibility("api-key", [(b"page-1", "image/jpeg"), (b"page-2", "image/png")])
+
+    assert len(results) == 1
+    client.messages.create.assert_called_once()
+    content = client.messages.create.call_args.kwargs["messages"][0]["content"]
+    assert [block["type"] for block in content] == ["image", "image", "text"]
+    assert content[1]["source"]["media_type"] == "image/png"
+    assert content[2]["text"] == MULTIPAGE_USER_PROMPT
+    assert mock_prepare.call_count == 2
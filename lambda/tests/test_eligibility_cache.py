@@ -0,0 +1,82 @@
+"""Tests for eligibility_cache module."""
+
+import hashlib
+import json
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from hsa_receipt_archiver.claude_client import EligibilityResult
+from hsa_receipt_archiver.eligibility_cache import cache_key, get_cached_results, put_cached_results
+from tests.conftest import FakeS3
+
+DIGEST = hashlib.sha256(b"data").digest()
+
+
+def _result(**overrides: object) -> EligibilityResult:
+    defaults: dict[str, object] = {
+        "is_eligible": False,
+        "description": "Sunscreen",
+        "short_description": "Sunscreen",
+        "category": "Other",
+        "amount": 9.99,
+        "provider": "CVS",
+        "service_date": None,
+        "payment_date": "2025-06-01",
+        "reasoning": "Not a medical expense",
+    }
+    defaults.update(overrides)
+    return EligibilityResult(**defaults)  # type: ignore[arg-type]
+
+
+def test_cache_key_depends_on_digest_and_prompt_version() -> None:
+    key = cache_key(DIGEST, "image/jpeg")
+    assert key.startswith("eligibility-cache/")
+    assert key == cache_key(DIGEST, "image/jpeg")
+    assert key != cache_key(hashlib.sha256(b"other").digest(), "image/jpeg")
+    assert key != cache_key(DIGEST, "image/png")
+    with patch("hsa_receipt_archiver.eligibility_cache.PROMPT_VERSION", "different"):
+        assert key != cache_key(DIGEST, "image/jpeg")
+
+
+def test_put_then_get_round_trips_results(fake_s3: FakeS3) -> None:
+    results = [_result(), _result(description="Bandages", is_eligible=True)]
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        put_cached_results("bucket", DIGEST, "image/jpeg", results)
+        assert get_cached_results("bucket", DIGEST, "image/jpeg") == results
+
+
+def test_get_miss_returns_none(fake_s3: FakeS3) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        assert get_cached_results("bucket", DIGEST, "image/jpeg") is None
+
+
+def test_expired_entry_is_a_miss(fake_s3: FakeS3) -> None:
+    fake_s3.objects[cache_key(DIGEST, "image/jpeg")] = json.dumps(
+        {
+            "expires_at": (datetime.now(tz=UTC) - timedelta(seconds=1)).isoformat(),
+            "results": [],
+        }
+    ).encode()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        assert get_cached_results("bucket", DIGEST, "image/jpeg") is None
+
+
+def test_corrupt_entry_is_a_miss(fake_s3: FakeS3) -> None:
+    fake_s3.objects[cache_key(DIGEST, "image/jpeg")] = b"{not json"
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        assert get_cached_results("bucket", DIGEST, "image/jpeg") is None
+
+
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_put_failure_is_swallowed(mock_s3: MagicMock) -> None:
+    mock_s3.put_object.side_effect = RuntimeError("S3 down")
+    put_cached_results("bucket", DIGEST, "image/jpeg", [_result()])
+
+
+@patch("hsa_receipt_archiver.eligibility_cache.CACHE_TTL_DAYS", 0)
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_zero_ttl_disables_cache(mock_s3: MagicMock) -> None:
+    put_cached_results("bucket", DIGEST, "image/jpeg", [_result()])
+    assert get_cached_results("bucket", DIGEST, "image/jpeg") is None
+    mock_s3.put_object.assert_not_called()
+    mock_s3.get_object.assert_not_called()
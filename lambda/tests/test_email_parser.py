@@ -1,8 +1,12 @@
 """Tests for email_parser module."""
 
+import os
+import tracemalloc
 from collections.abc import Callable
+from email.message import Message
+from unittest.mock import MagicMock, patch
 
-from hsa_receipt_archiver.email_parser import parse_ses_email
+from hsa_receipt_archiver.email_parser import Attachment, parse_ses_email
 
 
 def test_parse_simple_text_email(make_mime_email: Callable[..., bytes]) -> None:
@@ -81,3 +85,81 @@ def test_parse_email_missing_headers() -> None:
     assert parsed.sender == ""
     assert parsed.subject == ""
     assert parsed.body.strip() == "body"
+
+
+@patch("hsa_receipt_archiver.email_parser._parse_parts")
+def test_parse_email_reads_only_headers_until_parts_accessed(
+    mock_parse_parts: MagicMock, make_mime_email: Callable[..., bytes]
+) -> None:
+    mock_parse_parts.return_value = ("", [])
+    raw = make_mime_email(sender="a@example.com", subject="Hi", attachments=[("r.pdf", "application/pdf", b"%PDF")])
+
+    parsed = parse_ses_email(raw)
+    assert (parsed.sender, parsed.subject) == ("a@example.com", "Hi")
+    mock_parse_parts.assert_not_called()
+
+    assert parsed.attachments == []
+    mock_parse_parts.assert_called_once_with(raw)
+
+
+def test_parse_email_decodes_attachment_on_first_access(make_mime_email: Callable[..., bytes]) -> None:
+    raw = make_mime_email(attachments=[("a.jpg", "image/jpeg", b"a-data"), ("b.jpg", "image/jpeg", b"b-data")])
+    attachments = parse_ses_email(raw).attachments
+
+    with patch.object(Message, "get_payload", autospec=True, side_effect=Message.get_payload) as mock_get_payload:
+        assert attachments[1].data == b"b-data"
+        assert attachments[1].data == b"b-data"
+
+    mock_get_payload.assert_called_once()
+
+
+def test_attachment_with_data_compares_by_value() -> None:
+    assert Attachment("a.jpg", "image/jpeg", b"x") == Attachment(filename="a.jpg", content_type="image/jpeg", data=b"x")
+    assert Attachment("a.jpg", "image/jpeg", b"x") != Attachment("a.jpg", "image/jpeg", b"y")
+
+
+def test_parse_email_records_content_id_of_inline_images() -> None:
+    from email.message import EmailMessage
+
+    msg = EmailMessage()
+    msg["From"] = "a@example.com"
+    msg.set_content("body")
+    msg.add_alternative('<img src="cid:logo@example.com">', subtype="html")
+    msg.get_payload()[1].add_related(b"png-data", maintype="image", subtype="png", cid="<logo@example.com>")
+    msg.add_attachment(b"pdf-data", maintype="application", subtype="pdf", filename="r.pdf")
+
+    attachments = parse_ses_email(msg.as_bytes()).attachments
+
+    assert [(a.content_type, a.content_id) for a in attachments] == [
+        ("image/png", "<logo@example.com>"),
+        ("application/pdf", ""),
+    ]
+
+
+def test_parse_email_peak_memory_stays_near_attachment_size(make_mime_email: Callable[..., bytes]) -> None:
+    payload = os.urandom(2_000_000)
+    raw = make_mime_email(attachments=[("scan.pdf", "application/pdf", payload)])
+
+    tracemalloc.start()
+    try:
+        parsed = parse_ses_email(raw)
+        assert parsed.sender
+        data = parsed.attachments[0].data
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert data == payload
+    # Parsing the whole message at once peaked around 10x the attachment size.
+    assert peak < 4 * len(payload)
+
+
+def test_parse_email_falls_back_to_stdlib_for_malformed_base64() -> None:
+    raw = (
+        b"From: a@example.com\r\nMIME-Version: 1.0\r\n"
+        b"Content-Type: multipart/mixed; boundary=b\r\n\r\n"
+        b"--b\r\nContent-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n\r\n"
+        b"JVBERi0\r\n--b--\r\n"
+    )
+
+    assert parse_ses_email(raw).attachments[0].data.startswith(b"%PDF-")
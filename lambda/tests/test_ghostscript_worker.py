@@ -0,0 +1,113 @@
+"""Tests for ghostscript_worker module."""
+
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from hsa_receipt_archiver.ghostscript_worker import GhostscriptWorker, GhostscriptWorkerError
+
+# Stands in for gs: records its arguments, reads one job per line, writes a PDF to the job's
+# first OutputFile and reports the job's status. Inputs containing "crash" kill it, inputs
+# containing "fail" fail the job.
+FAKE_GS = """\
+import pathlib, re, sys
+pathlib.Path(__file__).with_name("args.txt").write_text("\\n".join(sys.argv[1:]))
+for line in sys.stdin:
+    out = re.search(r"/OutputFile \\((.*?)\\)", line).group(1)
+    src = re.search(r"\\((\\S+)\\) \\(r\\) file runpdf", line).group(1)
+    token = re.search(r"JOBDONE (\\w+)", line).group(1)
+    data = open(src, "rb").read()
+    if b"crash" in data:
+        sys.exit(1)
+    status = "JOBFAILED" if b"fail" in data else "JOBDONE"
+    if status == "JOBDONE":
+        open(out, "wb").write(b"%PDF-1.7 converted")
+    print("**** Warning: noise before the status line")
+    print(f"\\n{status} {token}", flush=True)
+"""
+
+
+@pytest.fixture
+def fake_gs(tmp_path: Path) -> str:
+    script = tmp_path / "fake_gs.py"
+    script.write_text(FAKE_GS)
+    binary = tmp_path / "gs"
+    binary.write_text(f'#!/bin/sh\nexec {sys.executable} {script} "$@"\n')
+    binary.chmod(0o755)
+    return str(binary)
+
+
+@pytest.fixture
+def worker(fake_gs: str) -> Iterator[GhostscriptWorker]:
+    w = GhostscriptWorker(fake_gs, ["-sDEVICE=pdfwrite"])
+    yield w
+    w.stop()
+
+
+def _pdf(tmp_path: Path, name: str, body: bytes = b"") -> Path:
+    path = tmp_path / name
+    path.write_bytes(b"%PDF-1.7 " + body)
+    return path
+
+
+def test_converts_several_jobs_with_one_process(worker: GhostscriptWorker, tmp_path: Path) -> None:
+    pids = set()
+    for i in range(3):
+        output = tmp_path / f"out{i}.pdf"
+        assert worker.try_convert(_pdf(tmp_path, "input.pdf"), output, timeout=10)
+        assert output.read_bytes() == b"%PDF-1.7 converted"
+        pids.add(worker._proc.pid)
+
+    assert len(pids) == 1
+    assert list(worker._work_dir.glob("*")) == []
+
+
+def test_runs_under_safer_confined_to_work_dir(worker: GhostscriptWorker, fake_gs: str, tmp_path: Path) -> None:
+    assert worker.try_convert(_pdf(tmp_path, "input.pdf"), tmp_path / "out.pdf", timeout=10)
+
+    args = (Path(fake_gs).parent / "args.txt").read_text().splitlines()
+    assert "-dSAFER" in args
+    assert "-dNOSAFER" not in args
+    assert f"--permit-file-read={worker._work_dir}/" in args
+    assert f"--permit-file-write={worker._work_dir}/" in args
+
+
+def test_rejects_input_without_pdf_header(worker: GhostscriptWorker, tmp_path: Path) -> None:
+    postscript = tmp_path / "input.pdf"
+    postscript.write_bytes(b"%!PS-Adobe-3.0\n(/etc/passwd) (r) file")
+
+    with pytest.raises(GhostscriptWorkerError, match="no %PDF- header"):
+        worker.try_convert(postscript, tmp_path / "out.pdf", timeout=10)
+    assert worker._proc is None
+
+
+def test_failed_job_raises_and_worker_restarts(worker: GhostscriptWorker, tmp_path: Path) -> None:
+    with pytest.raises(GhostscriptWorkerError, match="job failed"):
+        worker.try_convert(_pdf(tmp_path, "fail.pdf", b"fail"), tmp_path / "out.pdf", timeout=10)
+    assert worker._proc is None
+
+    assert worker.try_convert(_pdf(tmp_path, "input.pdf"), tmp_path / "out.pdf", timeout=10)
+
+
+def test_crashed_worker_raises_and_restarts(worker: GhostscriptWorker, tmp_path: Path) -> None:
+    with pytest.raises(GhostscriptWorkerError, match="exited"):
+        worker.try_convert(_pdf(tmp_path, "crash.pdf", b"crash"), tmp_path / "out.pdf", timeout=10)
+
+    assert worker.try_convert(_pdf(tmp_path, "input.pdf"), tmp_path / "out.pdf", timeout=10)
+
+
+def test_busy_worker_declines_job(worker: GhostscriptWorker, tmp_path: Path) -> None:
+    worker._lock.acquire()
+    try:
+        assert not worker.try_convert(_pdf(tmp_path, "input.pdf"), tmp_path / "out.pdf", timeout=10)
+    finally:
+        worker._lock.release()
+
+
+def test_missing_binary_raises(tmp_path: Path) -> None:
+    worker = GhostscriptWorker(str(tmp_path / "no-such-gs"), [])
+
+    with pytest.raises(GhostscriptWorkerError, match="Could not start"):
+        worker.try_convert(_pdf(tmp_path, "input.pdf"), tmp_path / "out.pdf", timeout=10)
@@ -1,12 +1,23 @@
 """Tests for handler module."""
 
+import hashlib
+import json
 import os
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
 from datetime import UTC, date, datetime
 from unittest.mock import MagicMock, patch
 
+import pytest
+
 from hsa_receipt_archiver.claude_client import EligibilityResult
 from hsa_receipt_archiver.email_parser import Attachment, ParsedEmail
 from hsa_receipt_archiver.ledger_manager import LedgerEntry
+from hsa_receipt_archiver.pdf_converter import ConversionTimeoutError
+from hsa_receipt_archiver.pdfa_upgrade import PENDING_NOTE
 
 ENV_VARS = {
     "BUCKET_NAME": "test-bucket",
@@ -15,6 +26,23 @@ ENV_VARS = {
 }
 
 
+@pytest.fixture(autouse=True)
+def _no_eligibility_cache() -> Iterator[MagicMock]:
+    """Keep handler tests off S3 by making every eligibility cache lookup a miss.
+
+    No email counts as already processed. Attachment triage is disabled too, since the test
+    attachments are far below its size thresholds.
+    """
+    with (
+        patch.dict(os.environ, ENV_VARS),
+        patch("hsa_receipt_archiver.handler.get_cached_results", return_value=None) as mock_get,
+        patch("hsa_receipt_archiver.handler.put_cached_results"),
+        patch("hsa_receipt_archiver.handler.is_raw_email_processed", return_value=False),
+        patch("hsa_receipt_archiver.handler.triage_attachments", side_effect=lambda attachments: attachments),
+    ):
+        yield mock_get
+
+
 def _make_ses_event(message_id: str = "msg-123") -> dict:
     return {"Records": [{"ses": {"mail": {"messageId": message_id}}}]}
 
@@ -35,6 +63,10 @@ def _make_eligibility_result(**overrides: object) -> EligibilityResult:
     return EligibilityResult(**defaults)  # type: ignore[arg-type]
 
 
+def _apply_ledger_merge(bucket: str, partition: str, merge: Callable[[str | None], str]) -> str:
+    return merge(None)
+
+
 def _make_parsed_email(
     sender: str = "allowed@example.com",
     subject: str = "Receipt",
@@ -48,8 +80,7 @@ def _make_parsed_email(
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler.tag_raw_email")
 @patch("hsa_receipt_archiver.handler.notify_success")
-@patch("hsa_receipt_archiver.handler.store_ledger")
-@patch("hsa_receipt_archiver.handler.fetch_ledger", return_value=None)
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
 @patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://test-bucket/receipts/2025/receipt.pdf")
 @patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf-data")
 @patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
@@ -63,8 +94,7 @@ def test_happy_path(
     mock_check: MagicMock,
     mock_convert: MagicMock,
     mock_store_receipt: MagicMock,
-    mock_fetch_ledger: MagicMock,
-    mock_store_ledger: MagicMock,
+    mock_update_ledger: MagicMock,
     mock_notify_success: MagicMock,
     mock_tag: MagicMock,
 ) -> None:
@@ -80,7 +110,7 @@ def test_happy_path(
     mock_fetch_email.assert_called_once()
     mock_convert.assert_called_once()
     mock_store_receipt.assert_called_once()
-    mock_store_ledger.assert_called_once()
+    mock_update_ledger.assert_called_once()
     mock_notify_success.assert_called_once()
     entries = mock_notify_success.call_args[0][0]
     assert len(entries) == 1
@@ -88,6 +118,59 @@ def test_happy_path(
     mock_tag.assert_called_once()
 
 
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.store_receipt")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email")
+@patch("hsa_receipt_archiver.handler.is_raw_email_processed", return_value=True)
+def test_already_processed_email_is_skipped(
+    mock_processed: MagicMock, mock_fetch_email: MagicMock, mock_store_receipt: MagicMock
+) -> None:
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+
+    assert result["statusCode"] == 200
+    mock_processed.assert_called_once_with("test-bucket", "raw-emails/msg-123")
+    mock_fetch_email.assert_not_called()
+    mock_store_receipt.assert_not_called()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email", side_effect=RuntimeError("throttled"))
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_tag_failure_after_ledger_commit_does_not_trigger_redelivery(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email()
+    mock_check.return_value = [_make_eligibility_result()]
+    body = json.dumps({"Records": [{"s3": {"object": {"key": "raw-emails/msg-1"}}}]})
+    event = {"Records": [{"eventSource": "aws:sqs", "messageId": "m1", "body": body}]}
+
+    from hsa_receipt_archiver.handler import process_receipt
+
+    result = process_receipt(event, None)
+
+    assert result == {"batchItemFailures": []}
+    mock_update_ledger.assert_called_once()
+    mock_notify_success.assert_called_once()
+
+
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler._handle", side_effect=RuntimeError("boom"))
 def test_process_receipt_catches_exceptions(mock_handle: MagicMock) -> None:
@@ -97,6 +180,28 @@ def test_process_receipt_catches_exceptions(mock_handle: MagicMock) -> None:
     assert result["statusCode"] == 500
 
 
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.email_parser._parse_parts")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_unauthorized_sender_rejected_before_attachments_parsed(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse_parts: MagicMock,
+    make_mime_email: Callable[..., bytes],
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_fetch.return_value = make_mime_email(
+        sender="intruder@evil.com", attachments=[("big.pdf", "application/pdf", b"%PDF" * 1000)]
+    )
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+    assert result["statusCode"] == 403
+    mock_parse_parts.assert_not_called()
+
+
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler.tag_raw_email")
 @patch("hsa_receipt_archiver.handler.parse_ses_email")
@@ -167,8 +272,7 @@ def test_ineligible_sends_rejection(
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler.tag_raw_email")
 @patch("hsa_receipt_archiver.handler.notify_success")
-@patch("hsa_receipt_archiver.handler.store_ledger")
-@patch("hsa_receipt_archiver.handler.fetch_ledger", return_value=None)
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
 @patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
 @patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
 @patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
@@ -182,8 +286,7 @@ def test_force_store_bypasses_eligibility(
     mock_check: MagicMock,
     mock_convert: MagicMock,
     mock_store_receipt: MagicMock,
-    mock_fetch_ledger: MagicMock,
-    mock_store_ledger: MagicMock,
+    mock_update_ledger: MagicMock,
     mock_notify_success: MagicMock,
     mock_tag: MagicMock,
 ) -> None:
@@ -202,8 +305,7 @@ def test_force_store_bypasses_eligibility(
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler.tag_raw_email")
 @patch("hsa_receipt_archiver.handler.notify_success")
-@patch("hsa_receipt_archiver.handler.store_ledger")
-@patch("hsa_receipt_archiver.handler.fetch_ledger", return_value=None)
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
 @patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
 @patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
 @patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
@@ -217,8 +319,7 @@ def test_multiple_results_share_pdf_uri(
     mock_check: MagicMock,
     mock_convert: MagicMock,
     mock_store_receipt: MagicMock,
-    mock_fetch_ledger: MagicMock,
-    mock_store_ledger: MagicMock,
+    mock_update_ledger: MagicMock,
     mock_notify_success: MagicMock,
     mock_tag: MagicMock,
 ) -> None:
@@ -234,7 +335,7 @@ def test_multiple_results_share_pdf_uri(
     _handle(_make_ses_event())
 
     mock_store_receipt.assert_called_once()
-    assert mock_store_ledger.call_count == 2
+    mock_update_ledger.assert_called_once()
     entries = mock_notify_success.call_args[0][0]
     assert len(entries) == 2
 
@@ -242,8 +343,7 @@ def test_multiple_results_share_pdf_uri(
 @patch.dict(os.environ, ENV_VARS)
 @patch("hsa_receipt_archiver.handler.tag_raw_email")
 @patch("hsa_receipt_archiver.handler.notify_success")
-@patch("hsa_receipt_archiver.handler.store_ledger")
-@patch("hsa_receipt_archiver.handler.fetch_ledger", return_value=None)
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
 @patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
 @patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
 @patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
@@ -257,8 +357,7 @@ def test_both_dates_none_with_force_store_uses_today(
     mock_check: MagicMock,
     mock_convert: MagicMock,
     mock_store_receipt: MagicMock,
-    mock_fetch_ledger: MagicMock,
-    mock_store_ledger: MagicMock,
+    mock_update_ledger: MagicMock,
     mock_notify_success: MagicMock,
     mock_tag: MagicMock,
 ) -> None:
@@ -321,3 +420,624 @@ def test_attachment_error_sends_failure_notification(
     assert result["statusCode"] == 200
     mock_notify_failure.assert_called_once()
     mock_tag.assert_called_once()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_attachments_processed_concurrently(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_notify_failure: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email(
+        attachments=[
+            Attachment("page1.jpg", "image/jpeg", b"jpeg-1"),
+            Attachment("page2.jpg", "image/jpeg", b"jpeg-2"),
+        ]
+    )
+    # Both Claude calls must be in flight at the same time for the barrier to release.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def _check(api_key: str, data: bytes, content_type: str) -> list[EligibilityResult]:
+        barrier.wait()
+        return [_make_eligibility_result()]
+
+    mock_check.side_effect = _check
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+
+    assert result["statusCode"] == 200
+    mock_notify_failure.assert_not_called()
+    assert mock_notify_success.call_count == 2
+    # Both attachments' entries land in a single ledger read and write.
+    mock_update_ledger.assert_called_once()
+    partition, merge = mock_update_ledger.call_args[0][1:]
+    assert partition == "2025"
+    assert merge(None).count("Dr Smith") == 2
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_one_failed_attachment_does_not_affect_others(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_notify_failure: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email(
+        attachments=[
+            Attachment("good.jpg", "image/jpeg", b"good"),
+            Attachment("bad.jpg", "image/jpeg", b"bad"),
+        ]
+    )
+
+    def _check(api_key: str, data: bytes, content_type: str) -> list[EligibilityResult]:
+        if data == b"bad":
+            raise RuntimeError("API failed")
+        return [_make_eligibility_result()]
+
+    mock_check.side_effect = _check
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+
+    assert result["statusCode"] == 200
+    mock_notify_failure.assert_called_once_with("Failed to process attachment: bad.jpg")
+    mock_notify_success.assert_called_once()
+    mock_update_ledger.assert_called_once()
+    mock_tag.assert_called_once()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=RuntimeError("S3 down"))
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+@patch("hsa_receipt_archiver.handler.queue_ledger_entries")
+def test_ledger_failure_queues_entries_and_sends_failure_notification(
+    mock_queue: MagicMock,
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_notify_failure: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email()
+    mock_check.return_value = [_make_eligibility_result()]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+
+    assert result["statusCode"] == 200
+    mock_notify_success.assert_not_called()
+    mock_notify_failure.assert_called_once()
+    assert "s3://b/r.pdf" in mock_notify_failure.call_args[0][0]
+    mock_queue.assert_called_once()
+    bucket, partition, entries, source = mock_queue.call_args[0]
+    assert (bucket, partition, source) == ("test-bucket", "2025", "raw-emails/msg-123")
+    assert [entry.receipt_s3_uri for entry in entries] == ["s3://b/r.pdf"]
+    mock_tag.assert_called_once()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=RuntimeError("S3 down"))
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+@patch("hsa_receipt_archiver.handler.queue_ledger_entries", side_effect=RuntimeError("S3 down"))
+def test_ledger_entries_that_cannot_be_queued_leave_email_for_redelivery(
+    mock_queue: MagicMock,
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_notify_failure: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email()
+    mock_check.return_value = [_make_eligibility_result()]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    with pytest.raises(RuntimeError):
+        _handle(_make_ses_event())
+
+    mock_tag.assert_not_called()
+    mock_notify_success.assert_not_called()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.queue_ledger_entries")
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger")
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_entries_written_to_their_tax_year_partition(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_notify_failure: MagicMock,
+    mock_tag: MagicMock,
+    mock_queue: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email()
+    mock_check.return_value = [
+        _make_eligibility_result(description="December visit", service_date="2024-12-30"),
+        _make_eligibility_result(description="January visit", service_date="2025-01-02"),
+    ]
+
+    def _update(bucket: str, partition: str, merge: Callable[[str | None], str]) -> str:
+        if partition == "2024":
+            raise RuntimeError("conflict")
+        return merge(None)
+
+    mock_update_ledger.side_effect = _update
+
+    from hsa_receipt_archiver.handler import _handle
+
+    _handle(_make_ses_event())
+
+    partitions = sorted(call[0][1] for call in mock_update_ledger.call_args_list)
+    assert partitions == ["2024", "2025"]
+    assert [call[0][1] for call in mock_queue.call_args_list] == ["2024"]
+    mock_notify_failure.assert_called_once()
+    mock_notify_success.assert_not_called()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.replay_ledger_entries", return_value=(1, 0))
+@patch("hsa_receipt_archiver.handler.rebuild_merged_ledger")
+@patch("hsa_receipt_archiver.handler._handle")
+def test_rebuild_ledger_action_replays_queue_and_rebuilds_merged_view(
+    mock_handle: MagicMock, mock_rebuild: MagicMock, mock_replay: MagicMock
+) -> None:
+    from hsa_receipt_archiver.handler import process_receipt
+
+    manager = MagicMock()
+    manager.attach_mock(mock_replay, "replay")
+    manager.attach_mock(mock_rebuild, "rebuild")
+
+    result = process_receipt({"action": "rebuild-ledger"}, None)
+
+    assert result["statusCode"] == 200
+    assert [call[0] for call in manager.mock_calls] == ["replay", "rebuild"]
+    mock_rebuild.assert_called_once_with("test-bucket")
+    mock_handle.assert_not_called()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.replay_ledger_entries", return_value=(0, 0))
+@patch("hsa_receipt_archiver.handler.notify_failure")
+@patch("hsa_receipt_archiver.handler.rebuild_merged_ledger")
+def test_rebuild_ledger_action_reports_edited_view(
+    mock_rebuild: MagicMock, mock_notify_failure: MagicMock, mock_replay: MagicMock
+) -> None:
+    from hsa_receipt_archiver.handler import process_receipt
+    from hsa_receipt_archiver.s3_manager import MergedLedgerEditedError
+
+    mock_rebuild.side_effect = MergedLedgerEditedError("view was edited")
+
+    result = process_receipt({"action": "rebuild-ledger"}, None)
+
+    assert result["statusCode"] == 409
+    mock_notify_failure.assert_called_once_with("view was edited")
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_cached_eligibility_skips_claude(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_tag: MagicMock,
+    _no_eligibility_cache: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email(subject="FORCE_STORE")
+    _no_eligibility_cache.return_value = [_make_eligibility_result(is_eligible=False)]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    _handle(_make_ses_event())
+
+    mock_check.assert_not_called()
+    _no_eligibility_cache.assert_called_once_with("test-bucket", hashlib.sha256(b"jpeg-data").digest(), "image/jpeg")
+    mock_store_receipt.assert_called_once()
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.mark_pending")
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://test-bucket/receipts/2025/r.pdf")
+@patch("hsa_receipt_archiver.handler.unconverted_pdf", return_value=b"plain-pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", side_effect=ConversionTimeoutError("gs killed"))
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_conversion_timeout_stores_unconverted_pdf_and_queues_upgrade(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_convert: MagicMock,
+    mock_unconverted: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_tag: MagicMock,
+    mock_mark_pending: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email()
+    mock_check.return_value = [_make_eligibility_result()]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(_make_ses_event())
+
+    assert result["statusCode"] == 200
+    mock_unconverted.assert_called_once_with([(b"jpeg-data", "image/jpeg")])
+    assert mock_store_receipt.call_args[0][1] == b"plain-pdf"
+    mock_mark_pending.assert_called_once_with("test-bucket", "s3://test-bucket/receipts/2025/r.pdf", ["2025"])
+    entry = mock_notify_success.call_args[0][0][0]
+    assert entry.notes == PENDING_NOTE
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.upgrade_pending", return_value=(2, 1))
+@patch("hsa_receipt_archiver.handler._handle")
+def test_upgrade_pending_pdfa_action_passes_deadline(mock_handle: MagicMock, mock_upgrade: MagicMock) -> None:
+    from hsa_receipt_archiver.handler import CONVERSION_RESERVE_SECONDS, process_receipt
+
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 300_000
+    before = time.monotonic()
+
+    result = process_receipt({"action": "upgrade-pending-pdfa"}, context)
+
+    assert result["statusCode"] == 200
+    mock_handle.assert_not_called()
+    bucket, deadline = mock_upgrade.call_args[0]
+    assert bucket == "test-bucket"
+    assert before + 300 - CONVERSION_RESERVE_SECONDS <= deadline <= time.monotonic() + 300
+
+
+MULTIPAGE_ATTACHMENTS = [
+    Attachment("page1.jpg", "image/jpeg", b"page-1"),
+    Attachment("page2.png", "image/png", b"page-2"),
+    Attachment("statement.pdf", "application/pdf", b"%PDF-statement"),
+]
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_pages_to_pdfa", return_value=b"multipage-pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_multipage_eligibility")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_multipage_subject_merges_images_into_one_document(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_check_multipage: MagicMock,
+    mock_convert: MagicMock,
+    mock_convert_pages: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email(subject="Itemized bill multipage", attachments=MULTIPAGE_ATTACHMENTS)
+    mock_check_multipage.return_value = [_make_eligibility_result(), _make_eligibility_result(amount=20.0)]
+    mock_check.return_value = [_make_eligibility_result(provider="Hospital")]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    _handle(_make_ses_event())
+
+    mock_check_multipage.assert_called_once_with("key", [(b"page-1", "image/jpeg"), (b"page-2", "image/png")])
+    mock_convert_pages.assert_called_once_with([(b"page-1", "image/jpeg"), (b"page-2", "image/png")], None)
+    mock_check.assert_called_once_with("key", b"%PDF-statement", "application/pdf")
+    mock_convert.assert_called_once_with(b"%PDF-statement", "application/pdf", None)
+    assert mock_store_receipt.call_count == 2
+    assert sorted(call[0][1] for call in mock_store_receipt.call_args_list) == [b"multipage-pdf", b"pdf"]
+    entries = [entry for call in mock_notify_success.call_args_list for entry in call[0][0]]
+    assert len(entries) == 3
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.tag_raw_email")
+@patch("hsa_receipt_archiver.handler.notify_success")
+@patch("hsa_receipt_archiver.handler.update_ledger", side_effect=_apply_ledger_merge)
+@patch("hsa_receipt_archiver.handler.store_receipt", return_value="s3://b/r.pdf")
+@patch("hsa_receipt_archiver.handler.convert_pages_to_pdfa", return_value=b"multipage-pdf")
+@patch("hsa_receipt_archiver.handler.convert_to_pdfa", return_value=b"pdf")
+@patch("hsa_receipt_archiver.handler.check_multipage_eligibility")
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+@patch("hsa_receipt_archiver.handler.parse_ses_email")
+@patch("hsa_receipt_archiver.handler.fetch_raw_email", return_value=b"raw")
+@patch("hsa_receipt_archiver.handler._get_ssm_param")
+def test_images_stay_separate_without_multipage_mode(
+    mock_ssm: MagicMock,
+    mock_fetch: MagicMock,
+    mock_parse: MagicMock,
+    mock_check: MagicMock,
+    mock_check_multipage: MagicMock,
+    mock_convert: MagicMock,
+    mock_convert_pages: MagicMock,
+    mock_store_receipt: MagicMock,
+    mock_update_ledger: MagicMock,
+    mock_notify_success: MagicMock,
+    mock_tag: MagicMock,
+) -> None:
+    mock_ssm.side_effect = lambda name: {"/test/api-key": "key", "/test/senders": "allowed@example.com"}[name]
+    mock_parse.return_value = _make_parsed_email(attachments=MULTIPAGE_ATTACHMENTS)
+    mock_check.return_value = [_make_eligibility_result()]
+
+    from hsa_receipt_archiver.handler import _handle
+
+    _handle(_make_ses_event())
+
+    mock_check_multipage.assert_not_called()
+    mock_convert_pages.assert_not_called()
+    assert mock_check.call_count == 3
+    assert mock_store_receipt.call_count == 3
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.MULTIPAGE_AUTO_DETECT", True)
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+def test_auto_detect_groups_images_with_same_provider_and_date(mock_check: MagicMock) -> None:
+    mock_check.return_value = [_make_eligibility_result(provider="Dr Smith", service_date="2025-01-15")]
+
+    from hsa_receipt_archiver.handler import _group_documents
+
+    documents = _group_documents(MULTIPAGE_ATTACHMENTS, "Receipt", "key")
+
+    assert [[page.filename for page in pages] for pages in documents] == [
+        ["page1.jpg", "page2.png"],
+        ["statement.pdf"],
+    ]
+    assert mock_check.call_count == 2
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.MULTIPAGE_AUTO_DETECT", True)
+@patch("hsa_receipt_archiver.handler.check_hsa_eligibility")
+def test_auto_detect_keeps_images_with_different_providers_separate(mock_check: MagicMock) -> None:
+    mock_check.side_effect = [
+        [_make_eligibility_result(provider="Dr Smith")],
+        [_make_eligibility_result(provider="Pharmacy")],
+    ]
+
+    from hsa_receipt_archiver.handler import _group_documents
+
+    documents = _group_documents(MULTIPAGE_ATTACHMENTS, "Receipt", "key")
+
+    assert len(documents) == 3
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler.check_multipage_eligibility", return_value=[])
+def test_multipage_results_cached_under_page_hashes(
+    mock_check_multipage: MagicMock, _no_eligibility_cache: MagicMock
+) -> None:
+    from hsa_receipt_archiver.handler import _check_eligibility
+
+    pages = MULTIPAGE_ATTACHMENTS[:2]
+    _check_eligibility(pages, "key")
+    _check_eligibility(list(reversed(pages)), "key")
+
+    first, second = (call[0] for call in _no_eligibility_cache.call_args_list)
+    assert first[2] == second[2] == "multipage"
+    assert first[1] != second[1]
+
+
+def _make_sqs_event(*bodies: dict) -> dict:
+    return {
+        "Records": [
+            {"messageId": f"sqs-{i}", "eventSource": "aws:sqs", "body": json.dumps(body)}
+            for i, body in enumerate(bodies)
+        ]
+    }
+
+
+def _make_s3_notification(*keys: str) -> dict:
+    return {"Records": [{"s3": {"bucket": {"name": "test-bucket"}, "object": {"key": key}}} for key in keys]}
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler._handle_email")
+def test_every_ses_record_is_processed(mock_handle_email: MagicMock) -> None:
+    mock_handle_email.side_effect = [RuntimeError("boom"), {"statusCode": 200, "body": "Processed"}]
+    event = {"Records": [*_make_ses_event("msg-1")["Records"], *_make_ses_event("msg-2")["Records"]]}
+
+    from hsa_receipt_archiver.handler import _handle
+
+    result = _handle(event)
+
+    assert [c.args[0] for c in mock_handle_email.call_args_list] == ["raw-emails/msg-1", "raw-emails/msg-2"]
+    assert result["statusCode"] == 500
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler._handle_email")
+def test_sqs_batch_reports_only_failed_messages(mock_handle_email: MagicMock) -> None:
+    def _result(key: str, deadline: float | None) -> dict:
+        if key == "raw-emails/boom":
+            raise RuntimeError("boom")
+        if key == "raw-emails/spam":
+            return {"statusCode": 403, "body": "Unauthorized sender"}
+        return {"statusCode": 200, "body": "Processed"}
+
+    mock_handle_email.side_effect = _result
+    event = _make_sqs_event(
+        _make_s3_notification("raw-emails/ok+1", "raw-emails/ok%2B2"),
+        _make_s3_notification("raw-emails/boom"),
+        _make_s3_notification("raw-emails/spam"),
+        {"Service": "Amazon S3", "Event": "s3:TestEvent"},
+    )
+
+    from hsa_receipt_archiver.handler import process_receipt
+
+    result = process_receipt(event, None)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "sqs-1"}]}
+    keys = [c.args[0] for c in mock_handle_email.call_args_list]
+    assert keys == ["raw-emails/ok 1", "raw-emails/ok+2", "raw-emails/boom", "raw-emails/spam"]
+
+
+@patch.dict(os.environ, ENV_VARS)
+@patch("hsa_receipt_archiver.handler._handle_email")
+def test_sqs_messages_after_deadline_are_returned_to_queue(mock_handle_email: MagicMock) -> None:
+    event = _make_sqs_event(_make_s3_notification("raw-emails/a"), _make_s3_notification("raw-emails/b"))
+
+    from hsa_receipt_archiver.handler import _handle_sqs_batch
+
+    result = _handle_sqs_batch(event, time.monotonic() - 1)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "sqs-0"}, {"itemIdentifier": "sqs-1"}]}
+    mock_handle_email.assert_not_called()
+
+
+# Cumulative import time allowed for the handler module. It was ~1.9s when anthropic, Pillow and the
+# boto3 clients were set up at import and is ~0.15s without them; the slack absorbs slower machines.
+HANDLER_IMPORT_BUDGET_US = 500_000
+
+
+def test_handler_import_stays_within_cold_start_budget() -> None:
+    code = (
+        "import sys, hsa_receipt_archiver.handler;"
+        "print(','.join(m for m in ('anthropic', 'PIL', 'boto3') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env={**os.environ, **ENV_VARS},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "", "heavy modules imported at cold start"
+    cumulative_us = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.endswith("| hsa_receipt_archiver.handler")
+    )
+    assert cumulative_us < HANDLER_IMPORT_BUDGET_US
+
+
+def test_allowed_senders_parsed_once_per_value() -> None:
+    from hsa_receipt_archiver.handler import _parse_allowed_senders
+
+    _parse_allowed_senders.cache_clear()
+    first = _parse_allowed_senders(" A@example.com, b@example.com")
+
+    assert first == {"a@example.com", "b@example.com"}
+    assert _parse_allowed_senders(" A@example.com, b@example.com") is first
+    assert _parse_allowed_senders("c@example.com") == {"c@example.com"}
+    assert _parse_allowed_senders.cache_info().misses == 2
+
+
+@patch("hsa_receipt_archiver.handler.get_parameter", return_value="value")
+def test_ssm_params_fetched_as_one_batch(mock_get_parameter: MagicMock) -> None:
+    from hsa_receipt_archiver.handler import _get_ssm_param
+
+    assert _get_ssm_param("/test/api-key") == "value"
+    mock_get_parameter.assert_called_once_with("/test/api-key", batch=("/test/api-key", "/test/senders"))
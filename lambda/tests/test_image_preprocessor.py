@@ -0,0 +1,74 @@
+"""Tests for image_preprocessor module."""
+
+import io
+from unittest.mock import patch
+
+from PIL import Image
+
+from hsa_receipt_archiver.image_preprocessor import prepare_image_for_model
+
+
+def _image_bytes(size: tuple[int, int], fmt: str = "JPEG", mode: str = "RGB", orientation: int | None = None) -> bytes:
+    img = Image.new(mode, size, "white")
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, fmt, exif=exif)
+    return buf.getvalue()
+
+
+def test_small_upright_image_is_unchanged() -> None:
+    data = _image_bytes((800, 600), "PNG")
+    assert prepare_image_for_model(data, "image/png") == (data, "image/png")
+
+
+@patch("hsa_receipt_archiver.image_preprocessor.MODEL_IMAGE_MAX_EDGE", 1000)
+def test_large_image_is_downscaled_to_max_edge() -> None:
+    data = _image_bytes((4000, 3000))
+
+    shrunk, content_type = prepare_image_for_model(data, "image/jpeg")
+
+    assert content_type == "image/jpeg"
+    assert Image.open(io.BytesIO(shrunk)).size == (1000, 750)
+
+
+def test_jpeg_is_drafted_at_reduced_size_keeping_aspect_ratio() -> None:
+    data = _image_bytes((4032, 3024))
+    drafted_sizes = []
+
+    def _record_size(img: Image.Image) -> Image.Image:
+        drafted_sizes.append(img.size)
+        return img
+
+    with patch("PIL.ImageOps.exif_transpose", side_effect=_record_size):
+        shrunk, _ = prepare_image_for_model(data, "image/jpeg")
+
+    assert drafted_sizes == [(2016, 1512)]
+    assert Image.open(io.BytesIO(shrunk)).size == (1568, 1176)
+
+
+def test_exif_orientation_is_applied() -> None:
+    # Orientation 6 means the camera was rotated; upright, the image is taller than wide.
+    data = _image_bytes((400, 200), orientation=6)
+
+    shrunk, content_type = prepare_image_for_model(data, "image/jpeg")
+
+    assert content_type == "image/jpeg"
+    assert Image.open(io.BytesIO(shrunk)).size == (200, 400)
+
+
+@patch("hsa_receipt_archiver.image_preprocessor.MODEL_IMAGE_MAX_EDGE", 100)
+def test_transparent_png_becomes_rgb_jpeg() -> None:
+    data = _image_bytes((400, 400), "PNG", mode="RGBA")
+
+    shrunk, content_type = prepare_image_for_model(data, "image/png")
+
+    img = Image.open(io.BytesIO(shrunk))
+    assert content_type == "image/jpeg"
+    assert img.format == "JPEG"
+    assert img.mode == "RGB"
+
+
+def test_undecodable_image_is_sent_as_is() -> None:
+    assert prepare_image_for_model(b"not-an-image", "image/jpeg") == (b"not-an-image", "image/jpeg")
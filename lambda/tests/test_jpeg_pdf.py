@@ -0,0 +1,71 @@
+"""Tests for jpeg_pdf module."""
+
+import io
+import re
+
+from PIL import Image
+
+from hsa_receipt_archiver.jpeg_pdf import jpeg_to_pdf
+
+
+def _jpeg(size: tuple[int, int] = (600, 300), mode: str = "RGB", orientation: int | None = None) -> bytes:
+    img = Image.new(mode, size, "white" if mode != "CMYK" else (0, 0, 0, 0))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", exif=exif)
+    return buf.getvalue()
+
+
+def test_jpeg_stream_is_embedded_unchanged() -> None:
+    data = _jpeg()
+
+    pdf = jpeg_to_pdf(data)
+
+    assert pdf is not None
+    assert pdf.startswith(b"%PDF-1.4")
+    assert b"/Filter /DCTDecode /Length %d >>\nstream\n" % len(data) + data + b"\nendstream" in pdf
+    assert b"/Width 600 /Height 300 /ColorSpace /DeviceRGB" in pdf
+
+
+def test_page_is_sized_at_300_dpi() -> None:
+    pdf = jpeg_to_pdf(_jpeg(size=(900, 600)))
+
+    assert pdf is not None
+    assert b"/MediaBox [0 0 216.0000 144.0000]" in pdf
+
+
+def test_xref_offsets_point_at_objects() -> None:
+    pdf = jpeg_to_pdf(_jpeg())
+
+    assert pdf is not None
+    startxref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    entries = re.findall(rb"(\d{10}) 00000 n ", pdf[startxref:])
+    assert len(entries) == 5
+    for number, offset in enumerate(entries, start=1):
+        assert pdf[int(offset) :].startswith(b"%d 0 obj" % number)
+
+
+def test_grayscale_uses_device_gray() -> None:
+    pdf = jpeg_to_pdf(_jpeg(mode="L"))
+
+    assert pdf is not None
+    assert b"/ColorSpace /DeviceGray" in pdf
+
+
+def test_exif_rotation_becomes_page_rotation() -> None:
+    pdf = jpeg_to_pdf(_jpeg(orientation=6))
+
+    assert pdf is not None
+    assert b"/Rotate 90" in pdf
+
+
+def test_unsupported_inputs_return_none() -> None:
+    png = io.BytesIO()
+    Image.new("RGB", (10, 10)).save(png, "PNG")
+
+    assert jpeg_to_pdf(png.getvalue()) is None
+    assert jpeg_to_pdf(b"not an image") is None
+    assert jpeg_to_pdf(_jpeg(mode="CMYK")) is None
+    assert jpeg_to_pdf(_jpeg(orientation=2)) is None
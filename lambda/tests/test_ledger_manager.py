@@ -2,14 +2,22 @@
 
 import csv
 import io
-from datetime import date
+import random
+from datetime import date, timedelta
 
 from hsa_receipt_archiver.ledger_manager import (
     HEADERS,
+    UNDATED_PARTITION,
+    Ledger,
     LedgerEntry,
     _duplicate_score,
+    add_ledger_entries,
     add_ledger_entry,
     create_empty_ledger,
+    ledger_partition,
+    merge_ledgers,
+    replace_note,
+    split_ledger,
 )
 
 
@@ -101,6 +109,12 @@ def test_add_entry_notes_always_empty(sample_ledger_entry: LedgerEntry) -> None:
     assert rows[1][8] == ""
 
 
+def test_add_entry_writes_notes(sample_ledger_entry: LedgerEntry) -> None:
+    sample_ledger_entry.notes = "Stored as plain PDF"
+    rows = list(csv.reader(io.StringIO(add_ledger_entry(None, sample_ledger_entry))))
+    assert rows[1][8] == "Stored as plain PDF"
+
+
 def test_add_multiple_entries() -> None:
     entry1 = LedgerEntry(
         service_date=date(2025, 1, 1),
@@ -274,3 +288,261 @@ def test_duplicate_pct_column_empty_when_zero() -> None:
     reader = csv.reader(io.StringIO(ledger))
     rows = list(reader)
     assert rows[1][9] == ""
+
+
+def test_add_entries_matches_adding_one_at_a_time() -> None:
+    existing = LedgerEntry(
+        service_date=date(2025, 1, 15),
+        payment_date=None,
+        provider="Dr Smith",
+        category="Medical",
+        description="Visit",
+        amount=30.00,
+        receipt_s3_uri="s3://b/r.pdf",
+    )
+    batch = [
+        LedgerEntry(
+            service_date=date(2025, 1, 20),
+            payment_date=None,
+            provider="dr smith",
+            category="Medical",
+            description="Follow-up",
+            amount=30.00,
+            receipt_s3_uri="s3://b/r2.pdf",
+        ),
+        LedgerEntry(
+            service_date=date(2025, 1, 20),
+            payment_date=None,
+            provider="Dr Smith",
+            category="Medical",
+            description="Follow-up again",
+            amount=30.00,
+            receipt_s3_uri="s3://b/r3.pdf",
+        ),
+    ]
+    ledger = add_ledger_entry(None, existing)
+
+    sequential = ledger
+    for entry in batch:
+        sequential = add_ledger_entry(sequential, entry)
+
+    assert add_ledger_entries(ledger, batch) == sequential
+
+
+def test_add_entries_scores_within_batch() -> None:
+    entry = LedgerEntry(
+        service_date=date(2025, 1, 15),
+        payment_date=None,
+        provider="Dr Smith",
+        category="Medical",
+        description="Visit",
+        amount=30.00,
+        receipt_s3_uri="s3://b/r.pdf",
+    )
+    ledger = add_ledger_entries(None, [entry, entry])
+
+    rows = list(csv.reader(io.StringIO(ledger)))
+    assert len(rows) == 3
+    assert rows[1][9] == ""
+    assert rows[2][9] == "100"
+
+
+def test_add_entries_empty_batch_returns_ledger_unchanged() -> None:
+    ledger = create_empty_ledger()
+    assert add_ledger_entries(ledger, []) == ledger
+
+
+def _linear_duplicate_score(ledger_csv: str, entry: LedgerEntry) -> int:
+    """Reference implementation: score the entry against every ledger row."""
+    best = 0
+    for row in csv.DictReader(io.StringIO(ledger_csv)):
+        score = 0
+        if row["Vendor/Provider"].strip().lower() == entry.provider.strip().lower():
+            score += 30
+        if abs(float(row["Amount"]) - entry.amount) < 0.01:
+            score += 30
+        if row["Service Date"] and entry.service_date:
+            row_date = date.fromisoformat(row["Service Date"])
+            if row_date == entry.service_date:
+                score += 40
+            elif abs((row_date - entry.service_date).days) <= 30:
+                score += 20
+        best = max(best, score)
+    return best
+
+
+def test_indexed_duplicate_score_matches_linear_scan() -> None:
+    rng = random.Random(1234)
+    providers = ["Dr Smith", "dr smith ", "CVS Pharmacy", "Vision Center", "Dental Co"]
+    start = date(2024, 1, 1)
+
+    def _random_entry() -> LedgerEntry:
+        return LedgerEntry(
+            service_date=start + timedelta(days=rng.randrange(730)) if rng.random() < 0.9 else None,
+            payment_date=None,
+            provider=rng.choice(providers),
+            category="Medical",
+            description="Visit",
+            amount=rng.choice([10.0, 25.0, 30.0, 30.004, 30.006, 12.99, 13.0]) + rng.randrange(3),
+            receipt_s3_uri="s3://b/r.pdf",
+        )
+
+    ledger = add_ledger_entries(None, [_random_entry() for _ in range(300)])
+    for _ in range(300):
+        entry = _random_entry()
+        assert _duplicate_score(ledger, entry) == _linear_duplicate_score(ledger, entry)
+
+
+def test_duplicate_score_boundary_of_date_window() -> None:
+    entry = LedgerEntry(
+        service_date=date(2025, 1, 1),
+        payment_date=None,
+        provider="A",
+        category="Medical",
+        description="Visit",
+        amount=1.00,
+        receipt_s3_uri="s3://b/r.pdf",
+    )
+    ledger = add_ledger_entry(None, entry)
+
+    def _at(days: int) -> LedgerEntry:
+        return LedgerEntry(
+            service_date=date(2025, 1, 1) + timedelta(days=days),
+            payment_date=None,
+            provider="B",
+            category="Medical",
+            description="Visit",
+            amount=2.00,
+            receipt_s3_uri="s3://b/r2.pdf",
+        )
+
+    assert _duplicate_score(ledger, _at(30)) == 20
+    assert _duplicate_score(ledger, _at(-30)) == 20
+    assert _duplicate_score(ledger, _at(31)) == 0
+
+
+def test_ledger_partition_prefers_service_date() -> None:
+    assert ledger_partition(date(2024, 12, 31), date(2025, 1, 2)) == "2024"
+    assert ledger_partition(None, date(2025, 1, 2)) == "2025"
+    assert ledger_partition(None, None) == UNDATED_PARTITION
+
+
+def test_split_and_merge_ledgers_round_trip() -> None:
+    entries = [
+        LedgerEntry(date(2024, 5, 1), None, "A", "Medical", "One", 1.0, "s3://b/1.pdf"),
+        LedgerEntry(None, date(2025, 2, 1), "B", "Dental", "Two", 2.0, "s3://b/2.pdf"),
+        LedgerEntry(date(2024, 7, 1), None, "C", "Vision", "Three", 3.0, "s3://b/3.pdf"),
+        LedgerEntry(None, None, "D", "Other", "Four", 4.0, "s3://b/4.pdf"),
+    ]
+    ledger = add_ledger_entries(None, entries)
+
+    partitions = split_ledger(ledger)
+
+    assert sorted(partitions) == ["2024", "2025", UNDATED_PARTITION]
+    assert [row[4] for row in csv.reader(io.StringIO(partitions["2024"]))][1:] == ["One", "Three"]
+    merged = merge_ledgers([partitions[p] for p in sorted(partitions)])
+    assert sorted(merged.splitlines()) == sorted(ledger.splitlines())
+
+
+def test_merge_ledgers_matches_columns_by_header_name() -> None:
+    standard = "Service Date,Vendor/Provider,Amount\n2025-01-02,A,1.00\n"
+    reordered = "Amount,Vendor/Provider,Service Date,Claim ID\n2.00,B,2025-03-04,C-9\n"
+
+    rows = list(csv.reader(io.StringIO(merge_ledgers([standard, reordered]))))
+
+    assert rows[0] == [*HEADERS, "Claim ID"]
+    records = [dict(zip(rows[0], row, strict=True)) for row in rows[1:]]
+    assert [(r["Service Date"], r["Vendor/Provider"], r["Amount"], r["Claim ID"]) for r in records] == [
+        ("2025-01-02", "A", "1.00", ""),
+        ("2025-03-04", "B", "2.00", "C-9"),
+    ]
+
+
+def test_replace_note_changes_only_the_receipts_rows_with_that_note() -> None:
+    ledger = add_ledger_entries(
+        None,
+        [
+            LedgerEntry(date(2025, 1, 1), None, "A", "Medical", "One", 1.0, "s3://b/1.pdf", "pending"),
+            LedgerEntry(date(2025, 1, 2), None, "A", "Medical", "Two", 2.0, "s3://b/1.pdf", "edited by hand"),
+            LedgerEntry(date(2025, 1, 3), None, "B", "Dental", "Three", 3.0, "s3://b/2.pdf", "pending"),
+        ],
+    )
+
+    updated = replace_note(ledger, "s3://b/1.pdf", "pending", "")
+
+    assert [row.notes for row in Ledger(updated)] == ["", "edited by hand", "pending"]
+
+
+def test_split_empty_ledger_has_no_partitions() -> None:
+    assert split_ledger(create_empty_ledger()) == {}
+
+
+def _sample_ledger() -> Ledger:
+    ledger_csv = create_empty_ledger() + (
+        "2024-12-20,,Dr Smith,Medical,Visit,30.00,s3://b/1.pdf,Yes,,\r\n"
+        "2025-01-15,2025-01-16,CVS,Pharmacy,Tylenol,12.99,s3://b/2.pdf,No,,\r\n"
+        ",2025-03-01,Vision Co,Vision,Glasses,200.10,s3://b/3.pdf,No,,\r\n"
+        "2025-02-10,,CVS,Pharmacy,Bandages,7.01,s3://b/4.pdf,yes,,\r\n"
+    )
+    return Ledger.from_csv(ledger_csv)
+
+
+def test_ledger_round_trips_loaded_csv_unchanged() -> None:
+    ledger_csv = create_empty_ledger() + 'not-a-date,,"Quoted, Inc",Other,Odd row,abc,s3://b/x.pdf,No,hand note,\r\n'
+    assert Ledger.from_csv(ledger_csv).to_csv() == ledger_csv
+
+
+def test_ledger_none_serializes_to_empty_ledger() -> None:
+    assert Ledger.from_csv(None).to_csv() == create_empty_ledger()
+
+
+def test_ledger_parses_typed_fields() -> None:
+    row = next(iter(_sample_ledger()))
+    assert row.service_date == date(2024, 12, 20)
+    assert row.payment_date is None
+    assert row.amount == 30.00
+    assert row.reimbursed is True
+    assert row.duplicate_pct is None
+    assert row.tax_year == 2024
+
+
+def test_ledger_totals_by_year_and_category() -> None:
+    totals = _sample_ledger().totals_by_year_and_category()
+    assert totals == {
+        (2024, "Medical"): 30.00,
+        (2025, "Pharmacy"): 20.00,
+        (2025, "Vision"): 200.10,
+    }
+
+
+def test_ledger_total_filters() -> None:
+    ledger = _sample_ledger()
+    assert ledger.total(year=2025) == 220.10
+    assert ledger.total(category="Pharmacy") == 20.00
+    assert ledger.total(year=2025, unreimbursed_only=True) == 213.09
+
+
+def test_ledger_unreimbursed() -> None:
+    assert [row.description for row in _sample_ledger().unreimbursed()] == ["Tylenol", "Glasses"]
+
+
+def test_ledger_between_uses_receipt_date_and_sees_appended_rows() -> None:
+    ledger = _sample_ledger()
+    assert [row.description for row in ledger.between(date(2025, 1, 1), date(2025, 2, 10))] == [
+        "Tylenol",
+        "Bandages",
+    ]
+
+    ledger.append(LedgerEntry(date(2025, 1, 20), None, "Dentist", "Dental", "Cleaning", 80.0, "s3://b/5.pdf"))
+    assert [row.description for row in ledger.between(date(2025, 1, 1), date(2025, 2, 10))] == [
+        "Tylenol",
+        "Cleaning",
+        "Bandages",
+    ]
+
+
+def test_ledger_append_records_duplicate_score() -> None:
+    ledger = _sample_ledger()
+    row = ledger.append(LedgerEntry(date(2025, 1, 15), None, "cvs", "Pharmacy", "Tylenol", 12.99, "s3://b/6.pdf"))
+    assert row.duplicate_pct == 100
+    assert len(ledger) == 5
@@ -40,6 +40,14 @@ def test_notify_success_includes_receipt_uri(mock_sns: MagicMock, sample_ledger_
     assert sample_ledger_entry.receipt_s3_uri in message
 
 
+@patch("hsa_receipt_archiver.notifier.SNS_CLIENT")
+def test_notify_success_includes_notes(mock_sns: MagicMock, sample_ledger_entry: LedgerEntry) -> None:
+    sample_ledger_entry.notes = "Queued for re-conversion"
+    notify_success([sample_ledger_entry])
+    message = mock_sns.publish.call_args[1]["Message"]
+    assert "Note: Queued for re-conversion" in message
+
+
 @patch("hsa_receipt_archiver.notifier.SNS_CLIENT")
 def test_notify_success_none_dates_show_na(mock_sns: MagicMock) -> None:
     entry = LedgerEntry(
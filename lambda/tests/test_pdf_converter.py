@@ -1,61 +1,69 @@
 """Tests for pdf_converter module."""
 
+import io
+import time
+from collections import Counter
+from collections.abc import Iterator
 from unittest.mock import MagicMock, patch
 
 import pytest
+from PIL import Image
 
-from hsa_receipt_archiver.pdf_converter import convert_to_pdfa
+from hsa_receipt_archiver import pdf_converter
+from hsa_receipt_archiver.ghostscript_worker import GhostscriptWorkerError
+from hsa_receipt_archiver.pdf_converter import (
+    ConversionTimeoutError,
+    convert_pages_to_pdfa,
+    convert_to_pdfa,
+    extract_pdf_text,
+    unconverted_pdf,
+)
 
 
-def _successful_run() -> MagicMock:
+def _successful_run(stdout: bytes = b"converted-pdf-output") -> MagicMock:
     result = MagicMock()
     result.returncode = 0
+    result.stdout = stdout
     return result
 
 
-@patch("hsa_receipt_archiver.pdf_converter.subprocess.run", return_value=_successful_run())
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
 def test_pdf_input_skips_pillow(mock_run: MagicMock, tmp_path: MagicMock) -> None:
-    output_pdf = b"converted-pdf-output"
-
     with (
-        patch("hsa_receipt_archiver.pdf_converter.Image") as mock_image_mod,
-        patch("pathlib.Path.read_bytes", return_value=output_pdf),
-        patch("pathlib.Path.write_bytes"),
+        patch("PIL.Image.open") as mock_open,
+        patch("pathlib.Path.write_bytes") as mock_write,
     ):
         result = convert_to_pdfa(b"pdf-input", "application/pdf")
 
-    mock_image_mod.open.assert_not_called()
+    mock_open.assert_not_called()
+    mock_write.assert_called_once_with(b"pdf-input")
     mock_run.assert_called_once()
-    assert result == output_pdf
+    assert result == b"converted-pdf-output"
 
 
-@patch("hsa_receipt_archiver.pdf_converter.subprocess.run", return_value=_successful_run())
-@patch("hsa_receipt_archiver.pdf_converter.Image")
-def test_jpeg_input_uses_pillow_then_ghostscript(mock_image_mod: MagicMock, mock_run: MagicMock) -> None:
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+@patch("hsa_receipt_archiver.pdf_converter.jpeg_to_pdf", return_value=None)
+@patch("PIL.Image.open")
+def test_undecodable_jpeg_falls_back_to_pillow_then_ghostscript(
+    mock_open: MagicMock, mock_jpeg_to_pdf: MagicMock, mock_run: MagicMock
+) -> None:
     mock_img = MagicMock()
-    mock_image_mod.open.return_value = mock_img
-    output_pdf = b"converted-pdf-output"
+    mock_open.return_value = mock_img
 
-    with (
-        patch("pathlib.Path.read_bytes", return_value=output_pdf),
-        patch("pathlib.Path.write_bytes"),
-    ):
+    with patch("pathlib.Path.write_bytes"):
         result = convert_to_pdfa(b"jpeg-data", "image/jpeg")
 
-    mock_image_mod.open.assert_called_once()
+    mock_open.assert_called_once()
     mock_img.save.assert_called_once()
     save_args = mock_img.save.call_args
     assert save_args[0][1] == "PDF"
     mock_run.assert_called_once()
-    assert result == output_pdf
+    assert result == b"converted-pdf-output"
 
 
-@patch("hsa_receipt_archiver.pdf_converter.subprocess.run", return_value=_successful_run())
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
 def test_ghostscript_called_with_correct_args(mock_run: MagicMock) -> None:
-    with (
-        patch("pathlib.Path.read_bytes", return_value=b"output"),
-        patch("pathlib.Path.write_bytes"),
-    ):
+    with patch("pathlib.Path.write_bytes"):
         convert_to_pdfa(b"pdf-input", "application/pdf")
 
     gs_args = mock_run.call_args[0][0]
@@ -63,24 +71,51 @@ def test_ghostscript_called_with_correct_args(mock_run: MagicMock) -> None:
     assert "-dBATCH" in gs_args
     assert "-dNOPAUSE" in gs_args
     assert "-sDEVICE=pdfwrite" in gs_args
-    assert mock_run.call_args[1]["capture_output"] is True
-
+    assert "-sOutputFile=-" in gs_args
+    assert "-sstdout=%stderr" in gs_args
 
-@patch("hsa_receipt_archiver.pdf_converter.subprocess.run", return_value=_successful_run())
-@patch("hsa_receipt_archiver.pdf_converter.Image")
-def test_png_input_uses_pillow(mock_image_mod: MagicMock, mock_run: MagicMock) -> None:
-    mock_image_mod.open.return_value = MagicMock()
 
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run(stdout=b""))
+@patch("hsa_receipt_archiver.pdf_converter.GS_IO_MODE", "tempfile")
+def test_tempfile_mode_reads_output_file(mock_run: MagicMock) -> None:
     with (
-        patch("pathlib.Path.read_bytes", return_value=b"output"),
+        patch("pathlib.Path.read_bytes", return_value=b"output-from-file"),
         patch("pathlib.Path.write_bytes"),
     ):
+        result = convert_to_pdfa(b"pdf-input", "application/pdf")
+
+    assert result == b"output-from-file"
+    gs_args = mock_run.call_args[0][0]
+    assert any(arg.startswith("-sOutputFile=") and arg.endswith("output.pdf") for arg in gs_args)
+
+
+def test_image_is_rendered_to_pdf_in_memory() -> None:
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(buf, "PNG")
+
+    with (
+        patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run()) as mock_run,
+        patch("pathlib.Path.write_bytes") as mock_write,
+    ):
+        convert_to_pdfa(buf.getvalue(), "image/png")
+
+    mock_run.assert_called_once()
+    mock_write.assert_called_once()
+    assert mock_write.call_args[0][0].startswith(b"%PDF-")
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+@patch("PIL.Image.open")
+def test_png_input_uses_pillow(mock_open: MagicMock, mock_run: MagicMock) -> None:
+    mock_open.return_value = MagicMock()
+
+    with patch("pathlib.Path.write_bytes"):
         convert_to_pdfa(b"png-data", "image/png")
 
-    mock_image_mod.open.assert_called_once()
+    mock_open.assert_called_once()
 
 
-@patch("hsa_receipt_archiver.pdf_converter.subprocess.run")
+@patch("hsa_receipt_archiver.pdf_converter._run_process")
 def test_ghostscript_failure_raises_with_stderr(mock_run: MagicMock) -> None:
     mock_result = MagicMock()
     mock_result.returncode = 1
@@ -93,3 +128,213 @@ def test_ghostscript_failure_raises_with_stderr(mock_run: MagicMock) -> None:
         pytest.raises(RuntimeError, match="something went wrong"),
     ):
         convert_to_pdfa(b"pdf-input", "application/pdf")
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process")
+def test_extract_pdf_text_uses_txtwrite_to_stdout(mock_run: MagicMock) -> None:
+    mock_run.return_value = MagicMock(returncode=0, stdout=b"Total due $30.00\n")
+
+    with patch("pathlib.Path.write_bytes"):
+        text = extract_pdf_text(b"pdf-input")
+
+    assert text == "Total due $30.00\n"
+    gs_args = mock_run.call_args[0][0]
+    assert "-sDEVICE=txtwrite" in gs_args
+    assert "-sOutputFile=-" in gs_args
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process")
+def test_extract_pdf_text_failure_raises(mock_run: MagicMock) -> None:
+    mock_run.return_value = MagicMock(returncode=1, stdout=b"", stderr=b"Error: bad pdf")
+
+    with patch("pathlib.Path.write_bytes"), pytest.raises(RuntimeError, match="bad pdf"):
+        extract_pdf_text(b"pdf-input")
+
+
+@pytest.fixture
+def persistent_engine() -> Iterator[MagicMock]:
+    with (
+        patch.object(pdf_converter, "GS_ENGINE", "persistent"),
+        patch.object(pdf_converter, "_worker", MagicMock()) as mock_worker,
+        patch.object(pdf_converter, "_worker_failures", 0),
+    ):
+        yield mock_worker
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process")
+def test_persistent_engine_uses_worker(mock_run: MagicMock, persistent_engine: MagicMock) -> None:
+    persistent_engine.try_convert.return_value = True
+
+    with patch("pathlib.Path.read_bytes", return_value=b"output"):
+        result = convert_to_pdfa(b"%PDF-input", "application/pdf")
+
+    assert result == b"output"
+    persistent_engine.try_convert.assert_called_once()
+    mock_run.assert_not_called()
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_persistent_engine_falls_back_when_worker_busy(mock_run: MagicMock, persistent_engine: MagicMock) -> None:
+    persistent_engine.try_convert.return_value = False
+
+    with patch("pathlib.Path.read_bytes", return_value=b"output"):
+        convert_to_pdfa(b"%PDF-input", "application/pdf")
+
+    mock_run.assert_called_once()
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_persistent_engine_skips_input_without_pdf_header(mock_run: MagicMock, persistent_engine: MagicMock) -> None:
+    with patch("pathlib.Path.read_bytes", return_value=b"output"):
+        convert_to_pdfa(b"%!PS-Adobe-3.0 disguised as a PDF", "application/pdf")
+
+    persistent_engine.try_convert.assert_not_called()
+    mock_run.assert_called_once()
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_persistent_engine_disabled_after_repeated_failures(mock_run: MagicMock, persistent_engine: MagicMock) -> None:
+    persistent_engine.try_convert.side_effect = GhostscriptWorkerError("crashed")
+
+    with patch("pathlib.Path.read_bytes", return_value=b"output"):
+        for _ in range(pdf_converter.GS_WORKER_MAX_FAILURES + 2):
+            convert_to_pdfa(b"%PDF-input", "application/pdf")
+
+    assert persistent_engine.try_convert.call_count == pdf_converter.GS_WORKER_MAX_FAILURES
+    assert mock_run.call_count == pdf_converter.GS_WORKER_MAX_FAILURES + 2
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process")
+@patch("hsa_receipt_archiver.pdf_converter.is_pdfa_2b", return_value=True)
+def test_existing_pdfa_is_passed_through(mock_check: MagicMock, mock_run: MagicMock) -> None:
+    with patch.object(pdf_converter, "CONVERSION_COUNTS", Counter()) as counts:
+        result = convert_to_pdfa(b"%PDF-1.7 already archival", "application/pdf")
+
+    assert result == b"%PDF-1.7 already archival"
+    mock_run.assert_not_called()
+    assert counts == {"passthrough": 1}
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+@patch("hsa_receipt_archiver.pdf_converter.is_pdfa_2b", return_value=False)
+def test_non_pdfa_is_converted_and_counted(mock_check: MagicMock, mock_run: MagicMock) -> None:
+    with patch.object(pdf_converter, "CONVERSION_COUNTS", Counter()) as counts, patch("pathlib.Path.write_bytes"):
+        convert_to_pdfa(b"%PDF-1.4 plain", "application/pdf")
+
+    mock_run.assert_called_once()
+    assert counts == {"converted": 1}
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_real_jpeg_is_wrapped_without_pillow_reencode(mock_run: MagicMock) -> None:
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(buf, "JPEG")
+
+    with patch("pathlib.Path.write_bytes") as mock_write, patch("PIL.Image.Image.save") as mock_save:
+        convert_to_pdfa(buf.getvalue(), "image/jpeg")
+
+    mock_save.assert_not_called()
+    assert buf.getvalue() in mock_write.call_args[0][0]
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run(stdout=b"merged"))
+def test_pages_are_combined_in_one_ghostscript_run(mock_run: MagicMock) -> None:
+    page = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(page, "PNG")
+
+    with patch("pathlib.Path.write_bytes") as mock_write:
+        result = convert_pages_to_pdfa([(page.getvalue(), "image/png"), (page.getvalue(), "image/png")])
+
+    assert result == b"merged"
+    mock_run.assert_called_once()
+    gs_args = mock_run.call_args[0][0]
+    assert [arg.rsplit("/", 1)[-1] for arg in gs_args[-2:]] == ["input0.pdf", "input1.pdf"]
+    assert mock_write.call_count == 2
+
+
+def _photo(color: tuple[int, int, int], *, logo: tuple[int, int, int] | None = None) -> bytes:
+    img = Image.new("RGB", (400, 300), color)
+    if logo is not None:
+        img.paste(logo, (0, 0, 120, 90))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def test_balanced_profile_keeps_original_flags() -> None:
+    assert pdf_converter.GS_PROFILE == "balanced"
+    assert pdf_converter._PDFA_DEVICE_ARGS == [
+        "-dPDFA=2",
+        "-sColorConversionStrategy=UseDeviceIndependentColor",
+        "-sDEVICE=pdfwrite",
+    ]
+
+
+def test_uncolored_detection() -> None:
+    # Warm paper cast: low saturation everywhere.
+    assert pdf_converter._is_uncolored(_photo((250, 238, 220)))
+    assert not pdf_converter._is_uncolored(_photo((250, 238, 220), logo=(200, 20, 20)))
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_compact_profile_wraps_uncolored_photo_as_grayscale(mock_run: MagicMock) -> None:
+    with (
+        patch.object(pdf_converter, "PROFILE", pdf_converter.PROFILES["compact"]),
+        patch("pathlib.Path.write_bytes") as mock_write,
+    ):
+        convert_to_pdfa(_photo((250, 238, 220)), "image/jpeg")
+
+    assert b"/DeviceGray" in mock_write.call_args[0][0]
+
+
+@patch("hsa_receipt_archiver.pdf_converter._run_process", return_value=_successful_run())
+def test_compact_profile_keeps_colored_jpeg_passthrough(mock_run: MagicMock) -> None:
+    photo = _photo((250, 238, 220), logo=(200, 20, 20))
+
+    with (
+        patch.object(pdf_converter, "PROFILE", pdf_converter.PROFILES["compact"]),
+        patch("pathlib.Path.write_bytes") as mock_write,
+    ):
+        convert_to_pdfa(photo, "image/jpeg")
+
+    assert photo in mock_write.call_args[0][0]
+
+
+def test_run_process_kills_process_group_at_deadline() -> None:
+    # The background sleep holds stdout open; only killing the whole group lets this return quickly.
+    started = time.monotonic()
+
+    with pytest.raises(ConversionTimeoutError, match="killed after"):
+        pdf_converter._run_process(["sh", "-c", "sleep 30 & sleep 30"], time.monotonic() + 0.3)
+
+    assert time.monotonic() - started < 5
+
+
+def test_run_process_returns_output() -> None:
+    result = pdf_converter._run_process(["sh", "-c", "echo out; echo err >&2; exit 3"], time.monotonic() + 10)
+
+    assert (result.returncode, result.stdout, result.stderr) == (3, b"out\n", b"err\n")
+
+
+def test_worker_timeout_at_deadline_is_not_a_worker_failure(persistent_engine: MagicMock) -> None:
+    def slow_job(input_pdf: object, output_pdf: object, timeout: float) -> bool:
+        time.sleep(timeout)
+        raise GhostscriptWorkerError("timed out")
+
+    persistent_engine.try_convert.side_effect = slow_job
+
+    with pytest.raises(ConversionTimeoutError):
+        convert_to_pdfa(b"%PDF-input", "application/pdf", deadline=time.monotonic() + 0.05)
+
+    assert pdf_converter._worker_failures == 0
+
+
+def test_unconverted_pdf_keeps_original_pdf_and_wraps_images() -> None:
+    jpeg = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(jpeg, "JPEG")
+
+    assert unconverted_pdf([(b"%PDF-original", "application/pdf")]) == b"%PDF-original"
+    assert jpeg.getvalue() in unconverted_pdf([(jpeg.getvalue(), "image/jpeg")])
+    combined = unconverted_pdf([(jpeg.getvalue(), "image/jpeg"), (jpeg.getvalue(), "image/jpeg")])
+    assert combined.startswith(b"%PDF-")
+    assert b"/Count 2" in combined
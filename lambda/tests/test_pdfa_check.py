@@ -0,0 +1,57 @@
+"""Tests for pdfa_check module."""
+
+import zlib
+
+from hsa_receipt_archiver.pdfa_check import is_pdfa_2b
+
+OUTPUT_INTENT = b"4 0 obj\n<< /Type /OutputIntent /S /GTS_PDFA1 /DestOutputProfile 5 0 R >>\nendobj\n"
+
+
+def _xmp(part: str = "2", conformance: str = "B", *, as_elements: bool = False) -> bytes:
+    if as_elements:
+        ident = f"<pdfaid:part>{part}</pdfaid:part><pdfaid:conformance>{conformance}</pdfaid:conformance>"
+    else:
+        ident = f'<rdf:Description pdfaid:part="{part}" pdfaid:conformance="{conformance}"/>'
+    return f"3 0 obj\n<< /Type /Metadata /Subtype /XML >>\nstream\n{ident}\nendstream\nendobj\n".encode()
+
+
+def _pdf(*objects: bytes, trailer: bytes = b"<< /Root 1 0 R >>") -> bytes:
+    return b"%PDF-1.7\n" + b"".join(objects) + b"trailer\n" + trailer + b"\n%%EOF\n"
+
+
+def test_pdfa_2b_is_detected() -> None:
+    assert is_pdfa_2b(_pdf(_xmp(), OUTPUT_INTENT))
+
+
+def test_element_form_xmp_and_levels_a_and_u_are_accepted() -> None:
+    assert is_pdfa_2b(_pdf(_xmp(conformance="A", as_elements=True), OUTPUT_INTENT))
+    assert is_pdfa_2b(_pdf(_xmp(conformance="U"), OUTPUT_INTENT))
+
+
+def test_other_parts_are_rejected() -> None:
+    assert not is_pdfa_2b(_pdf(_xmp(part="1"), OUTPUT_INTENT))
+    assert not is_pdfa_2b(_pdf(_xmp(part="3"), OUTPUT_INTENT))
+
+
+def test_missing_identification_or_output_intent_is_rejected() -> None:
+    assert not is_pdfa_2b(_pdf(OUTPUT_INTENT))
+    assert not is_pdfa_2b(_pdf(_xmp()))
+
+
+def test_output_intent_in_compressed_object_stream_is_found() -> None:
+    compressed = zlib.compress(b"4 0 << /Type /OutputIntent /S /GTS_PDFA1 /DestOutputProfile 5 0 R >>")
+    objstm = (
+        b"6 0 obj\n<< /Type /ObjStm /N 1 /First 4 /Filter /FlateDecode /Length %d >>\nstream\n" % len(compressed)
+        + compressed
+        + b"\nendstream\nendobj\n"
+    )
+
+    assert is_pdfa_2b(_pdf(_xmp(), objstm))
+
+
+def test_encrypted_pdf_is_rejected() -> None:
+    assert not is_pdfa_2b(_pdf(_xmp(), OUTPUT_INTENT, trailer=b"<< /Root 1 0 R /Encrypt 7 0 R >>"))
+
+
+def test_non_pdf_is_rejected() -> None:
+    assert not is_pdfa_2b(b"\xff\xd8\xff" + _xmp() + OUTPUT_INTENT)
@@ -0,0 +1,141 @@
+"""Tests for pdfa_upgrade module."""
+
+import json
+import time
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from hsa_receipt_archiver import pdfa_upgrade
+from hsa_receipt_archiver.ledger_manager import Ledger, LedgerEntry, add_ledger_entries
+from hsa_receipt_archiver.pdf_converter import ConversionTimeoutError
+from hsa_receipt_archiver.pdfa_upgrade import (
+    ABANDONED_NOTE,
+    PENDING_NOTE,
+    PENDING_PREFIX,
+    mark_pending,
+    upgrade_pending,
+)
+from tests.conftest import FakeS3
+
+RECEIPT_KEY = "receipts/2025/2025-01-15_Dr_Smith_Medical.pdf"
+RECEIPT_URI = f"s3://bucket/{RECEIPT_KEY}"
+PARTITION_KEY = "ledger/2025.csv"
+
+
+def _pending_ledger() -> bytes:
+    """A 2025 partition with the pending receipt's row and an unrelated row."""
+    entries = [
+        LedgerEntry(date(2025, 1, 15), None, "Dr Smith", "Medical", "Visit", 30.0, RECEIPT_URI, PENDING_NOTE),
+        LedgerEntry(date(2025, 2, 1), None, "Pharmacy", "Pharmacy", "Rx", 10.0, "s3://bucket/other.pdf", "Keep"),
+    ]
+    return add_ledger_entries(None, entries).encode()
+
+
+def _notes(fake_s3: FakeS3) -> dict[str, str]:
+    return {row.receipt_s3_uri: row.notes for row in Ledger(fake_s3.objects[PARTITION_KEY].decode())}
+
+
+def test_mark_pending_writes_marker_for_receipt_key(fake_s3: FakeS3) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+
+    marker = json.loads(fake_s3.objects[f"{PENDING_PREFIX}{RECEIPT_KEY}"])
+    assert marker["receipt_key"] == RECEIPT_KEY
+    assert "queued_at" in marker
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa", return_value=b"%PDF-pdfa")
+def test_upgrade_pending_overwrites_receipt_and_clears_marker(mock_convert: MagicMock, fake_s3: FakeS3) -> None:
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    fake_s3.objects[PARTITION_KEY] = _pending_ledger()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        assert upgrade_pending("bucket") == (1, 0)
+
+    mock_convert.assert_called_once()
+    assert sorted(fake_s3.objects) == [PARTITION_KEY, RECEIPT_KEY]
+    assert fake_s3.objects[RECEIPT_KEY] == b"%PDF-pdfa"
+    assert _notes(fake_s3) == {RECEIPT_URI: "", "s3://bucket/other.pdf": "Keep"}
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa", side_effect=ConversionTimeoutError("slow"))
+def test_upgrade_pending_keeps_marker_when_conversion_fails(mock_convert: MagicMock, fake_s3: FakeS3) -> None:
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        assert upgrade_pending("bucket") == (0, 1)
+
+    assert fake_s3.objects[RECEIPT_KEY] == b"%PDF-plain"
+    assert json.loads(fake_s3.objects[f"{PENDING_PREFIX}{RECEIPT_KEY}"])["attempts"] == 1
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.notify_failure")
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa", side_effect=ConversionTimeoutError("slow"))
+def test_upgrade_pending_gives_up_after_max_attempts(
+    mock_convert: MagicMock, mock_notify: MagicMock, fake_s3: FakeS3
+) -> None:
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    fake_s3.objects[PARTITION_KEY] = _pending_ledger()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        for _ in range(pdfa_upgrade.PDFA_UPGRADE_MAX_ATTEMPTS - 1):
+            assert upgrade_pending("bucket") == (0, 1)
+        mock_notify.assert_not_called()
+        assert upgrade_pending("bucket") == (0, 0)
+
+    assert mock_convert.call_count == pdfa_upgrade.PDFA_UPGRADE_MAX_ATTEMPTS
+    mock_notify.assert_called_once()
+    assert RECEIPT_KEY in mock_notify.call_args.args[0]
+    assert sorted(fake_s3.objects) == [PARTITION_KEY, RECEIPT_KEY]
+    assert fake_s3.objects[RECEIPT_KEY] == b"%PDF-plain"
+    assert _notes(fake_s3) == {RECEIPT_URI: ABANDONED_NOTE, "s3://bucket/other.pdf": "Keep"}
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.notify_failure")
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa")
+def test_upgrade_pending_drops_receipt_whose_attempts_are_used_up(
+    mock_convert: MagicMock, mock_notify: MagicMock, fake_s3: FakeS3
+) -> None:
+    # A run that died mid-conversion has still counted its attempt.
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    marker = {"receipt_key": RECEIPT_KEY, "attempts": pdfa_upgrade.PDFA_UPGRADE_MAX_ATTEMPTS}
+    fake_s3.objects[f"{PENDING_PREFIX}{RECEIPT_KEY}"] = json.dumps(marker).encode()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        assert upgrade_pending("bucket") == (0, 0)
+
+    mock_convert.assert_not_called()
+    mock_notify.assert_called_once()
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa", return_value=b"%PDF-pdfa")
+def test_upgrade_pending_caps_each_receipt_at_its_own_timeout(mock_convert: MagicMock, fake_s3: FakeS3) -> None:
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    fake_s3.objects[PARTITION_KEY] = _pending_ledger()
+    run_deadline = time.monotonic() + 3600
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        upgrade_pending("bucket", run_deadline)
+
+    receipt_deadline = mock_convert.call_args.args[2]
+    assert receipt_deadline <= time.monotonic() + pdfa_upgrade.PDFA_UPGRADE_RECEIPT_SECONDS
+    assert receipt_deadline < run_deadline
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa")
+def test_upgrade_pending_drops_marker_for_missing_receipt(mock_convert: MagicMock, fake_s3: FakeS3) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        assert upgrade_pending("bucket") == (0, 0)
+
+    mock_convert.assert_not_called()
+    assert fake_s3.objects == {}
+
+
+@patch("hsa_receipt_archiver.pdfa_upgrade.convert_to_pdfa")
+def test_upgrade_pending_stops_at_deadline(mock_convert: MagicMock, fake_s3: FakeS3) -> None:
+    fake_s3.objects[RECEIPT_KEY] = b"%PDF-plain"
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        mark_pending("bucket", RECEIPT_URI, ["2025"])
+        assert upgrade_pending("bucket", time.monotonic() - 1) == (0, 1)
+
+    mock_convert.assert_not_called()
@@ -0,0 +1,50 @@
+"""Tests for pending_ledger module."""
+
+from unittest.mock import patch
+
+from hsa_receipt_archiver.ledger_manager import Ledger, LedgerEntry, add_ledger_entries
+from hsa_receipt_archiver.pending_ledger import PENDING_PREFIX, queue_ledger_entries, replay_ledger_entries
+from tests.conftest import FakeS3
+
+PARTITION_KEY = "ledger/2025.csv"
+
+
+def _rows(fake_s3: FakeS3, key: str = PARTITION_KEY) -> list[tuple[str, str]]:
+    return [(row.receipt_s3_uri, row.description) for row in Ledger(fake_s3.objects[key].decode())]
+
+
+def test_replay_adds_queued_entries_and_clears_markers(
+    fake_s3: FakeS3, sample_ledger_entry: LedgerEntry, ledger_entry_no_dates: LedgerEntry
+) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        queue_ledger_entries("bucket", "2025", [sample_ledger_entry], "raw-emails/msg-1")
+        queue_ledger_entries("bucket", "undated", [ledger_entry_no_dates], "raw-emails/msg-1")
+        assert replay_ledger_entries("bucket") == (2, 0)
+
+    assert _rows(fake_s3) == [(sample_ledger_entry.receipt_s3_uri, "Office visit copay")]
+    assert _rows(fake_s3, "ledger/undated.csv") == [(ledger_entry_no_dates.receipt_s3_uri, "Unknown receipt")]
+    assert not [key for key in fake_s3.objects if key.startswith(PENDING_PREFIX)]
+    replayed = Ledger(fake_s3.objects[PARTITION_KEY].decode()).rows[0]
+    assert (replayed.service_date, replayed.payment_date) == (
+        sample_ledger_entry.service_date,
+        sample_ledger_entry.payment_date,
+    )
+
+
+def test_replay_skips_receipts_already_in_the_partition(fake_s3: FakeS3, sample_ledger_entry: LedgerEntry) -> None:
+    fake_s3.objects[PARTITION_KEY] = add_ledger_entries(None, [sample_ledger_entry]).encode()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        queue_ledger_entries("bucket", "2025", [sample_ledger_entry], "raw-emails/msg-1")
+        assert replay_ledger_entries("bucket") == (1, 0)
+
+    assert len(_rows(fake_s3)) == 1
+
+
+def test_failed_replay_stays_queued(fake_s3: FakeS3, sample_ledger_entry: LedgerEntry) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        queue_ledger_entries("bucket", "2025", [sample_ledger_entry], "raw-emails/msg-1")
+        with patch("hsa_receipt_archiver.pending_ledger.update_ledger", side_effect=RuntimeError("S3 down")):
+            assert replay_ledger_entries("bucket") == (0, 1)
+        assert replay_ledger_entries("bucket") == (1, 0)
+
+    assert len(_rows(fake_s3)) == 1
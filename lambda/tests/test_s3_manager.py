@@ -1,19 +1,35 @@
 """Tests for s3_manager module."""
 
+import csv
+import io
+from collections.abc import Callable
 from unittest.mock import MagicMock, patch
 
 import pytest
 from botocore.exceptions import ClientError
 
+from hsa_receipt_archiver.ledger_manager import HEADERS
 from hsa_receipt_archiver.s3_manager import (
+    LEDGER_KEY,
+    LEDGER_MAX_ATTEMPTS,
+    LedgerConflictError,
+    MergedLedgerEditedError,
     _key_exists,
     _sanitize,
+    delete_object,
     fetch_ledger,
     fetch_raw_email,
-    store_ledger,
+    is_raw_email_processed,
+    ledger_partition_key,
+    list_keys,
+    rebuild_merged_ledger,
     store_receipt,
     tag_raw_email,
+    update_ledger,
 )
+from tests.conftest import FakeS3
+
+HEADER_ROW = ",".join(HEADERS) + "\n"
 
 
 @patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
@@ -81,17 +97,6 @@ def test_fetch_ledger_raises_other_client_errors(mock_s3: MagicMock) -> None:
         fetch_ledger("bucket")
 
 
-@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
-def test_store_ledger_encodes_utf8(mock_s3: MagicMock) -> None:
-    store_ledger("bucket", "csv-content")
-    mock_s3.put_object.assert_called_once_with(
-        Bucket="bucket",
-        Key="ledger/hsa-receipts.csv",
-        Body=b"csv-content",
-        ContentType="text/csv",
-    )
-
-
 @patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
 def test_tag_raw_email_sets_processed_tag(mock_s3: MagicMock) -> None:
     tag_raw_email("bucket", "raw-emails/msg-123")
@@ -102,6 +107,16 @@ def test_tag_raw_email_sets_processed_tag(mock_s3: MagicMock) -> None:
     )
 
 
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_is_raw_email_processed_reads_status_tag(mock_s3: MagicMock) -> None:
+    mock_s3.get_object_tagging.return_value = {"TagSet": [{"Key": "status", "Value": "processed"}]}
+    assert is_raw_email_processed("bucket", "raw-emails/msg-123")
+    mock_s3.get_object_tagging.assert_called_once_with(Bucket="bucket", Key="raw-emails/msg-123")
+
+    mock_s3.get_object_tagging.return_value = {"TagSet": []}
+    assert not is_raw_email_processed("bucket", "raw-emails/msg-123")
+
+
 @patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
 def test_key_exists_returns_true_when_exists(mock_s3: MagicMock) -> None:
     mock_s3.head_object.return_value = {}
@@ -128,3 +143,214 @@ def test_sanitize_strips_leading_trailing_underscores() -> None:
 
 def test_sanitize_collapses_multiple_special_chars() -> None:
     assert _sanitize("a!!!b") == "a_b"
+
+
+@patch("hsa_receipt_archiver.s3_manager._key_exists", return_value=False)
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_store_receipt_retries_next_name_when_conditional_put_loses_race(
+    mock_s3: MagicMock, mock_exists: MagicMock
+) -> None:
+    mock_exists.side_effect = [False, True, False]
+    mock_s3.put_object.side_effect = [
+        ClientError({"Error": {"Code": "PreconditionFailed", "Message": ""}}, "PutObject"),
+        {},
+    ]
+    uri = store_receipt("bucket", b"pdf-data", "2025-01-15", "Dr Smith", "Medical")
+    assert uri == "s3://bucket/receipts/2025/2025-01-15_Dr_Smith_Medical_2.pdf"
+    assert mock_s3.put_object.call_args.kwargs["IfNoneMatch"] == "*"
+
+
+PARTITION_KEY = "ledger/2025.csv"
+
+
+def _append_row(row: str) -> Callable[[str | None], str]:
+    def _merge(ledger_csv: str | None) -> str:
+        return (ledger_csv or "header\n") + f"{row}\n"
+
+    return _merge
+
+
+def test_update_ledger_creates_missing_ledger(fake_s3: FakeS3) -> None:
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        result = update_ledger("bucket", "2025", _append_row("a"))
+
+    assert result == "header\na\n"
+    assert fake_s3.objects[PARTITION_KEY] == b"header\na\n"
+
+
+def test_update_ledger_remerges_after_conflicting_writer(fake_s3: FakeS3) -> None:
+    fake_s3.objects[PARTITION_KEY] = b"header\n"
+
+    def _competing_writer(s3: FakeS3, key: str) -> None:
+        # Another invocation sneaks its row in between our fetch and our put, once.
+        if s3.put_attempts == 1:
+            s3.objects[key] += b"theirs\n"
+
+    fake_s3.before_put = _competing_writer
+    with (
+        patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3),
+        patch("hsa_receipt_archiver.s3_manager.time.sleep"),
+    ):
+        update_ledger("bucket", "2025", _append_row("ours"))
+
+    assert fake_s3.objects[PARTITION_KEY] == b"header\ntheirs\nours\n"
+    assert fake_s3.put_attempts == 2
+
+
+def test_update_ledger_conflict_when_racing_to_create(fake_s3: FakeS3) -> None:
+    def _competing_creator(s3: FakeS3, key: str) -> None:
+        if s3.put_attempts == 1:
+            s3.objects[key] = b"header\ntheirs\n"
+
+    fake_s3.before_put = _competing_creator
+    with (
+        patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3),
+        patch("hsa_receipt_archiver.s3_manager.time.sleep"),
+    ):
+        update_ledger("bucket", "2025", _append_row("ours"))
+
+    assert fake_s3.objects[PARTITION_KEY] == b"header\ntheirs\nours\n"
+
+
+def test_update_ledger_gives_up_after_max_attempts(fake_s3: FakeS3) -> None:
+    fake_s3.objects[PARTITION_KEY] = b"header\n"
+
+    def _always_wins(s3: FakeS3, key: str) -> None:
+        s3.objects[key] += b"theirs\n"
+
+    fake_s3.before_put = _always_wins
+    with (
+        patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3),
+        patch("hsa_receipt_archiver.s3_manager.time.sleep") as mock_sleep,
+        pytest.raises(LedgerConflictError),
+    ):
+        update_ledger("bucket", "2025", _append_row("ours"))
+
+    assert fake_s3.put_attempts == LEDGER_MAX_ATTEMPTS
+    # No backoff after the final attempt, since nothing follows it.
+    assert mock_sleep.call_count == LEDGER_MAX_ATTEMPTS - 1
+    assert b"ours" not in fake_s3.objects[PARTITION_KEY]
+
+
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_update_ledger_raises_other_client_errors(mock_s3: MagicMock) -> None:
+    mock_s3.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey", "Message": ""}}, "GetObject")
+    mock_s3.put_object.side_effect = ClientError({"Error": {"Code": "AccessDenied", "Message": ""}}, "PutObject")
+    with pytest.raises(ClientError):
+        update_ledger("bucket", "2025", _append_row("ours"))
+    mock_s3.put_object.assert_called_once()
+
+
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_fetch_ledger_partition_reads_partition_key(mock_s3: MagicMock) -> None:
+    mock_body = MagicMock()
+    mock_body.read.return_value = b"h\n"
+    mock_s3.get_object.return_value = {"Body": mock_body}
+
+    fetch_ledger("bucket", "2025")
+    mock_s3.get_object.assert_called_once_with(Bucket="bucket", Key="ledger/2025.csv")
+
+
+def test_ledger_partition_key() -> None:
+    assert ledger_partition_key("2025") == "ledger/2025.csv"
+    assert ledger_partition_key("undated") == "ledger/undated.csv"
+
+
+def test_update_ledger_seeds_new_partition_from_merged_view(fake_s3: FakeS3) -> None:
+    fake_s3.objects[LEDGER_KEY] = (
+        HEADER_ROW + "2024-03-01,,Old,Medical,Visit,10.00,s3://b/1.pdf,Yes,,\n"
+        "2025-02-01,,Legacy,Medical,Visit,20.00,s3://b/2.pdf,No,,\n"
+    ).encode()
+
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        update_ledger("bucket", "2025", _append_row("new"))
+
+    partition = fake_s3.objects[PARTITION_KEY].decode()
+    assert "Legacy" in partition
+    assert "Old" not in partition
+    assert partition.endswith("new\n")
+
+
+def test_rebuild_merged_ledger_moves_legacy_years_into_partitions(fake_s3: FakeS3) -> None:
+    fake_s3.objects[LEDGER_KEY] = (
+        HEADER_ROW + "2024-03-01,,Old,Medical,Visit,10.00,s3://b/1.pdf,Yes,,\n"
+        "2025-02-01,,Stale,Medical,Visit,20.00,s3://b/2.pdf,No,,\n"
+    ).encode()
+    fake_s3.objects["ledger/2025.csv"] = (
+        HEADER_ROW + "2025-02-01,,Fresh,Medical,Visit,20.00,s3://b/2.pdf,No,,\n"
+    ).encode()
+    fake_s3.objects["ledger/2026.csv"] = (
+        HEADER_ROW + "2026-01-05,,Newest,Dental,Cleaning,5.00,s3://b/3.pdf,No,,\n"
+    ).encode()
+
+    legacy = fake_s3.objects[LEDGER_KEY]
+
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        # The pre-partitioning ledger carries no hash, so it counts as hand-edited and is kept,
+        # but the year without a partition is copied into one first.
+        with pytest.raises(MergedLedgerEditedError):
+            rebuild_merged_ledger("bucket")
+        assert fake_s3.objects[LEDGER_KEY] == legacy
+        assert b"Old" in fake_s3.objects["ledger/2024.csv"]
+
+        fake_s3.delete_object(Bucket="bucket", Key=LEDGER_KEY)
+        merged = rebuild_merged_ledger("bucket")
+
+    rows = list(csv.reader(io.StringIO(merged)))
+    assert rows[0] == HEADERS
+    assert [row[2] for row in rows[1:]] == ["Old", "Fresh", "Newest"]
+    assert fake_s3.objects[LEDGER_KEY] == merged.encode()
+
+
+def test_rebuild_merged_ledger_refuses_to_overwrite_edited_view(fake_s3: FakeS3) -> None:
+    fake_s3.objects["ledger/2025.csv"] = (
+        HEADER_ROW + "2025-02-01,,Fresh,Medical,Visit,20.00,s3://b/2.pdf,No,,\n"
+    ).encode()
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        merged = rebuild_merged_ledger("bucket")
+        rebuild_merged_ledger("bucket")
+
+        edited = merged.replace(",No,", ",Yes,").encode()
+        fake_s3.objects[LEDGER_KEY] = edited
+        with pytest.raises(MergedLedgerEditedError):
+            rebuild_merged_ledger("bucket")
+
+    assert fake_s3.objects[LEDGER_KEY] == edited
+
+
+def test_rebuild_merged_ledger_write_is_conditional_on_view(fake_s3: FakeS3) -> None:
+    fake_s3.objects["ledger/2025.csv"] = (
+        HEADER_ROW + "2025-02-01,,Fresh,Medical,Visit,20.00,s3://b/2.pdf,No,,\n"
+    ).encode()
+    edited = b"edited by hand mid-rebuild"
+
+    def _edit_view(s3: FakeS3, key: str) -> None:
+        if key == LEDGER_KEY:
+            s3.objects[LEDGER_KEY] = edited
+            s3.before_put = None
+
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        rebuild_merged_ledger("bucket")
+        fake_s3.before_put = _edit_view
+        with pytest.raises(MergedLedgerEditedError):
+            rebuild_merged_ledger("bucket")
+
+    assert fake_s3.objects[LEDGER_KEY] == edited
+
+
+@patch("hsa_receipt_archiver.s3_manager.S3_CLIENT")
+def test_list_keys_follows_continuation_tokens(mock_s3: MagicMock) -> None:
+    mock_s3.list_objects_v2.side_effect = [
+        {"Contents": [{"Key": "p/a"}], "IsTruncated": True, "NextContinuationToken": "t1"},
+        {"Contents": [{"Key": "p/b"}], "IsTruncated": False},
+    ]
+
+    assert list_keys("bucket", "p/") == ["p/a", "p/b"]
+    assert mock_s3.list_objects_v2.call_args_list[1].kwargs["ContinuationToken"] == "t1"
+
+
+def test_delete_object_removes_key(fake_s3: FakeS3) -> None:
+    fake_s3.objects["a"] = b"x"
+    with patch("hsa_receipt_archiver.s3_manager.S3_CLIENT", fake_s3):
+        delete_object("bucket", "a")
+    assert "a" not in fake_s3.objects
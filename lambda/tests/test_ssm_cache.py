@@ -0,0 +1,78 @@
+"""Tests for ssm_cache module."""
+
+import threading
+import time
+from collections.abc import Iterator
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hsa_receipt_archiver import ssm_cache
+from hsa_receipt_archiver.ssm_cache import _Entry, get_parameter
+
+
+def _response(**values: str) -> dict:
+    return {"Parameters": [{"Name": name, "Value": value} for name, value in values.items()], "InvalidParameters": []}
+
+
+@pytest.fixture
+def mock_ssm() -> Iterator[MagicMock]:
+    ssm_cache._entries.clear()
+    with patch.object(ssm_cache, "SSM_CLIENT") as client:
+        yield client
+    ssm_cache._entries.clear()
+
+
+def _age(name: str, value: str, seconds: float) -> None:
+    ssm_cache._entries[name] = _Entry(value, time.monotonic() - seconds)
+
+
+def _join_refresh() -> None:
+    for thread in threading.enumerate():
+        if thread.name == "ssm-refresh":
+            thread.join()
+
+
+def test_first_lookup_fetches_whole_batch_in_one_call(mock_ssm: MagicMock) -> None:
+    mock_ssm.get_parameters.return_value = _response(a="1", b="2")
+
+    assert get_parameter("a", batch=("a", "b")) == "1"
+    assert get_parameter("b", batch=("a", "b")) == "2"
+
+    mock_ssm.get_parameters.assert_called_once_with(Names=["a", "b"], WithDecryption=True)
+
+
+def test_stale_value_is_served_while_refreshing_in_background(mock_ssm: MagicMock) -> None:
+    _age("a", "old", ssm_cache.SSM_CACHE_TTL_SECONDS + 1)
+    mock_ssm.get_parameters.return_value = _response(a="new")
+
+    assert get_parameter("a") == "old"
+    _join_refresh()
+    assert get_parameter("a") == "new"
+    mock_ssm.get_parameters.assert_called_once()
+
+
+def test_value_past_max_staleness_is_fetched_synchronously(mock_ssm: MagicMock) -> None:
+    _age("a", "old", ssm_cache.SSM_CACHE_TTL_SECONDS + ssm_cache.SSM_CACHE_MAX_STALE_SECONDS + 1)
+    mock_ssm.get_parameters.return_value = _response(a="new")
+
+    assert get_parameter("a") == "new"
+
+
+def test_failed_background_refresh_keeps_serving_cached_value(mock_ssm: MagicMock) -> None:
+    _age("a", "old", ssm_cache.SSM_CACHE_TTL_SECONDS + 1)
+    mock_ssm.get_parameters.side_effect = RuntimeError("throttled")
+
+    assert get_parameter("a") == "old"
+    _join_refresh()
+    # Still stale, so the next lookup tries again.
+    assert get_parameter("a") == "old"
+    _join_refresh()
+    assert mock_ssm.get_parameters.call_count == 2
+
+
+def test_missing_parameter_raises(mock_ssm: MagicMock) -> None:
+    mock_ssm.get_parameters.return_value = {"Parameters": [], "InvalidParameters": ["a"]}
+
+    with pytest.raises(KeyError, match="a"):
+        get_parameter("a")